@@ -1,5 +1,7 @@
 import os
-import joblib
+# Disk cache for numba functions declared with cache=True (must be set before umap/hdbscan import numba).
+# UMAP's transform kernels are not among them and are compiled by the warmup below in every process.
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".numba_cache"))
 from flask import Flask, render_template, request, redirect,jsonify, Response
 from dotenv import load_dotenv
 from generate import generate_prompt
@@ -10,11 +12,17 @@ from generate import generate_prompt
 from flask import Flask
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
-import pandas as pd
-import numpy as np
 from generate import generate_prompt_from_persona
-import requests 
 from pathlib import Path  
+from model_registry import load_inference_bundle
+from features import engineer_features, encode_features
+from warmup import start_warmup, WARMUP_STATE
+from assignment import select_assigner
+from cluster_pool import ClusterPool
+import upload_cache
+from job_store import create_job, get_job, update_job, start_stage, mark_stages, append_job_result, finish_job, recover_jobs, evict_jobs
+from concurrent.futures import ThreadPoolExecutor
+import json
 
 """
 ==========================
@@ -28,6 +36,8 @@ ROUTE SUMMARY (Flask API)
 2. /upload-excel (POST)
    - Purpose: Uploads Excel file, performs clustering, and generates default persona + content per cluster
    - Used on: Upload Page (after uploading customer dataset)
+   - ?async=1 answers 202 with a job id and runs the upload in the background
+   - ?stream=1 streams NDJSON: a header record, then one record per cluster as its content is generated
 
 3. /generate-post (POST)
    - Purpose: Regenerates content for a selected cluster using its members and campaign inputs
@@ -40,10 +50,17 @@ ROUTE SUMMARY (Flask API)
 5. /api/proxy-download (POST)
    - Purpose: Securely downloads generated image from external storage via backend proxy
    - Used on: Results Page (when user clicks "Download Image")
+
+6. /ready (GET)
+   - Purpose: Readiness probe; 200 once models are loaded and warmed up, 503 before that
+   - Used by: load balancer / container orchestrator health checks
+
+7. /jobs/<job_id> (GET)
+   - Purpose: Status, stage progress and per-cluster results so far of an /upload-excel?async=1 job
+   - Used on: Upload Page (polling after an async upload)
 """
 app = Flask(__name__)
 CORS(app)  # This allows all origins
-print(app.url_map)
 
 # Load .env from this folder
 dotenv_path = Path(__file__).parent / ".env"
@@ -56,13 +73,36 @@ if not OPENAI_API_KEY:
 # Load Gemini key
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
-# Load models
+# Load the slim inference bundle of the live model version through the registry
+# (always one complete version, see model_registry.py and inference_bundle.py)
 BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "retraining_scripts")
-clusterer = joblib.load(os.path.join(BASE_DIR, 'production_models', 'HDBSCAN_cluster_model.pkl'))
-encoder = joblib.load(os.path.join(BASE_DIR, 'production_models', 'encoder.pkl'))
-scaler = joblib.load(os.path.join(BASE_DIR, 'production_models', 'scaler.pkl'))
-umap_model = joblib.load(os.path.join(BASE_DIR, 'production_models', 'umap_model.pkl'))
-cluster_personas = joblib.load(os.path.join(BASE_DIR, 'production_models', 'cluster_personas.pkl'))
+models = load_inference_bundle()
+MODEL_VERSION = models['version']
+clusterer = models['clusterer']
+encoder = models['encoder']
+scaler = models['scaler']
+umap_model = models['umap_model']
+cluster_personas = models['cluster_personas']
+# Compiled single-row encoder for get_cluster_label (None if it could not be verified, see features.py)
+row_encoder = models['row_encoder']
+print(f"📦 Loaded model version {MODEL_VERSION}")
+
+# Cluster assignment engine per route: "hdbscan" (UMAP + approximate_predict), "knn" or "surrogate"
+# (assignment.py). Falls back to hdbscan when the model has no such assigner or the surrogate's
+# held-out fidelity is below SURROGATE_MIN_FIDELITY.
+ASSIGNMENT_ENGINES, ASSIGNERS = {}, {}
+for route in ("generate-promo", "upload-excel"):
+    ASSIGNMENT_ENGINES[route], ASSIGNERS[route] = select_assigner(route, models)
+print(f"🧭 Cluster assignment engines: {ASSIGNMENT_ENGINES}")
+
+# Worker processes that run the clustering stage of /upload-excel off the request threads (cluster_pool.py).
+# Started before the warmup thread; gunicorn.conf.py defers it to each worker (CLUSTER_POOL_START).
+cluster_pool = ClusterPool(models, ASSIGNERS["upload-excel"])
+if os.getenv("CLUSTER_POOL_START", "import") == "import":
+    cluster_pool.start()
+
+# Run one synthetic prediction so numba compilation happens before the first real request
+start_warmup(models, os.getenv("MODEL_WARMUP", "sync"))
 
 month_name_to_int = {
     "January": 1, "February": 2, "March": 3, "April": 4,
@@ -105,8 +145,9 @@ def generate_promo():
                 scaler=scaler,
                 umap_model=umap_model,
                 cluster_personas=cluster_personas,
-                api_key=OPENAI_API_KEY
-
+                api_key=OPENAI_API_KEY,
+                row_encoder=row_encoder,
+                assigner=ASSIGNERS["generate-promo"]
             )
         else:
             # For Text or Both, generate both prompt and text
@@ -117,7 +158,9 @@ def generate_promo():
                 scaler=scaler,
                 umap_model=umap_model,
                 cluster_personas=cluster_personas,
-                api_key=OPENAI_API_KEY
+                api_key=OPENAI_API_KEY,
+                row_encoder=row_encoder,
+                assigner=ASSIGNERS["generate-promo"]
             )
 
         # Build the response based on the type of content requested
@@ -156,7 +199,234 @@ def generate_promo():
      # Handle unexpected errors
     except Exception as e:
         return jsonify({'error': str(e)}), 400
-# Route to handle customer Excel file uploads, perform clustering, and generate personas with AI content
+
+
+# Stages of one /upload-excel run, reported by ?async=1 jobs (GET /jobs/<job_id>)
+UPLOAD_STAGES = ["parse", "encode", "cluster", "generate"]
+
+# Background executor for ?async=1 uploads; their state and results go to job_store.py (jobs/ on disk)
+upload_jobs = ThreadPoolExecutor(max_workers=int(os.getenv("UPLOAD_JOB_WORKERS", "2")))
+# Finished upload jobs (and their results) are deleted this many seconds after they last changed
+UPLOAD_JOB_TTL_SECONDS = int(os.getenv("UPLOAD_JOB_TTL_SECONDS", "3600"))
+# Upload jobs left running by a previous server process are reported as interrupted
+recover_jobs("upload")
+
+
+def _no_progress(stage):
+    pass
+
+
+# Parse an uploaded workbook and assign its customers to clusters: (DataFrame with cluster_id, cluster ids).
+# progress(stage) is called as each of UPLOAD_STAGES up to "cluster" starts.
+def cluster_upload(file_path, progress=_no_progress):
+    import pandas as pd  # only uploads need pandas/openpyxl, so it is not imported at startup
+
+    #  Load DataFrame
+    progress("parse")
+    df = pd.read_excel(file_path)
+
+    # Filter relevant columns
+    keep_cols = ['Date Joined', 'Location', 'Gender', 'Loyalty Tier']
+    df = df[keep_cols].copy()
+    print("🧹 Selected columns:", list(df.columns))
+
+    #  Loyalty tier score + join date parts, the same features the model was trained on
+    progress("encode")
+    df_cat, df_num = engineer_features(df)
+
+    #  Encode categoricals, scale numerical, combine into one float32 matrix (see features.py)
+    combined = encode_features(encoder, scaler, df_cat, df_num)
+
+    progress("cluster")
+    #  Assign rows to the trained clusters (same as get_cluster_label; personas are keyed by these ids),
+    #  in a cluster worker process for large uploads
+    clusters = cluster_pool.assign(combined)
+    df['cluster_id'] = clusters
+    return df, clusters
+
+
+# default_post of a cluster whose AI generation failed (such results are not cached)
+FAILED_POST = "⚠️ Failed to generate post."
+
+
+# Persona and AI content of each cluster of cluster_upload()'s result, yielded as soon as it is generated.
+# campaign_inputs: objective, industry, funnel_stage, past_engagement.
+def iter_cluster_results(df, clusters, campaign_inputs):
+    tier_names = {1: "Silver", 2: "Gold", 3: "Platinum"}
+
+    # Utility: Get most common value in a list
+    from collections import Counter
+    def most_common(lst):
+        lst = list(lst)  # ensures it's a plain list
+        return Counter(lst).most_common(1)[0][0] if lst else None
+
+    for cluster_id in sorted(set(clusters)):
+        cluster_data = df[df['cluster_id'] == cluster_id]
+        cluster_rows = cluster_data.to_dict(orient='records')
+
+        # Dynamically build persona from uploaded data
+        persona = {
+            "Top_Gender": most_common(cluster_data["Gender"]),
+            "Top_Locations": cluster_data["Location"].value_counts().head(3).index.tolist(),
+            "Top_Loyalty_Tier": most_common(cluster_data["Loyalty_Tier_Score"]),
+            "Top_Join_Quarter": most_common(cluster_data["Join_Quarter"]),
+            "Top_Join_Years": cluster_data["Join_Year"].value_counts().head(2).index.tolist(),
+            "Top_Join_Months": cluster_data["Join_Month"].value_counts().head(2).index.tolist(),
+        }
+
+        # Convert loyalty score back to label
+        tier_score = persona.get('Top_Loyalty_Tier', 1)
+        loyalty_label = tier_names.get(tier_score, "General")
+
+        #Create persona summary string for prompt
+        persona_summary = (
+            f"{loyalty_label} tier {persona.get('Top_Gender', '').lower()}s "
+            f"from {', '.join(persona.get('Top_Locations', [])[:3])} "
+            f"who joined in Quarter {persona.get('Top_Join_Quarter', '?')} "
+            f"of {persona.get('Top_Join_Years', ['?'])[0]}"
+        )
+         # Generate AI post using persona and campaign inputs
+        try:
+            ai_prompt, generated_post = generate_prompt_from_persona(
+                persona_summary=persona_summary,
+                persona=persona,
+                api_key=OPENAI_API_KEY,
+                **campaign_inputs
+            )
+
+        except Exception as e:
+            print(f"❌ AI generation failed for cluster {cluster_id}: {e}")
+            generated_post = FAILED_POST
+            ai_prompt = "Prompt unavailable due to error."
+
+        # Append cluster result to grouped list
+        cluster_result = {
+            "cluster_id": int(cluster_id),
+            "persona": persona,
+            "persona_summary": persona_summary,
+            "default_post": generated_post,
+            "prompt_used": ai_prompt,
+            "members": cluster_rows,
+            "campaign_inputs": dict(campaign_inputs)
+        }
+        yield cluster_result
+
+
+# Header record of an upload: row count and members per cluster (stored in the upload cache too)
+def _upload_header(df):
+    sizes = df['cluster_id'].value_counts().sort_index()
+    return {
+        "rows": int(len(df)),
+        "cluster_count": int(len(sizes)),
+        "cluster_sizes": {str(cluster_id): int(count) for cluster_id, count in sizes.items()},
+    }
+
+
+# Serialize each cluster result once, as the JSON response would (Flask's JSON provider), and write it
+# to the upload cache as it goes. The entry is kept only if every cluster's post was generated.
+def _cache_results(writer, cluster_results):
+    complete = True
+    try:
+        for cluster_result in cluster_results:
+            complete = complete and cluster_result["default_post"] != FAILED_POST
+            line = app.json.dumps(cluster_result)
+            writer.write(line)
+            yield json.loads(line)
+        if complete:
+            writer.commit()
+    finally:
+        writer.close()
+
+
+# (header, iterator of JSON-ready cluster results) for one uploaded workbook, reusing the upload cache:
+# the same file + model + campaign inputs replays the stored results, the same file with other inputs
+# reuses the stored clustering and only generates the posts (see upload_cache.py).
+# Parsing and clustering happen here; the posts are generated lazily as the iterator is consumed.
+# progress(stage) is called as each of UPLOAD_STAGES that actually runs starts, on_cached(stages) with
+# the stages answered from the cache instead.
+def prepare_upload(file_path, campaign_inputs, progress=_no_progress, on_cached=_no_progress):
+    cluster_key = upload_cache.clustering_key(upload_cache.file_sha256(file_path), MODEL_VERSION,
+                                              ASSIGNMENT_ENGINES["upload-excel"])
+    result_key = upload_cache.results_key(cluster_key, campaign_inputs)
+
+    cached = upload_cache.read_results(result_key)
+    if cached is not None:
+        print("♻️ Upload cache hit: replaying stored cluster results")
+        on_cached(UPLOAD_STAGES)
+        return cached
+
+    df = upload_cache.load_clustering(cluster_key)
+    if df is None:
+        df, _ = cluster_upload(file_path, progress)
+        upload_cache.save_clustering(cluster_key, df)
+    else:
+        print("♻️ Upload cache hit: reusing stored clustering")
+        on_cached(UPLOAD_STAGES[:UPLOAD_STAGES.index("generate")])
+
+    header = _upload_header(df)
+    progress("generate")
+    cluster_results = iter_cluster_results(df, df['cluster_id'].to_numpy(), campaign_inputs)
+    return header, _cache_results(upload_cache.ResultWriter(result_key, header), cluster_results)
+
+
+# Parse, cluster and generate AI content per cluster for one uploaded workbook (JSON-ready results).
+# progress/on_cached as for prepare_upload, on_cluster(result) is called as each cluster is done.
+def process_upload(file_path, campaign_inputs, progress=_no_progress, on_cluster=_no_progress,
+                   on_cached=_no_progress):
+    _, cluster_results = prepare_upload(file_path, campaign_inputs, progress, on_cached)
+    grouped = []
+    for cluster_result in cluster_results:
+        grouped.append(cluster_result)
+        on_cluster(cluster_result)
+
+    print("✅ Successfully grouped clusters.")
+    return grouped
+
+
+# One NDJSON line: the record as Flask's JSON provider serializes it, plus its record type
+def _ndjson(record_type, record):
+    return app.json.dumps({"type": record_type, **record}) + "\n"
+
+
+# Body of /upload-excel?stream=1: a header record with the cluster counts, one "cluster" record per
+# cluster as its content is generated (same fields as the items of the JSON response), then "end".
+# Records are sent and dropped one by one, so the full result list is never held in memory.
+def stream_upload(header, cluster_results):
+    yield _ndjson("header", header)
+    sent = 0
+    try:
+        for cluster_result in cluster_results:
+            yield _ndjson("cluster", cluster_result)
+            sent += 1
+    except Exception as e:
+        # Headers are already sent, so a failure can only be reported in the stream
+        print(f"❌ Exception while streaming clusters: {e}")
+        yield _ndjson("error", {"error": str(e), "clusters_sent": sent})
+        return
+    print(f"✅ Streamed {sent} clusters.")
+    yield _ndjson("end", {"clusters_sent": sent})
+
+
+def run_upload_job(job_id, file_path, campaign_inputs):
+    try:
+        # Stages answered from the upload cache never start, so mark the job running up front
+        update_job(job_id, status="running")
+        grouped = process_upload(
+            file_path, campaign_inputs,
+            progress=lambda stage: start_stage(job_id, stage),
+            on_cluster=lambda result: append_job_result(job_id, "clusters", result),
+            on_cached=lambda stages: mark_stages(job_id, stages, "cached"),
+        )
+        finish_job(job_id, result={"clusters": grouped})
+        print(f"✅ Upload job {job_id} finished with {len(grouped)} clusters")
+    except Exception as e:
+        finish_job(job_id, error=str(e))
+        print(f"❌ Upload job {job_id} failed: {e}")
+
+
+# Route to handle customer Excel file uploads, perform clustering, and generate personas with AI content.
+# With ?async=1 it answers 202 with a job id straight away and runs in the background (poll /jobs/<job_id>);
+# with ?stream=1 it streams one NDJSON record per cluster as each is generated (see stream_upload).
 @app.route('/upload-excel', methods=['POST'])
 def upload_excel():
     try:
@@ -175,126 +445,51 @@ def upload_excel():
         print(f" File saved to {file_path}")
 
         # Get additional campaign inputs from form
-        objective = request.form.get('objective', '')
-        industry = request.form.get('industry', '')
-        funnel_stage = request.form.get('funnelStage', '')
-        past_engagement = request.form.get('pastEngagement', '')
-
-        #  Load DataFrame
-        df = pd.read_excel(file_path)
-
-        # Filter relevant columns
-        keep_cols = ['Date Joined', 'Location', 'Gender', 'Loyalty Tier']
-        df = df[keep_cols]
-        print("🧹 Selected columns:", list(df.columns))
-
-        # Ordinal encode loyalty tier for numerical clustering
-        df['Loyalty_Tier_Score'] = df['Loyalty Tier'].map({
-            'Silver': 1, 'Gold': 2, 'Platinum': 3
-        })
-
-        #  Extract features from join date
-        df['Join_Year'] = pd.to_datetime(df['Date Joined']).dt.year
-        df['Join_Month'] = pd.to_datetime(df['Date Joined']).dt.month
-        df['Join_Quarter'] = pd.to_datetime(df['Date Joined']).dt.quarter
-
-        categorical_cols = ['Location', 'Gender', 'Join_Year', 'Join_Month', 'Join_Quarter']
-        numerical_cols = ['Loyalty_Tier_Score']
-
-        df_cat = df[categorical_cols]
-        df_num = df[numerical_cols]
-
-        #  Encode categoricals
-        encoded_cat = encoder.transform(df_cat)
-
-        #  Scale numerical
-        scaled_num = scaler.transform(df_num)
-
-        #  Combine all features
-        combined = np.hstack([encoded_cat, scaled_num])
-
-        #  Apply UMAP
-        df_embed = umap_model.transform(combined)
-
-        #  Apply clustering to embedded data
-        clusters = clusterer.fit_predict(df_embed)
-        df['cluster_id'] = clusters
-
-        #  Group by cluster and generate AI content per group
-        grouped = []
-        tier_names = {1: "Silver", 2: "Gold", 3: "Platinum"}
-
-        # Utility: Get most common value in a list
-        from collections import Counter
-        def most_common(lst):
-            lst = list(lst)  # ensures it's a plain list
-            return Counter(lst).most_common(1)[0][0] if lst else None
-
-        for cluster_id in sorted(set(clusters)):
-            cluster_data = df[df['cluster_id'] == cluster_id]
-            cluster_rows = cluster_data.to_dict(orient='records')
-
-            # Dynamically build persona from uploaded data
-            persona = {
-                "Top_Gender": most_common(cluster_data["Gender"]),
-                "Top_Locations": cluster_data["Location"].value_counts().head(3).index.tolist(),
-                "Top_Loyalty_Tier": most_common(cluster_data["Loyalty_Tier_Score"]),
-                "Top_Join_Quarter": most_common(cluster_data["Join_Quarter"]),
-                "Top_Join_Years": cluster_data["Join_Year"].value_counts().head(2).index.tolist(),
-                "Top_Join_Months": cluster_data["Join_Month"].value_counts().head(2).index.tolist(),
-            }
-
-            # Convert loyalty score back to label
-            tier_score = persona.get('Top_Loyalty_Tier', 1)
-            loyalty_label = tier_names.get(tier_score, "General")
-
-            #Create persona summary string for prompt
-            persona_summary = (
-                f"{loyalty_label} tier {persona.get('Top_Gender', '').lower()}s "
-                f"from {', '.join(persona.get('Top_Locations', [])[:3])} "
-                f"who joined in Quarter {persona.get('Top_Join_Quarter', '?')} "
-                f"of {persona.get('Top_Join_Years', ['?'])[0]}"
+        campaign_inputs = {
+            "objective": request.form.get('objective', ''),
+            "industry": request.form.get('industry', ''),
+            "funnel_stage": request.form.get('funnelStage', ''),
+            "past_engagement": request.form.get('pastEngagement', ''),
+        }
+
+        if request.args.get('async', '0').lower() in ('1', 'true'):
+            evict_jobs("upload", UPLOAD_JOB_TTL_SECONDS)
+            job = create_job("upload", params={"file": filename, "campaign_inputs": campaign_inputs},
+                             stages=UPLOAD_STAGES)
+            upload_jobs.submit(run_upload_job, job["id"], file_path, campaign_inputs)
+            return jsonify({
+                "message": "Upload accepted.",
+                "job_id": job["id"],
+                "status_url": f"/jobs/{job['id']}",
+            }), 202
+
+        if request.args.get('stream', '0').lower() in ('1', 'true'):
+            # Parse and cluster before answering, so their errors still get a 500
+            header, cluster_results = prepare_upload(file_path, campaign_inputs)
+            return Response(
+                stream_upload(header, cluster_results),
+                mimetype='application/x-ndjson',
+                headers={'X-Accel-Buffering': 'no', 'Cache-Control': 'no-cache'},
             )
-             # Generate AI post using persona and campaign inputs
-            try:
-                ai_prompt, generated_post = generate_prompt_from_persona(
-                    persona_summary=persona_summary,
-                    persona=persona,
-                    api_key=OPENAI_API_KEY,
-                    objective=objective,
-                    industry=industry,
-                    funnel_stage=funnel_stage,
-                    past_engagement=past_engagement
-                )
-
-            except Exception as e:
-                print(f"❌ AI generation failed for cluster {cluster_id}: {e}")
-                generated_post = "⚠️ Failed to generate post."
-                ai_prompt = "Prompt unavailable due to error."
-
-            # Append cluster result to grouped list
-            grouped.append({
-                "cluster_id": int(cluster_id),
-                "persona": persona,
-                "persona_summary": persona_summary,
-                "default_post": generated_post,
-                "prompt_used": ai_prompt,
-                "members": cluster_rows,
-                "campaign_inputs": {
-                    "objective": objective,
-                    "industry": industry,
-                    "funnel_stage": funnel_stage,
-                    "past_engagement": past_engagement
-                }
-            })
-
-        print("✅ Successfully grouped clusters.")
+
+        grouped = process_upload(file_path, campaign_inputs)
         return jsonify({"clusters": grouped})
 
     except Exception as e:
         print(f"❌ Exception during file processing: {e}")
         return jsonify({'error': str(e)}), 500
-    
+
+
+# Route to poll an ?async=1 upload: status, stage timings and the per-cluster results finished so far
+# ("result": {"clusters": [...]}, complete once status is "succeeded")
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    evict_jobs("upload", UPLOAD_JOB_TTL_SECONDS)
+    job = get_job(job_id)
+    if job is None or job["kind"] != "upload":
+        return jsonify({"error": f"Unknown or expired job: {job_id}"}), 404
+    return jsonify(job), 200
+
 # Route to regenerate content for a specific cluster using uploaded persona and members in upload results page
 @app.route('/generate-post', methods=['POST'])
 def generate_post():
@@ -446,6 +641,7 @@ def proxy_download():
         return jsonify({"error": "Missing 'url' in request body"}), 400
 
     # Make a GET request to the file URL (e.g. Azure Blob SAS)
+    import requests  # only needed by this route
     resp = requests.get(blob_url, stream=True)
     if resp.status_code != 200:
         # Return error response if file could not be retrieved
@@ -465,6 +661,13 @@ def proxy_download():
         content_type=resp.headers.get('Content-Type', 'application/octet-stream')
     )
 
+# Readiness probe: reports model version and warmup state, 503 until warmup has finished
+@app.route('/ready', methods=['GET'])
+def ready():
+    status_code = 200 if WARMUP_STATE["status"] in ("ready", "skipped") else 503
+    # Uploads are assigned inline until the cluster pool is ready, so it does not gate readiness
+    return jsonify({**WARMUP_STATE, "cluster_pool": cluster_pool.status()}), status_code
+
 # Entry point for running the Flask app directly
 # Enables debug mode for development: shows errors and auto-reloads on changes
 if __name__ == "__main__":
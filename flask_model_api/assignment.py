@@ -0,0 +1,346 @@
+import os
+import time
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+"""
+==========================
+CLUSTER ASSIGNMENT (assignment.py)
+==========================
+Serving assigns new customers to the trained clusters with umap_model.transform + HDBSCAN
+approximate_predict ("hdbscan" engine). NeighborAssigner is a cheaper alternative ("knn" engine) that
+works in the encoded feature space (features.encode_features), without UMAP:
+
+    exact lookup   the feature space is discrete (location, gender, join year/month/quarter, tier), so
+                   most rows are an exact copy of some training row. Each distinct training row keeps
+                   the cluster ids of the training rows equal to it; a row found there gets their
+                   majority cluster. fit() finds the distinct rows by their exact bytes, FIT_CHUNK_ROWS
+                   rows at a time (never copying the whole training matrix), and keeps them sorted by a
+                   64-bit row hash, so a batch is looked up with one np.searchsorted (hits are confirmed
+                   bit for bit; a colliding row falls through to the kNN vote).
+    kNN vote       rows not seen in training are looked up in a BallTree over the distinct training rows
+                   (euclidean, like UMAP) and get the majority cluster of their KNN_NEIGHBORS nearest
+                   training rows (each distinct row weighted by how often it occurred).
+
+Either way, a row whose winning cluster has less than MIN_VOTE_SHARE of the votes, or whose winner is
+noise, is assigned -1 (noise), like approximate_predict does for rows outside every cluster.
+
+SurrogateAssigner ("surrogate" engine) is a classifier distilled from the clustering: a linear model
+(or gradient-boosted trees, SURROGATE_MODEL) trained on the encoded rows to predict their HDBSCAN label.
+It is fitted on (1 - SURROGATE_HOLDOUT) of at most SURROGATE_MAX_ROWS random training rows, and its
+fidelity is the share of the held-out rest it labels like HDBSCAN did; serving only uses it when that
+clears SURROGATE_MIN_FIDELITY.
+
+run_retraining builds them from the training matrix and final labels when enabled (the kNN assigner is
+opt-in, RETRAIN_CLUSTER_ASSIGNER=1, and so is the surrogate, RETRAIN_SURROGATE=1) and stores them in the inference bundle
+("cluster_assigner", "cluster_surrogate"); compare_engines() and train_surrogate() measure agreement
+with approximate_predict on held-out rows and rows/sec for the retrain report ("assignment", "surrogate").
+
+The engine is picked per route with environment variables (see select_assigner):
+    ASSIGNMENT_ENGINE                 default for every route: hdbscan (default), knn or surrogate
+    ASSIGNMENT_ENGINE_UPLOAD_EXCEL    /upload-excel
+    ASSIGNMENT_ENGINE_GENERATE_PROMO  /generate-promo
+Routes fall back to hdbscan when the model has no such assigner (older versions) or the surrogate's
+fidelity is below SURROGATE_MIN_FIDELITY.
+
+Used in: app.py (select_assigner for /upload-excel, /generate-promo), generate.py (get_cluster_label),
+         cluster_pool.py (assign_clusters), inference_bundle.py, retraining_scripts/retrain_model.py
+"""
+
+ENGINES = ("hdbscan", "knn", "surrogate")
+DEFAULT_ENGINE = os.getenv("ASSIGNMENT_ENGINE", "hdbscan")
+# Model key (inference bundle / load_inference_bundle) holding each engine's assigner
+ENGINE_MODEL_KEYS = {"knn": "cluster_assigner", "surrogate": "cluster_surrogate"}
+
+KNN_NEIGHBORS = int(os.getenv("ASSIGNMENT_KNN_NEIGHBORS", "15"))
+MIN_VOTE_SHARE = float(os.getenv("ASSIGNMENT_MIN_VOTE_SHARE", "0.5"))
+
+SURROGATE_MODEL = os.getenv("SURROGATE_MODEL", "linear")   # linear | boosted
+SURROGATE_HOLDOUT = float(os.getenv("SURROGATE_HOLDOUT", "0.2"))
+SURROGATE_MIN_FIDELITY = float(os.getenv("SURROGATE_MIN_FIDELITY", "0.98"))
+# Training rows the surrogate is fitted and scored on at most (a random subset of larger histories)
+SURROGATE_MAX_ROWS = int(os.getenv("SURROGATE_MAX_ROWS", "200000"))
+
+# Training rows compare_engines() holds out and assigns with both engines
+COMPARE_SAMPLE_ROWS = 2000
+
+# Training rows NeighborAssigner.fit() reads at a time (the training matrix may be a memmap)
+FIT_CHUNK_ROWS = int(os.getenv("ASSIGNMENT_FIT_CHUNK_ROWS", "50000"))
+HASH_CHUNK_ROWS = 8192
+# Bumped when _row_hashes changes, so pickled assigners re-hash their points on load
+HASH_VERSION = 2
+
+
+# "hdbscan", "knn" or "surrogate" for a route name such as "upload-excel"
+def engine_for_route(route):
+    engine = os.getenv(f"ASSIGNMENT_ENGINE_{route.upper().replace('-', '_')}", DEFAULT_ENGINE)
+    if engine not in ENGINES:
+        raise ValueError(f"❌ Unknown assignment engine {engine!r} for {route} (expected one of {ENGINES})")
+    return engine
+
+
+# (engine, assigner) a route should use with these models; assigner None means UMAP + approximate_predict
+def select_assigner(route, models):
+    engine = engine_for_route(route)
+    if engine == "hdbscan":
+        return engine, None
+    assigner = models.get(ENGINE_MODEL_KEYS[engine])
+    if assigner is None:
+        print(f"⚠️ Model {models.get('version')} has no {engine} assigner, /{route} uses hdbscan")
+        return "hdbscan", None
+    if engine == "surrogate" and assigner.fidelity < SURROGATE_MIN_FIDELITY:
+        print(f"⚠️ Surrogate fidelity {assigner.fidelity:.2%} is below {SURROGATE_MIN_FIDELITY:.2%}, "
+              f"/{route} uses hdbscan")
+        return "hdbscan", None
+    return engine, assigner
+
+
+# Cluster id of every encoded row with the route's assigner, or UMAP + approximate_predict when it is None
+def assign_clusters(X, umap_model, clusterer, assigner=None):
+    if assigner is not None:
+        return assigner.assign(X)
+    from hdbscan.prediction import approximate_predict
+    labels, _ = approximate_predict(clusterer, umap_model.transform(X))
+    return labels
+
+
+# 64-bit hash of every row of a float32 matrix (equal rows, equal hash): pandas' hash_array over the
+# rows' bytes, HASH_CHUNK_ROWS rows at a time. It mixes every byte non-linearly, so rows built from the
+# same few values (one-hot 0.0/1.0) still spread over all 64 bits.
+def _row_hashes(X):
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    rows = X.view(_row_bytes(X)).ravel()
+    hashes = np.empty(len(rows), dtype=np.uint64)
+    for start in range(0, len(rows), HASH_CHUNK_ROWS):
+        hashes[start:start + HASH_CHUNK_ROWS] = pd.util.hash_array(rows[start:start + HASH_CHUNK_ROWS])
+    return hashes
+
+
+# dtype viewing each row of a contiguous matrix as one opaque value, so rows compare by their bytes
+def _row_bytes(X):
+    return np.dtype((np.void, X.dtype.itemsize * X.shape[1]))
+
+
+class NeighborAssigner:
+    def __init__(self, n_neighbors=KNN_NEIGHBORS, min_vote_share=MIN_VOTE_SHARE):
+        self.n_neighbors = n_neighbors
+        self.min_vote_share = min_vote_share
+        self.hash_version = HASH_VERSION
+
+    # X: encoded training rows (float32, as UMAP was fitted on; may be a memmap), labels: final cluster id
+    # of every row; rows: sorted indices to fit on (default all). X is read FIT_CHUNK_ROWS rows at a time;
+    # only its distinct rows are kept.
+    def fit(self, X, labels, chunk_rows=FIT_CHUNK_ROWS, rows=None):
+        labels = np.asarray(labels)
+        rows = np.arange(X.shape[0]) if rows is None else np.asarray(rows)
+        self.n_features = X.shape[1]
+        self.classes = np.unique(labels[rows])
+        label_index = np.searchsorted(self.classes, labels[rows])
+
+        points = np.empty((0, self.n_features), dtype=np.float32)
+        votes = np.empty((0, len(self.classes)), dtype=np.int64)
+        for start in range(0, len(rows), chunk_rows):
+            chunk = np.asarray(X[rows[start:start + chunk_rows]], dtype=np.float32)
+            chunk_votes = np.zeros((len(chunk), len(self.classes)), dtype=np.int64)
+            chunk_votes[np.arange(len(chunk)), label_index[start:start + len(chunk)]] = 1
+            # Merge the chunk into the distinct rows seen so far
+            points, votes = self._merge(np.concatenate([points, chunk]), np.concatenate([votes, chunk_votes]))
+
+        # Sorted by hash: assign() finds exact copies with np.searchsorted
+        hashes = _row_hashes(points)
+        order = np.argsort(hashes, kind="stable")
+        self.hashes, self.points = hashes[order], points[order]
+        # votes[i, c]: training rows equal to distinct row i that were labelled classes[c]
+        self.votes = votes[order].astype(np.int32)
+        self.exact_labels = self._decide(self.votes)
+        self.tree = BallTree(self.points)
+        return self
+
+    # Collapse rows with equal bytes into one, adding up their votes
+    @staticmethod
+    def _merge(points, votes):
+        points = np.ascontiguousarray(points)
+        _, first, inverse = np.unique(points.view(_row_bytes(points)).ravel(), return_index=True, return_inverse=True)
+        merged = np.zeros((len(first), votes.shape[1]), dtype=votes.dtype)
+        np.add.at(merged, inverse.ravel(), votes)
+        return points[first], merged
+
+    # Assigners pickled before the hash index kept a dict of row bytes instead, and ones pickled before
+    # the byte hash used a linear one; (re)index their points, which are distinct by bytes in both
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if state.get("hash_version") != HASH_VERSION:
+            hashes = _row_hashes(self.points)
+            order = np.argsort(hashes, kind="stable")
+            self.points, self.votes, self.exact_labels = self.points[order], self.votes[order], self.exact_labels[order]
+            self.hashes = hashes[order]
+            self.hash_version = HASH_VERSION
+            self.__dict__.pop("lookup", None)
+
+    # Winning cluster per row of a vote matrix, -1 when it is noise or below min_vote_share
+    def _decide(self, votes):
+        winner = votes.argmax(axis=1)
+        share = votes[np.arange(len(votes)), winner] / np.maximum(votes.sum(axis=1), 1)
+        labels = self.classes[winner]
+        return np.where(share >= self.min_vote_share, labels, -1)
+
+    # Cluster id of every encoded row; exact_hits (optional list) receives the number of exact matches
+    def assign(self, X, exact_hits=None):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        hashes = _row_hashes(X)
+        position = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        found = self.hashes[position] == hashes
+        # Confirm the bytes, so a hash collision falls through to the kNN vote instead of a wrong row
+        row_bytes = _row_bytes(X)
+        candidates = X if found.all() else X[found]
+        found[found] = (candidates.view(row_bytes) == self.points[position[found]].view(row_bytes)).ravel()
+
+        labels = np.empty(len(X), dtype=self.exact_labels.dtype)
+        labels[found] = self.exact_labels[position[found]]
+        missing = np.flatnonzero(~found)
+        if len(missing):
+            k = min(self.n_neighbors, len(self.points))
+            neighbors = self.tree.query(X[missing], k=k, return_distance=False)
+            labels[missing] = self._decide(self.votes[neighbors].sum(axis=1))
+        if exact_hits is not None:
+            exact_hits.append(int(found.sum()))
+        return labels
+
+
+def build_assigner(X, labels):
+    start = time.perf_counter()
+    assigner = NeighborAssigner().fit(X, labels)
+    print(f"🧭 Built kNN cluster assigner: {len(assigner.points)} distinct of {len(X)} training rows "
+          f"in {time.perf_counter() - start:.2f}s")
+    return assigner
+
+
+# Labels of the hdbscan engine for X and its steady-state rows/sec (UMAP's kernels are compiled first)
+def _hdbscan_assign(umap_model, clusterer, X):
+    from hdbscan.prediction import approximate_predict
+
+    approximate_predict(clusterer, umap_model.transform(X[:1]))
+    start = time.perf_counter()
+    labels, _ = approximate_predict(clusterer, umap_model.transform(X))
+    return labels, round(len(X) / (time.perf_counter() - start), 1)
+
+
+# Agreement of the knn engine with the hdbscan engine (and of both with the training labels), plus rows/sec
+# of each (steady state, same batch for both engines). The served assigner has every training row in its
+# exact lookup, so scoring it on training rows would mostly replay their labels: instead sample_rows
+# random rows are held out, a second NeighborAssigner is fitted on all the other rows, and it is scored
+# on the held-out ones, like train_surrogate() measures fidelity.
+def compare_engines(X, labels, umap_model, clusterer, sample_rows=COMPARE_SAMPLE_ROWS, seed=0):
+    labels = np.asarray(labels)
+    rng = np.random.default_rng(seed)
+    held_out = np.sort(rng.choice(len(X), size=min(sample_rows, len(X) - 1), replace=False))
+    assigner = NeighborAssigner().fit(X, labels, rows=np.setdiff1d(np.arange(len(X)), held_out))
+    X_held_out = np.asarray(X[held_out], dtype=np.float32)
+    train_labels = labels[held_out]
+    hdbscan_labels, hdbscan_rows_per_second = _hdbscan_assign(umap_model, clusterer, X_held_out)
+
+    assigner.assign(X_held_out[:1])
+    exact_hits = []
+    start = time.perf_counter()
+    knn_labels = assigner.assign(X_held_out, exact_hits)
+    knn_seconds = time.perf_counter() - start
+
+    return {
+        "held_out_rows": len(held_out),
+        "agreement": round(float(np.mean(knn_labels == hdbscan_labels)), 4),
+        "agreement_non_noise": round(float(np.mean((knn_labels == hdbscan_labels)[hdbscan_labels != -1])), 4)
+        if np.any(hdbscan_labels != -1) else None,
+        "hdbscan_matches_training": round(float(np.mean(hdbscan_labels == train_labels)), 4),
+        "knn_matches_training": round(float(np.mean(knn_labels == train_labels)), 4),
+        "exact_hit_rate": round(exact_hits[0] / len(held_out), 4),
+        "noise_share": {
+            "hdbscan": round(float(np.mean(hdbscan_labels == -1)), 4),
+            "knn": round(float(np.mean(knn_labels == -1)), 4),
+        },
+        "rows_per_second": {
+            "hdbscan": hdbscan_rows_per_second,
+            "knn": round(len(held_out) / knn_seconds, 1),
+        },
+        "n_neighbors": assigner.n_neighbors,
+        "min_vote_share": assigner.min_vote_share,
+    }
+
+
+class SurrogateAssigner:
+    # model: fitted sklearn classifier; fidelity: share of held-out rows labelled like HDBSCAN
+    def __init__(self, model, fidelity):
+        self.model = model
+        self.fidelity = fidelity
+
+    def assign(self, X):
+        return self.model.predict(np.asarray(X, dtype=np.float32))
+
+
+def _surrogate_model(kind):
+    if kind == "linear":
+        from sklearn.linear_model import LogisticRegression
+        return LogisticRegression(max_iter=1000)
+    if kind == "boosted":
+        from sklearn.ensemble import HistGradientBoostingClassifier
+        return HistGradientBoostingClassifier(random_state=0)
+    raise ValueError(f"❌ Unknown surrogate model {kind!r} (expected linear or boosted)")
+
+
+# Fit a SurrogateAssigner on the encoded rows X and their HDBSCAN labels, holding out SURROGATE_HOLDOUT
+# of the rows (stratified by label when every label has two rows) to measure its fidelity. Only
+# max_rows random rows of X are used, so X (possibly a memmap) is never copied whole.
+# Returns (assigner, report); the report also compares it with approximate_predict on the held-out rows.
+# With fewer than two labels there is nothing to classify: returns (None, {"skipped": ...}).
+def train_surrogate(X, labels, umap_model, clusterer, kind=SURROGATE_MODEL, holdout=SURROGATE_HOLDOUT,
+                    sample_rows=COMPARE_SAMPLE_ROWS, max_rows=SURROGATE_MAX_ROWS, seed=0):
+    from sklearn.model_selection import train_test_split
+
+    labels = np.asarray(labels)
+    if len(np.unique(labels)) < 2:
+        print("⚠️ Clustering has fewer than 2 labels, skipping the surrogate")
+        return None, {"skipped": "fewer than 2 classes"}
+
+    rows = np.arange(len(labels))
+    if len(rows) > max_rows:
+        rows = np.sort(np.random.default_rng(seed).choice(len(rows), size=max_rows, replace=False))
+    stratify = labels[rows] if np.unique(labels[rows], return_counts=True)[1].min() >= 2 else None
+    train_rows, held_out = (np.sort(split) for split in train_test_split(
+        rows, test_size=holdout, random_state=seed, stratify=stratify
+    ))
+    start = time.perf_counter()
+    model = _surrogate_model(kind).fit(np.asarray(X[train_rows], dtype=np.float32), labels[train_rows])
+    fit_seconds = round(time.perf_counter() - start, 3)
+
+    X_held_out = np.asarray(X[held_out], dtype=np.float32)
+    surrogate = SurrogateAssigner(model, fidelity=0.0)
+    predicted = surrogate.assign(X_held_out)
+    surrogate.fidelity = round(float(np.mean(predicted == labels[held_out])), 4)
+
+    # Agreement with what serving would otherwise return, on (a sample of) the held-out rows
+    X_compared = X_held_out[:sample_rows]
+    hdbscan_labels, hdbscan_rows_per_second = _hdbscan_assign(umap_model, clusterer, X_compared)
+    start = time.perf_counter()
+    surrogate_labels = surrogate.assign(X_compared)
+    surrogate_seconds = time.perf_counter() - start
+
+    clusters = [label for label in np.unique(labels[held_out]) if label != -1]
+    recalls = [float(np.mean(predicted[labels[held_out] == label] == label)) for label in clusters]
+    report = {
+        "model": kind,
+        "rows_available": len(labels),
+        "train_rows": len(train_rows),
+        "held_out_rows": len(held_out),
+        "fit_seconds": fit_seconds,
+        "fidelity": surrogate.fidelity,
+        "min_cluster_recall": round(min(recalls), 4) if recalls else None,
+        "agreement_with_approximate_predict": round(float(np.mean(surrogate_labels == hdbscan_labels)), 4),
+        "rows_per_second": {
+            "hdbscan": hdbscan_rows_per_second,
+            "surrogate": round(len(X_compared) / surrogate_seconds, 1),
+        },
+        "min_fidelity": SURROGATE_MIN_FIDELITY,
+        "serving_enabled": surrogate.fidelity >= SURROGATE_MIN_FIDELITY,
+    }
+    print(f"🎓 Surrogate ({kind}) fidelity {surrogate.fidelity:.1%} on {len(held_out)} held-out rows "
+          f"(serving threshold {SURROGATE_MIN_FIDELITY:.0%}), fitted in {fit_seconds}s")
+    return surrogate, report
@@ -0,0 +1,107 @@
+import time
+import json
+import argparse
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from features import engineer_features, make_encoder, encode_features, compile_row_encoder
+"""
+bench_features.py
+
+Memory and time of building the UMAP input matrix, before and after features.py:
+
+    dense_float64   OneHotEncoder(sparse_output=False) + np.hstack, as the code did before; UMAP then
+                    makes its own float32 copy (counted here, it is part of the real cost)
+    sparse_float32  features.encode_features(): CSR one-hot scattered into a float32 matrix
+
+Runs on a synthetic customer table with a configurable number of locations (the one-hot column that
+grows), and also times the one-row transform done per /generate-promo request, including the compiled
+features.RowEncoder that get_cluster_label uses. Peak memory is measured with tracemalloc in a
+separate pass, so it does not slow down the timed runs.
+
+Usage (from flask_model_api):
+    python bench_features.py
+    python bench_features.py --rows 500000 --locations 2000 --runs 5
+"""
+
+
+def synthetic_customers(rows, locations, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "Location": [f"Location {i}" for i in rng.integers(0, locations, rows)],
+        "Gender": rng.choice(["Male", "Female"], rows),
+        "Loyalty Tier": rng.choice(["Silver", "Gold", "Platinum"], rows),
+        "Date Joined": pd.Timestamp("2000-01-01") + pd.to_timedelta(rng.integers(0, 25 * 365, rows), unit="D"),
+    })
+
+
+def dense_float64(encoder, scaler, df_cat, df_num):
+    combined = np.hstack([encoder.transform(df_cat), scaler.transform(df_num)])
+    return np.asarray(combined, dtype=np.float32)  # what UMAP's check_array does with it
+
+
+def sparse_float32(encoder, scaler, df_cat, df_num):
+    return encode_features(encoder, scaler, df_cat, df_num)
+
+
+def best_seconds(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def peak_mb(fn):
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(peak / 1024 / 1024, 1)
+
+
+def run_benchmark(rows, locations, runs):
+    df_cat, df_num = engineer_features(synthetic_customers(rows, locations))
+    scaler = StandardScaler().fit(df_num)
+    paths = {
+        "dense_float64": (dense_float64, OneHotEncoder(handle_unknown='ignore', sparse_output=False).fit(df_cat)),
+        "sparse_float32": (sparse_float32, make_encoder().fit(df_cat)),
+    }
+    one_cat, one_num = df_cat.iloc[:1].values.tolist(), df_num.iloc[:1].values.tolist()
+
+    results = {"rows": rows, "locations": locations}
+    outputs = {}
+    for name, (fn, encoder) in paths.items():
+        outputs[name] = fn(encoder, scaler, df_cat, df_num)
+        results[name] = {
+            "seconds": round(best_seconds(lambda: fn(encoder, scaler, df_cat, df_num), runs), 4),
+            "peak_mb": peak_mb(lambda: fn(encoder, scaler, df_cat, df_num)),
+            "one_row_ms": round(best_seconds(lambda: fn(encoder, scaler, one_cat, one_num), runs * 20) * 1000, 3),
+            "shape": list(outputs[name].shape),
+        }
+    results["identical"] = bool(np.array_equal(outputs["dense_float64"], outputs["sparse_float32"]))
+
+    row_encoder = compile_row_encoder(paths["sparse_float32"][1], scaler)
+    results["row_encoder_one_row_ms"] = round(
+        best_seconds(lambda: row_encoder.encode(one_cat[0], one_num[0]), runs * 20) * 1000, 4
+    )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dense float64 vs sparse/float32 feature building")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--locations", type=int, default=500)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = run_benchmark(args.rows, args.locations, args.runs)
+    print(f"📊 {results['rows']} rows, {results['locations']} locations, "
+          f"{results['dense_float64']['shape'][1]} features (identical output: {results['identical']})")
+    for name in ("dense_float64", "sparse_float32"):
+        r = results[name]
+        print(f"   {name:<15} {r['seconds']:>8}s  peak {r['peak_mb']:>8} MB  one row {r['one_row_ms']} ms")
+    print(f"   {'row_encoder':<15} one row {results['row_encoder_one_row_ms']} ms")
+    print(json.dumps(results))
@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import json
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+from datetime import datetime
+"""
+bench_startup.py
+
+Time-to-ready benchmark for app.py: starts a fresh server process and measures the wall time
+until GET /ready answers 200 (imports + model loading + warmup, see warmup.py).
+
+Each run is a new interpreter, so it includes everything a new gunicorn worker or a freshly
+scaled container pays. Use --record to append the result to startup_benchmark.jsonl so the
+numbers can be compared across commits and model versions.
+
+Usage (from flask_model_api):
+    python bench_startup.py --runs 3
+    python bench_startup.py --runs 5 --record
+"""
+
+HISTORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_benchmark.jsonl")
+
+SERVER_CODE = "import app; app.app.run(host='127.0.0.1', port={port}, use_reloader=False)"
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def time_to_ready(timeout):
+    port = _free_port()
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "bench-only")
+
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-c", SERVER_CODE.format(port=port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError("❌ app.py exited before becoming ready")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=2) as resp:
+                    state = json.load(resp)
+                    return time.perf_counter() - start, state
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.1)
+        raise RuntimeError(f"❌ /ready did not return 200 within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure app.py time-to-ready")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--record", action="store_true", help=f"append the result to {os.path.basename(HISTORY_FILE)}")
+    args = parser.parse_args()
+
+    timings = []
+    state = {}
+    for i in range(args.runs):
+        seconds, state = time_to_ready(args.timeout)
+        timings.append(round(seconds, 3))
+        print(f"⏱️ run {i + 1}: ready after {seconds:.2f}s (warmup first call {state.get('first_call_seconds')}s)")
+
+    result = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": _git_commit(),
+        "model_version": state.get("model_version"),
+        "python": sys.version.split()[0],
+        "runs": timings,
+        "min_seconds": min(timings),
+        "median_seconds": round(statistics.median(timings), 3),
+    }
+    print(f"✅ time-to-ready median {result['median_seconds']}s, min {result['min_seconds']}s")
+
+    if args.record:
+        with open(HISTORY_FILE, "a") as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"📝 Recorded in {HISTORY_FILE}")
@@ -0,0 +1,132 @@
+import os
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".numba_cache"))
+import sys
+import time
+import json
+import argparse
+import tempfile
+import subprocess
+import warnings
+import joblib
+import numpy as np
+"""
+bench_transform.py
+
+Cost of umap_model.transform() for a freshly started process, with the two search indexes a bundle can
+carry (inference_bundle.slim_umap):
+
+    pynndescent   NNDescent, as bundles were built before search_index.py; unpickling compiles its
+                  search closure
+    prepared      search_index.PreparedSearchIndex; unpickling is plain numpy, the search kernel comes
+                  from the numba disk cache
+
+Both slim UMAPs are built from the full umap_model.pkl of a registry version (default: the live one)
+and each is timed in its own new Python process, like a gunicorn worker after a deploy:
+
+    load_seconds              unpickle the slim UMAP
+    first_query_seconds       first search index query
+    first_transform_seconds   first one-row transform (also compiles UMAP's own, uncached, layout kernels)
+    steady_query_ms           median search index query afterwards
+    steady_transform_ms       median one-row transform afterwards
+
+The embeddings of both variants are compared and must be identical. Run it twice to see the warm numba
+cache (the first ever run also fills it).
+
+Usage (from flask_model_api):
+    python bench_transform.py
+    python bench_transform.py --version 20240101T000000-abc123 --runs 200
+"""
+
+
+def _median_ms(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return round(float(np.median(timings)) * 1000, 3)
+
+
+# Runs in a fresh process: time loading and querying one slim UMAP, save its embedding of the queries
+def run_child(umap_path, queries_path, runs):
+    warnings.filterwarnings("ignore")
+    import umap  # noqa: F401  (imports are not part of the timings)
+    import search_index  # noqa: F401
+    queries = np.load(queries_path)
+    one_row = queries[:1]
+
+    start = time.perf_counter()
+    umap_model = joblib.load(umap_path)
+    load_seconds = time.perf_counter() - start
+
+    index = umap_model._knn_search_index
+    start = time.perf_counter()
+    index.query(one_row, k=umap_model._n_neighbors, epsilon=0.12)
+    first_query_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    umap_model.transform(one_row)
+    first_transform_seconds = time.perf_counter() - start
+
+    embedding = np.vstack([umap_model.transform(queries[i:i + 1]) for i in range(len(queries))])
+    np.save(umap_path + ".embedding.npy", embedding)
+    return {
+        "index": type(index).__name__,
+        "load_seconds": round(load_seconds, 3),
+        "first_query_seconds": round(first_query_seconds, 4),
+        "first_transform_seconds": round(first_transform_seconds, 3),
+        "steady_query_ms": _median_ms(lambda: index.query(one_row, k=umap_model._n_neighbors, epsilon=0.12), runs),
+        "steady_transform_ms": _median_ms(lambda: umap_model.transform(one_row), runs),
+    }
+
+
+def run_benchmark(version_id, runs, n_queries):
+    from model_registry import current_version, load_models
+    from inference_bundle import slim_umap
+
+    version_id = version_id or current_version()
+    umap_model = load_models(version_id, verify=False)["umap_model"]
+    if umap_model._small_data:
+        raise ValueError("❌ This UMAP searches its training data brute force; there is no index to compare")
+
+    rng = np.random.default_rng(0)
+    queries = umap_model._raw_data[rng.integers(0, umap_model._raw_data.shape[0], n_queries)]
+    results = {"version": version_id, "training_rows": umap_model._raw_data.shape[0]}
+    embeddings = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        queries_path = os.path.join(workdir, "queries.npy")
+        np.save(queries_path, np.asarray(queries, dtype=np.float32))
+        for name, prepare_index in (("pynndescent", False), ("prepared", True)):
+            umap_path = os.path.join(workdir, f"{name}.pkl")
+            joblib.dump(slim_umap(umap_model, prepare_index=prepare_index), umap_path)
+            output = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--child", umap_path, queries_path, "--runs", str(runs)],
+                check=True, capture_output=True, text=True,
+            ).stdout
+            results[name] = json.loads(output.strip().splitlines()[-1])
+            embeddings[name] = np.load(umap_path + ".embedding.npy")
+    results["identical"] = bool(np.array_equal(embeddings["pynndescent"], embeddings["prepared"]))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark UMAP transform with the pynndescent vs prepared search index")
+    parser.add_argument("--version", default=None, help="registry version (default: CURRENT)")
+    parser.add_argument("--runs", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200, help="rows whose embeddings are compared")
+    parser.add_argument("--child", nargs=2, metavar=("UMAP_PKL", "QUERIES_NPY"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(*args.child, args.runs)))
+        sys.exit(0)
+
+    results = run_benchmark(args.version, args.runs, args.queries)
+    print(f"📊 Model {results['version']}, {results['training_rows']} training rows "
+          f"(identical embeddings: {results['identical']})")
+    for name in ("pynndescent", "prepared"):
+        r = results[name]
+        print(f"   {name:<12} load {r['load_seconds']:>7}s  first query {r['first_query_seconds']:>8}s  "
+              f"first transform {r['first_transform_seconds']:>7}s  steady query {r['steady_query_ms']} ms  "
+              f"steady transform {r['steady_transform_ms']} ms")
+    print(json.dumps(results))
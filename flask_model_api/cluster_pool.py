@@ -0,0 +1,187 @@
+import os
+import time
+import threading
+import multiprocessing
+from multiprocessing import shared_memory, resource_tracker
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from assignment import assign_clusters
+"""
+==========================
+CLUSTER POOL (cluster_pool.py)
+==========================
+Assigning an upload to clusters (umap_model.transform + approximate_predict) is pure CPU work. Run
+inline in a Flask request thread it holds the GIL for seconds and every other route of that process
+(/generate-promo, /ready, ...) waits behind it.
+
+ClusterPool keeps CLUSTER_POOL_WORKERS processes that already hold the models, and hands them the
+clustering stage of /upload-excel. ClusterPool.assign(X):
+
+    1. copies the encoded float32 matrix into a multiprocessing.shared_memory block
+    2. sends a worker only the block's name, shape and dtype (no pickled DataFrame or array)
+    3. waits for the labels (a small int array) while the request thread holds no GIL
+
+The workers are forked from the serving process once its models are loaded, so like gunicorn's
+preloaded workers they share the model pages copy-on-write instead of loading their own copy.
+Each worker then pushes one row through the route's engine so UMAP's kernels are compiled before
+the first batch (instant when the parent was warmed up already).
+
+Batches below CLUSTER_POOL_MIN_ROWS, and every batch while the workers are still warming up, are
+assigned inline, so the pool never makes a request slower than before. When a worker dies the pool
+is marked broken, its batch is assigned inline, and so is every batch after it until the pool is
+restarted (status "broken" on /ready).
+
+start() should run while the process has no busy threads (forking copies only the calling thread):
+app.py starts it before the warmup thread, and under gunicorn (CLUSTER_POOL_START=post_worker_init)
+every worker starts its own pool right after it was forked, never the preloading master. A broken
+pool is therefore not restarted by the request that found it broken, but by the next assign() that
+runs on the main thread (gunicorn's sync workers serve requests there) while no other batch is being
+clustered in this process (checked under the pool's lock, so none can start meanwhile). Forking from
+any other thread can copy locks other threads hold (numba's TBB pool warns about it), so on the dev
+server and in async upload jobs a broken pool stays broken until start() is called again.
+
+Used in: app.py (/upload-excel), gunicorn.conf.py
+"""
+
+POOL_WORKERS = int(os.getenv("CLUSTER_POOL_WORKERS", "1"))      # 0 = always assign inline
+POOL_MIN_ROWS = int(os.getenv("CLUSTER_POOL_MIN_ROWS", "200"))
+
+# Set in each pool process by _init_worker
+_WORKER = {}
+
+
+def _init_worker(umap_model, clusterer, assigner, n_features):
+    _WORKER.update(umap_model=umap_model, clusterer=clusterer, assigner=assigner)
+    _assign(np.zeros((1, n_features), dtype=np.float32))
+
+
+def _assign(X):
+    return assign_clusters(X, _WORKER["umap_model"], _WORKER["clusterer"], _WORKER["assigner"])
+
+
+def _ping():
+    return os.getpid()
+
+
+# Runs in a pool process: labels of the matrix the parent placed in shared memory
+def _assign_shared(name, shape, dtype):
+    # Forked workers share the parent's resource tracker, so attaching does not hand them ownership;
+    # the parent unlinks the block
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        X = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        labels = _assign(X)
+        del X
+        return labels
+    finally:
+        block.close()
+
+
+class ClusterPool:
+    # models: load_inference_bundle() result; assigner: what assignment.select_assigner picked for the
+    # route (None = UMAP + approximate_predict)
+    def __init__(self, models, assigner, workers=POOL_WORKERS, min_rows=POOL_MIN_ROWS):
+        self.umap_model = models["umap_model"]
+        self.clusterer = models["clusterer"]
+        self.assigner = assigner
+        # Width of the encoded matrix, for the warmup row
+        self.n_features = sum(len(cats) for cats in models["encoder"].categories_) + models["scaler"].n_features_in_
+        self.workers = workers
+        self.min_rows = min_rows
+        self._executor = None
+        self._warm = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Set when a worker died; cleared when the pool is started again
+        self._broken = False
+        # assign() calls of this process currently clustering a batch (inline or in a worker)
+        self._in_flight = 0
+
+    def start(self):
+        with self._lock:
+            self._start()
+        return self
+
+    # start() with self._lock held
+    def _start(self):
+        if self.workers <= 0 or (self._executor is not None and self._pid == os.getpid()):
+            return
+        self._pid = os.getpid()
+        self._broken = False
+        # Start the resource tracker before forking so the workers share it (see _assign_shared)
+        resource_tracker.ensure_running()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.umap_model, self.clusterer, self.assigner, self.n_features),
+        )
+        # The first submit forks every worker; it resolves once one of them has warmed up
+        self._warm = self._executor.submit(_ping)
+        print(f"🏊 Started {self.workers} cluster worker process(es)")
+
+    def _started_here(self):
+        return self._executor is not None and self._pid == os.getpid()
+
+    def ready(self):
+        return self._started_here() and self._warm.done() and self._warm.exception() is None
+
+    # off | broken | starting | ready | failed (reported by /ready)
+    def status(self):
+        if self._broken:
+            return "broken"
+        if self.workers <= 0 or not self._started_here():
+            return "off"
+        if not self._warm.done():
+            return "starting"
+        return "failed" if self._warm.exception() is not None else "ready"
+
+    def _assign_inline(self, X):
+        return assign_clusters(X, self.umap_model, self.clusterer, self.assigner)
+
+    # Cluster id of every row of the encoded float32 matrix X
+    def assign(self, X):
+        with self._lock:
+            if self._broken and self._in_flight == 0 and threading.current_thread() is threading.main_thread():
+                print("🏊 No batch is being clustered, restarting the broken cluster pool")
+                self._start()
+            self._in_flight += 1
+        try:
+            return self._assign(X)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def _assign(self, X):
+        if len(X) < self.min_rows or not self.ready():
+            return self._assign_inline(X)
+
+        X = np.ascontiguousarray(X)
+        block = shared_memory.SharedMemory(create=True, size=max(X.nbytes, 1))
+        try:
+            np.ndarray(X.shape, dtype=X.dtype, buffer=block.buf)[:] = X
+            start = time.perf_counter()
+            labels = self._executor.submit(_assign_shared, block.name, X.shape, X.dtype.str).result()
+            print(f"🏊 Assigned {len(X)} rows in a cluster worker in {time.perf_counter() - start:.2f}s")
+            return labels
+        except BrokenProcessPool as e:
+            # Forking here could copy locks other threads hold; restart at a safe point (see the docstring)
+            print(f"⚠️ Cluster worker died ({e}), assigning inline until the pool can be restarted")
+            with self._lock:
+                self._shutdown()
+                self._broken = True
+            return self._assign_inline(X)
+        finally:
+            block.close()
+            block.unlink()
+
+    def shutdown(self):
+        with self._lock:
+            self._shutdown()
+
+    # shutdown() with self._lock held
+    def _shutdown(self):
+        if self._started_here():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
@@ -0,0 +1,154 @@
+import threading
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.preprocessing import OneHotEncoder
+"""
+==========================
+FEATURES (features.py)
+==========================
+The one feature path shared by training and serving: customer rows -> engineered columns ->
+one-hot + scaled matrix that UMAP embeds.
+
+    engineer_features(df)      adds Loyalty_Tier_Score, Join_Year/Month/Quarter; returns (df_cat, df_num)
+    make_encoder()             OneHotEncoder with sparse CSR float32 output
+    encode_features(...)       float32 matrix [one-hot | scaled numerics]
+    compile_row_encoder(...)   RowEncoder: the same encoding for one row, without sklearn's per-call overhead
+
+UMAP works in float32 (it converts any other input with a full copy), so the matrix is built in
+float32 directly. The one-hot part is never materialized as a dense float64 array: the encoder
+returns CSR and only its non-zeros are scattered into the float32 output, one per categorical
+column per row, however many locations there are. Encoders pickled before this (sparse_output=False,
+float64) still work; their dense output is copied in as is. The values UMAP sees are identical
+either way.
+
+UMAP itself is still given a dense matrix: a model fitted on dense data cannot transform sparse
+rows, and fitting on sparse input would switch UMAP to its (slower) sparse metrics.
+
+RowEncoder is compiled from a fitted encoder + scaler when the models are loaded: one
+{category: column} dict per categorical column and the scaler's mean_/scale_ as Python floats. A row
+is written straight into a per-thread preallocated (1, n_features) float32 buffer, with the same
+float64 arithmetic sklearn uses, so the result is bit-for-bit identical. compile_row_encoder() checks
+that on rows covering every category (and run_retraining on every distinct training row) and returns
+None when they differ or the encoder uses options it does not reproduce (drop, infrequent categories);
+callers then stay on encode_features().
+
+Used in: app.py (/upload-excel), generate.py (get_cluster_label), model_registry.py (compile_row_encoder),
+         retraining_scripts (retrain_model.py,
+         chunked_features.py, fit_modes.py, drift_check.py)
+
+Benchmark (dense float64 vs this path): python bench_features.py
+"""
+
+CATEGORICAL_COLUMNS = ['Location', 'Gender', 'Join_Year', 'Join_Month', 'Join_Quarter']
+NUMERICAL_COLUMNS = ['Loyalty_Tier_Score']
+LOYALTY_TIER_SCORES = {'Silver': 1, 'Gold': 2, 'Platinum': 3}
+
+
+# Add the engineered columns to a cleaned frame. Returns (df_cat, df_num) in encoder/scaler column order.
+def engineer_features(df):
+    joined = pd.to_datetime(df['Date Joined'])
+    df['Loyalty_Tier_Score'] = df['Loyalty Tier'].map(LOYALTY_TIER_SCORES)
+    df['Join_Year'] = joined.dt.year
+    df['Join_Month'] = joined.dt.month
+    df['Join_Quarter'] = joined.dt.quarter
+    return df[CATEGORICAL_COLUMNS], df[NUMERICAL_COLUMNS]
+
+
+def make_encoder():
+    return OneHotEncoder(handle_unknown='ignore', sparse_output=True, dtype=np.float32)
+
+
+# Encode + scale rows into one float32 matrix. df_cat/df_num: frames or 2-D lists in column order.
+# out: optional float32 array (e.g. a memmap slice) of shape (rows, n_features) to write into.
+def encode_features(encoder, scaler, df_cat, df_num, out=None):
+    encoded = encoder.transform(df_cat)
+    n_rows, n_cat = encoded.shape
+    if out is None:
+        out = np.zeros((n_rows, n_cat + scaler.n_features_in_), dtype=np.float32)
+    else:
+        out[:, :n_cat] = 0
+
+    if sparse.issparse(encoded):
+        encoded = encoded.tocsr()
+        rows = np.repeat(np.arange(n_rows), np.diff(encoded.indptr))
+        out[rows, encoded.indices] = encoded.data
+    else:
+        out[:, :n_cat] = encoded
+    out[:, n_cat:] = scaler.transform(df_num)
+    return out
+
+
+class RowEncoder:
+    def __init__(self, encoder, scaler):
+        if encoder.drop is not None or getattr(encoder, "_infrequent_enabled", False):
+            raise ValueError("❌ Row encoder does not support drop or infrequent categories")
+        self.lookups = []
+        offset = 0
+        for categories in encoder.categories_:
+            self.lookups.append({value: offset + i for i, value in enumerate(categories.tolist())})
+            offset += len(categories)
+        self.ignore_unknown = encoder.handle_unknown != "error"
+        self.n_cat = offset
+        self.n_features = offset + scaler.n_features_in_
+        n_num = scaler.n_features_in_
+        self.mean = scaler.mean_.tolist() if scaler.with_mean else [0.0] * n_num
+        self.scale = scaler.scale_.tolist() if scaler.with_std else [1.0] * n_num
+        self._local = threading.local()
+
+    def _buffer(self):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = np.zeros((1, self.n_features), dtype=np.float32)
+        else:
+            buffer.fill(0)
+        return buffer
+
+    # One row -> (1, n_features) float32. The buffer is reused by the next call from the same thread.
+    def encode(self, cat_row, num_row):
+        out = self._buffer()
+        row = out[0]
+        for lookup, value in zip(self.lookups, cat_row):
+            column = lookup.get(value)
+            if column is not None:
+                row[column] = 1.0
+            elif not self.ignore_unknown:
+                raise ValueError(f"❌ Unknown category {value!r}")
+        for j, value in enumerate(num_row):
+            row[self.n_cat + j] = (float(value) - self.mean[j]) / self.scale[j]
+        return out
+
+    def encode_rows(self, cat_rows, num_rows):
+        return np.vstack([self.encode(c, n).copy() for c, n in zip(cat_rows, num_rows)])
+
+
+# Frames that together contain every fitted category (columns padded by repeating their categories)
+def _category_frames(encoder, scaler):
+    n_rows = max(len(cats) for cats in encoder.categories_)
+    df_cat = pd.DataFrame({i: np.resize(cats, n_rows) for i, cats in enumerate(encoder.categories_)})
+    df_num = pd.DataFrame(np.arange(n_rows, dtype=float).reshape(-1, 1).repeat(scaler.n_features_in_, axis=1))
+    df_cat.columns = getattr(encoder, "feature_names_in_", df_cat.columns)
+    df_num.columns = getattr(scaler, "feature_names_in_", df_num.columns)
+    return df_cat, df_num
+
+
+# Number of rows of df_cat/df_num where the row encoder's output differs from encode_features()
+# (0 = bit-for-bit identical)
+def verify_row_encoder(row_encoder, encoder, scaler, df_cat, df_num):
+    expected = encode_features(encoder, scaler, df_cat, df_num)
+    actual = row_encoder.encode_rows(df_cat.values.tolist(), df_num.values.tolist())
+    return int((expected.view(np.uint32) != actual.view(np.uint32)).any(axis=1).sum())
+
+
+# RowEncoder for a fitted encoder + scaler, or None when it cannot reproduce encode_features() exactly
+def compile_row_encoder(encoder, scaler):
+    try:
+        row_encoder = RowEncoder(encoder, scaler)
+    except (ValueError, AttributeError) as e:
+        print(f"⚠️ Row encoder not available, using sklearn transform: {e}")
+        return None
+    mismatches = verify_row_encoder(row_encoder, encoder, scaler, *_category_frames(encoder, scaler))
+    if mismatches:
+        print(f"⚠️ Row encoder differs from sklearn on {mismatches} rows, using sklearn transform")
+        return None
+    return row_encoder
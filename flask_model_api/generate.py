@@ -1,12 +1,10 @@
-import numpy as np
+from features import encode_features, LOYALTY_TIER_SCORES
 from hdbscan.prediction import approximate_predict
-from openai import OpenAI
-import openai
 """
 ==========================
 FUNCTION SUMMARY (generate.py)
 ==========================
-1) get_cluster_label : Predicts users cluster via encoded inputs, UMAP, and HDBSCAN.
+1) get_cluster_label : Predicts users cluster via encoded inputs, UMAP, and HDBSCAN (or the kNN assigner).
    Used in: generate_prompt
 2) get_openai_response : Sends prompt to GPT and returns generated text.
    Used in: generate_prompt, generate_prompt_from_persona, generate_prompt_from_editor
@@ -28,7 +26,8 @@ FUNCTION SUMMARY (generate.py)
 
 # This function is used in generate_prompt() from routes like /generate-promo and /generate-post
 # It encodes user input, applies UMAP, and predicts which cluster the user belongs to using the trained HDBSCAN model
-def get_cluster_label(user_input, clusterer, encoder, scaler, umap_model):
+# assigner: optional assignment.NeighborAssigner/SurrogateAssigner; when given it replaces UMAP + approximate_predict
+def get_cluster_label(user_input, clusterer, encoder, scaler, umap_model, row_encoder=None, assigner=None):
     cat_input = [[
         user_input['location'],
         user_input['gender'],
@@ -38,12 +37,18 @@ def get_cluster_label(user_input, clusterer, encoder, scaler, umap_model):
     ]]
     # Map loyalty tier to ordinal scor
     loyalty_score = [[
-        {'Silver': 1, 'Gold': 2, 'Platinum': 3}.get(user_input['loyalty_tier'], 1)
+        LOYALTY_TIER_SCORES.get(user_input['loyalty_tier'], 1)
     ]]
-    # Encode categorical and scale numerical input
-    encoded = encoder.transform(cat_input)
-    scaled = scaler.transform(loyalty_score)
-    combined = np.hstack([encoded, scaled])
+    # Encode categorical and scale numerical input (float32, see features.py); the compiled
+    # row encoder gives the same bits without sklearn's input validation
+    if row_encoder is not None:
+        combined = row_encoder.encode(cat_input[0], loyalty_score[0])
+    else:
+        combined = encode_features(encoder, scaler, cat_input, loyalty_score)
+
+    # knn / surrogate engine: assign in the encoded space, without UMAP (see assignment.py)
+    if assigner is not None:
+        return assigner.assign(combined)[0]
 
     # Apply UMAP to get embedding
     embedding = umap_model.transform(combined)
@@ -55,6 +60,7 @@ def get_cluster_label(user_input, clusterer, encoder, scaler, umap_model):
 # This function is used in all routes that generate content (e.g. /generate-promo, /generate-post, /generate-editor-post)
 # It sends a structured prompt to OpenAI's GPT model and returns the generated promotional message
 def get_openai_response(prompt, api_key):
+    import openai  # imported on first use to keep app.py startup fast
     openai.api_key = api_key  # Set your API key
     response = openai.chat.completions.create(
         model="gpt-4",
@@ -82,7 +88,8 @@ def get_openai_response(prompt, api_key):
 
 # This function powers content generation in routes like /generate-promo and /generate-post
 # It builds a personalized marketing prompt using user input and cluster persona
-def generate_prompt(user_input, clusterer, encoder, scaler, umap_model, cluster_personas, api_key, override_persona=None):
+def generate_prompt(user_input, clusterer, encoder, scaler, umap_model, cluster_personas, api_key, override_persona=None,
+                    row_encoder=None, assigner=None):
     image_urls = None
 
     # Use override persona if provided (e.g. in /generate-post or /generate-editor-post), otherwise infer from cluster
@@ -90,7 +97,7 @@ def generate_prompt(user_input, clusterer, encoder, scaler, umap_model, cluster_
         persona = override_persona
         cluster_id = None  # Skipping cluster prediction for persona-only generation
     else:
-        cluster_id = get_cluster_label(user_input, clusterer, encoder, scaler, umap_model)
+        cluster_id = get_cluster_label(user_input, clusterer, encoder, scaler, umap_model, row_encoder, assigner)
         persona = cluster_personas.get(cluster_id, {})
 
 
@@ -260,7 +267,6 @@ Now write the promotional post accordingly.
     return prompt, result
 
 
-from openai import OpenAI
 import base64
 # DALL·E image generation using OpenAI's API
 # Used in generate_prompt() to generate platform-specific images
@@ -298,6 +304,7 @@ def generate_image_content(image_prompt, api_key, platform="Instagram", custom_w
 # generate_slogan(user_input, api_key)
 # Used in: generate_prompt() → when generating image prompts
 def generate_slogan(user_input, api_key):
+    import openai
     openai.api_key = api_key
     response = openai.chat.completions.create(
         model="gpt-4",
@@ -448,6 +455,7 @@ Now write the promotional message."""
 #     • Strip out unwanted tokens or misunderstood formatting
 #     • Improve prompt clarity and compliance for visual generation
 def get_openai_refined_prompt(user_input, slogan, api_key):
+    import openai
     openai.api_key = api_key
     system = "You are a Canva-style designer. Rewrite the user prompt to generate a photo-realistic poster using DALL·E 3. Enforce clean layout, no fake UI, no emojis, legible text, no gibberish, and only show the heading provided."
 
@@ -0,0 +1,30 @@
+"""
+gunicorn.conf.py
+
+Production settings for serving app.py with gunicorn:
+    gunicorn -c gunicorn.conf.py app:app
+
+preload_app loads app.py (and therefore every model artifact) once in the master process
+before the workers are forked. Combined with MODEL_MMAP_MODE=c (see model_registry.py) the
+large numpy arrays are file-backed pages that all workers share copy-on-write, so RAM no
+longer grows with the worker count. Use measure_worker_memory.py to check RSS/PSS per worker.
+
+post_worker_init starts each worker's cluster pool (cluster_pool.py) once that worker exists.
+"""
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+# Set GUNICORN_PRELOAD=0 to let every worker load its own copy of the models
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# app.py's cluster worker pool (cluster_pool.py) forks processes; start it in every worker after the
+# fork instead of in the preloading master
+os.environ.setdefault("CLUSTER_POOL_START", "post_worker_init")
+
+
+def post_worker_init(worker):
+    from app import cluster_pool
+    cluster_pool.start()
@@ -0,0 +1,157 @@
+import copy
+from datetime import datetime
+import numpy as np
+from search_index import PreparedSearchIndex, prepare_search_index
+"""
+==========================
+INFERENCE BUNDLE (inference_bundle.py)
+==========================
+Serving only ever calls four things on the models:
+    encoder.transform, scaler.transform, umap_model.transform, approximate_predict(clusterer, ...)
+
+The production pickles also carry everything that was needed to *fit* them (UMAP fuzzy graph,
+kNN arrays, sigmas/rhos; HDBSCAN raw data, single linkage tree, exemplars, labels ...).
+build_inference_bundle() copies the models and drops that training state, and packs the result
+into one dict with a header:
+
+    {
+        "header": {"format", "bundle_version", "model_version", "feature_schema_hash", "search_index", ...},
+        "encoder", "scaler", "umap_model", "clusterer", "cluster_personas",
+        "cluster_assigner"      optional assignment.NeighborAssigner (the "knn" engine), None if not built
+        "cluster_surrogate"     optional assignment.SurrogateAssigner (the "surrogate" engine), None if not built
+    }
+
+UMAP's pynndescent search index is swapped for a search_index.PreparedSearchIndex when it returns the
+same neighbours, so loading the bundle no longer compiles a search function (header "search_index":
+"prepared"; "pynndescent" when the original index was kept).
+
+The registry writes it as inference_bundle.pkl next to the full artifacts of each version
+(see model_registry.publish_version) and app.py loads it through model_registry.load_inference_bundle().
+
+Used in: retrain_model.py (build), model_registry.py (stamp version, load), app.py (via registry)
+"""
+
+BUNDLE_FORMAT = "persona-inference-bundle"
+BUNDLE_VERSION = 1
+BUNDLE_KEYS = ["encoder", "scaler", "umap_model", "clusterer", "cluster_personas"]
+
+# UMAP attributes only used while fitting (the fuzzy graph and its kNN inputs)
+UMAP_TRAINING_ATTRS = ["graph_", "graph_dists_", "_knn_indices", "_knn_dists", "_sigmas", "_rhos", "_rp_forest"]
+
+# HDBSCAN attributes approximate_predict never reads (it uses _condensed_tree and prediction data)
+HDBSCAN_TRAINING_ATTRS = [
+    "_raw_data", "_single_linkage_tree", "_min_spanning_tree", "_outlier_scores",
+    "labels_", "probabilities_", "cluster_persistence_", "_relative_validity", "_branch_detection_data",
+]
+
+
+def _library_versions():
+    import sklearn
+    import umap
+    import hdbscan
+    return {
+        "numpy": np.__version__,
+        "scikit-learn": sklearn.__version__,
+        "umap-learn": getattr(umap, "__version__", "unknown"),
+        "hdbscan": getattr(hdbscan, "__version__", "unknown"),
+    }
+
+
+# Epsilon umap_model.transform passes to the search index
+def _transform_epsilon(index):
+    return 0.24 if index._angular_trees else 0.12
+
+
+# Shallow copy of the fitted UMAP without its training graph.
+# The search index (transform queries it) becomes a PreparedSearchIndex when that reproduces it
+# (prepare_index=False keeps pynndescent's), otherwise it is kept minus its build-time neighbour graph.
+def slim_umap(umap_model, prepare_index=True):
+    slim = copy.copy(umap_model)
+    for attr in UMAP_TRAINING_ATTRS:
+        if hasattr(slim, attr):
+            setattr(slim, attr, None)
+
+    index = getattr(slim, "_knn_search_index", None)
+    if index is not None and not isinstance(index, PreparedSearchIndex):
+        prepared = None
+        if prepare_index:
+            prepared = prepare_search_index(
+                index, umap_model._raw_data, umap_model._n_neighbors, _transform_epsilon(index)
+            )
+        if prepared is None:
+            prepared = copy.copy(index)
+            if hasattr(prepared, "_neighbor_graph"):
+                del prepared._neighbor_graph
+        index = slim._knn_search_index = prepared
+
+    # With a search index, transform only reads the row count of the training data
+    # (small datasets are searched brute force and still need the full array)
+    if not slim._small_data and index is not None:
+        slim._raw_data = np.empty((umap_model._raw_data.shape[0], 0), dtype=np.float32)
+    return slim
+
+
+# "prepared", "pynndescent" or None (small datasets are searched brute force, without an index)
+def search_index_kind(umap_model):
+    index = getattr(umap_model, "_knn_search_index", None)
+    if index is None:
+        return None
+    return "prepared" if isinstance(index, PreparedSearchIndex) else "pynndescent"
+
+
+# Shallow copy of the fitted HDBSCAN keeping only what approximate_predict needs
+def slim_clusterer(clusterer):
+    if clusterer.prediction_data_ is None:
+        raise ValueError("❌ HDBSCAN model has no prediction data; fit it with prediction_data=True")
+
+    slim = copy.copy(clusterer)
+    for attr in HDBSCAN_TRAINING_ATTRS:
+        if attr in vars(slim):
+            setattr(slim, attr, None)
+
+    prediction_data = copy.copy(clusterer.prediction_data_)
+    prediction_data.exemplars = []
+    slim.prediction_data_ = prediction_data
+    return slim
+
+
+# Build the serving bundle from freshly trained models.
+# model_version is usually filled in by model_registry.publish_version().
+def build_inference_bundle(encoder, scaler, umap_model, clusterer, cluster_personas,
+                           feature_schema_hash=None, model_version=None, cluster_assigner=None,
+                           cluster_surrogate=None):
+    slim = slim_umap(umap_model)
+    return {
+        "header": {
+            "format": BUNDLE_FORMAT,
+            "bundle_version": BUNDLE_VERSION,
+            "model_version": model_version,
+            "feature_schema_hash": feature_schema_hash,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "libraries": _library_versions(),
+            "search_index": search_index_kind(slim),
+        },
+        "encoder": encoder,
+        "scaler": scaler,
+        "umap_model": slim,
+        "clusterer": slim_clusterer(clusterer),
+        "cluster_personas": cluster_personas,
+        "cluster_assigner": cluster_assigner,
+        "cluster_surrogate": cluster_surrogate,
+    }
+
+
+# Reject files that are not a bundle or were written by an incompatible bundle layout
+def check_bundle_header(bundle):
+    header = bundle.get("header") if isinstance(bundle, dict) else None
+    if not header or header.get("format") != BUNDLE_FORMAT:
+        raise ValueError("❌ Not an inference bundle")
+    if header.get("bundle_version") != BUNDLE_VERSION:
+        raise ValueError(
+            f"❌ Inference bundle version {header.get('bundle_version')} is not supported "
+            f"(expected {BUNDLE_VERSION}); re-export it with retrain_model.py"
+        )
+    missing = [key for key in BUNDLE_KEYS if key not in bundle]
+    if missing:
+        raise ValueError(f"❌ Inference bundle is missing {missing}")
+    return header
@@ -0,0 +1,175 @@
+import os
+import json
+import uuid
+import threading
+from datetime import datetime
+"""
+==========================
+JOB STORE (job_store.py)
+==========================
+Persisted state for long-running background jobs (retraining, async uploads), so a client can submit work, get an
+id back straight away and poll for progress instead of holding an HTTP request open for minutes.
+
+One JSON file per job under jobs/ (JOBS_DIR env var), rewritten atomically on every update:
+
+    {
+        "id", "kind", "status",          queued | running | succeeded | failed | interrupted
+        "stage",                         name of the stage currently running
+        "stages": {name: {"status", "started_at", "seconds"}},   in the order the job runs them
+                                         (status pending | running | done | failed | cached)
+        "params", "result", "error", "pid", "created_at", "updated_at"
+    }
+
+Because the state lives on disk, any process (another gunicorn worker, a CLI) can read it, and a job
+whose process died is reported as "interrupted" instead of "running" forever (recover_jobs).
+A job can publish partial results while it runs (append_job_result), and finished jobs are deleted
+once they are older than a TTL (evict_jobs).
+
+Used in: retraining_scripts/retrain_api.py, app.py (/upload-excel?async=1, /jobs/<job_id>)
+"""
+
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs"))
+
+# Serializes read-modify-write of job files between threads of this process
+_lock = threading.Lock()
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _job_path(job_id):
+    return os.path.join(JOBS_DIR, f"{job_id}.json")
+
+
+def _write_job(job):
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    job["updated_at"] = _now()
+    tmp_path = _job_path(job["id"]) + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(job, f, indent=2, default=str)
+    os.replace(tmp_path, _job_path(job["id"]))
+    return job
+
+
+def get_job(job_id):
+    # Job ids are generated hex strings; anything else cannot name a job file
+    if not job_id.isalnum() or not os.path.exists(_job_path(job_id)):
+        return None
+    with open(_job_path(job_id)) as f:
+        return json.load(f)
+
+
+def list_jobs(kind=None, status=None):
+    if not os.path.isdir(JOBS_DIR):
+        return []
+    jobs = [get_job(name[:-len(".json")]) for name in os.listdir(JOBS_DIR) if name.endswith(".json")]
+    jobs = [job for job in jobs if job and (kind is None or job["kind"] == kind)
+            and (status is None or job["status"] == status)]
+    return sorted(jobs, key=lambda job: job["created_at"])
+
+
+def create_job(kind, params=None, stages=None):
+    job = {
+        "id": uuid.uuid4().hex[:12],
+        "kind": kind,
+        "status": "queued",
+        "stage": None,
+        "stages": {name: {"status": "pending", "started_at": None, "seconds": None} for name in stages or []},
+        "params": params or {},
+        "result": None,
+        "error": None,
+        "pid": os.getpid(),
+        "created_at": _now(),
+    }
+    with _lock:
+        return _write_job(job)
+
+
+def update_job(job_id, **fields):
+    with _lock:
+        job = get_job(job_id)
+        job.update(fields)
+        return _write_job(job)
+
+
+def _close_stage(job, status):
+    stage = job["stages"].get(job["stage"])
+    if stage and stage["status"] == "running":
+        stage["status"] = status
+        stage["seconds"] = round((datetime.now() - datetime.fromisoformat(stage["started_at"])).total_seconds(), 3)
+
+
+# Mark `stage` as running and close the one before it. Usable directly as a progress callback.
+def start_stage(job_id, stage):
+    with _lock:
+        job = get_job(job_id)
+        _close_stage(job, "done")
+        job["stages"].setdefault(stage, {"status": "pending", "started_at": None, "seconds": None})
+        job["stages"][stage].update(status="running", started_at=datetime.now().isoformat(timespec="milliseconds"))
+        job["stage"] = stage
+        job["status"] = "running"
+        return _write_job(job)
+
+
+# Set the status of stages that will not run (e.g. "cached" when their output came from a cache)
+def mark_stages(job_id, stages, status):
+    with _lock:
+        job = get_job(job_id)
+        for stage in stages:
+            job["stages"].setdefault(stage, {"status": "pending", "started_at": None, "seconds": None})
+            job["stages"][stage]["status"] = status
+        return _write_job(job)
+
+
+def finish_job(job_id, result=None, error=None):
+    with _lock:
+        job = get_job(job_id)
+        _close_stage(job, "failed" if error else "done")
+        job.update(status="failed" if error else "succeeded", result=result, error=error)
+        return _write_job(job)
+
+
+# Append one item to result[key] of a running job, so pollers see partial results as they finish
+def append_job_result(job_id, key, item):
+    with _lock:
+        job = get_job(job_id)
+        job["result"] = job["result"] or {}
+        job["result"].setdefault(key, []).append(item)
+        return _write_job(job)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# Jobs left queued/running by a process that no longer exists can never finish
+def recover_jobs(kind=None):
+    recovered = []
+    for job in list_jobs(kind):
+        if job["status"] in ("queued", "running") and not _pid_alive(job["pid"]):
+            update_job(job["id"], status="interrupted", error="Process exited before the job finished")
+            recovered.append(job["id"])
+    return recovered
+
+
+# Delete finished jobs whose last update is more than ttl_seconds ago; returns their ids
+def evict_jobs(kind=None, ttl_seconds=3600):
+    evicted = []
+    now = datetime.now()
+    for job in list_jobs(kind):
+        age = (now - datetime.fromisoformat(job["updated_at"])).total_seconds()
+        if job["status"] in ("succeeded", "failed", "interrupted") and age > ttl_seconds:
+            with _lock:
+                try:
+                    os.remove(_job_path(job["id"]))
+                except FileNotFoundError:
+                    continue
+            evicted.append(job["id"])
+    return evicted
@@ -0,0 +1,115 @@
+import os
+import sys
+import time
+import json
+import argparse
+import subprocess
+import urllib.request
+import urllib.error
+import psutil
+"""
+measure_worker_memory.py
+
+Starts app.py under gunicorn twice and reports the memory of every worker:
+  1) baseline : each worker joblib.loads private copies (MODEL_MMAP_MODE="", no preload)
+  2) shared   : models preloaded in the master and memory-mapped (MODEL_MMAP_MODE=c, preload)
+
+RSS counts shared pages in every worker, so also look at USS (private to the worker)
+and PSS (shared pages divided between the processes that map them, Linux only).
+The sum of PSS over all workers is the real cost of the worker pool.
+
+Usage (Linux, from flask_model_api):
+    python measure_worker_memory.py --workers 4
+    python measure_worker_memory.py --workers 4 --json memory_report.json
+"""
+
+SCENARIOS = [
+    ("baseline", {"MODEL_MMAP_MODE": "", "GUNICORN_PRELOAD": "0"}),
+    ("shared", {"MODEL_MMAP_MODE": "c", "GUNICORN_PRELOAD": "1"}),
+]
+
+
+def _wait_until_serving(port, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=2)
+            return True
+        except urllib.error.HTTPError:
+            return True  # 404 on "/" still means a worker answered
+        except Exception:
+            time.sleep(0.5)
+    return False
+
+
+def measure(name, env_overrides, workers, port, settle, timeout):
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "measure-only")
+    env.update(env_overrides)
+    env["GUNICORN_WORKERS"] = str(workers)
+    env["GUNICORN_BIND"] = f"127.0.0.1:{port}"
+
+    master = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        if not _wait_until_serving(port, timeout):
+            raise RuntimeError(f"❌ gunicorn ({name}) did not start within {timeout}s")
+        # give the remaining workers time to finish loading the models
+        time.sleep(settle)
+
+        rows = []
+        for child in psutil.Process(master.pid).children():
+            info = child.memory_full_info()
+            rows.append({
+                "pid": child.pid,
+                "rss_mb": round(info.rss / 2**20, 1),
+                "uss_mb": round(info.uss / 2**20, 1),
+                "pss_mb": round(getattr(info, "pss", 0) / 2**20, 1),
+            })
+        return {
+            "scenario": name,
+            "settings": env_overrides,
+            "workers": rows,
+            "total_rss_mb": round(sum(r["rss_mb"] for r in rows), 1),
+            "total_pss_mb": round(sum(r["pss_mb"] for r in rows), 1),
+        }
+    finally:
+        master.terminate()
+        master.wait(timeout=30)
+
+
+def print_report(result):
+    print(f"\n📊 {result['scenario']} {result['settings']}")
+    print(f"{'pid':>8} {'RSS MB':>9} {'USS MB':>9} {'PSS MB':>9}")
+    for row in result["workers"]:
+        print(f"{row['pid']:>8} {row['rss_mb']:>9} {row['uss_mb']:>9} {row['pss_mb']:>9}")
+    print(f"{'total':>8} {result['total_rss_mb']:>9} {'':>9} {result['total_pss_mb']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-worker memory of app.py under gunicorn")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--settle", type=float, default=10.0, help="seconds to wait after the first response")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--json", help="optional path to write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for name, overrides in SCENARIOS:
+        result = measure(name, overrides, args.workers, args.port, args.settle, args.timeout)
+        print_report(result)
+        results.append(result)
+
+    before, after = results[0]["total_pss_mb"], results[-1]["total_pss_mb"]
+    if before:
+        print(f"\n✅ Total PSS {before} MB -> {after} MB ({100 * (before - after) / before:.0f}% less)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,461 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import time
+import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import joblib
+from inference_bundle import build_inference_bundle, check_bundle_header
+from features import compile_row_encoder
+"""
+==========================
+MODEL REGISTRY (model_registry.py)
+==========================
+Versioned storage for the five production artifacts (HDBSCAN, encoder, scaler, UMAP, personas).
+
+Layout under retraining_scripts/production_models:
+    versions/<version_id>/      immutable folder, one per published model
+        HDBSCAN_cluster_model.pkl
+        encoder.pkl
+        scaler.pkl
+        umap_model.pkl
+        cluster_personas.pkl
+        inference_bundle.pkl    slim serving-only copy of the models (see inference_bundle.py)
+        training_customer_ids.pkl   Customer ID of every UMAP training row (incremental retraining)
+        manifest.json           sha256 per file, feature-schema hash, metadata
+        profile.json            stage timings/memory of the retrain that produced it (retrain_profiler.py)
+    CURRENT                     text file holding the live version id
+    tuned_params.json           UMAP/HDBSCAN settings picked by the last sweep (sweep_params.py)
+    sweeps/<sweep_id>.json      full score table of every sweep
+
+publish_version() writes everything into a hidden staging folder, renames it into versions/
+and only then flips CURRENT with os.replace(). A reader therefore always gets a complete
+set of five files from one training run, never a new encoder paired with an old UMAP.
+The staging folder is named after the publishing process (.staging-<version_id>-<pid>), so
+prune_versions() only deletes the ones whose process is gone, never one another publish
+(a retrain, or `adopt` from the CLI) is still writing.
+
+If CURRENT does not exist yet, load_models() falls back to the old flat layout
+(the .pkl files directly inside production_models/).
+
+Artifacts are written uncompressed, so joblib can open their numpy arrays (UMAP training data,
+embedding and kNN index, HDBSCAN prediction data) with mmap_mode. Every gunicorn worker then maps
+the same page-cache pages instead of holding a private copy (see gunicorn.conf.py).
+
+Used in: app.py (load_inference_bundle), retrain_model.py (load_models, publish_version, read_tuned_params),
+         sweep_params.py (record_tuned_params), retrain_profiler.py (read_version_report)
+
+CLI:
+    python model_registry.py list
+    python model_registry.py rollback [version_id]
+    python model_registry.py prune [keep]
+    python model_registry.py adopt        # publish the flat legacy files as the first version
+    python model_registry.py tuned        # show the recorded sweep winner
+"""
+
+REGISTRY_DIR = os.getenv(
+    "MODEL_REGISTRY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "retraining_scripts", "production_models")
+)
+VERSIONS_DIR = os.path.join(REGISTRY_DIR, "versions")
+CURRENT_POINTER = os.path.join(REGISTRY_DIR, "CURRENT")
+MANIFEST_NAME = "manifest.json"
+TUNED_PARAMS_FILE = os.path.join(REGISTRY_DIR, "tuned_params.json")
+SWEEPS_DIR = os.path.join(REGISTRY_DIR, "sweeps")
+
+# How many published versions to keep on disk (the live one is never deleted)
+KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", "5"))
+# Age after which a staging folder without a publisher pid is treated as left behind
+STALE_STAGING_SECONDS = 24 * 3600
+
+# Default mmap mode for load_models(): "c" maps arrays copy-on-write so workers share the
+# page cache; "" loads private copies. ("r" breaks pynndescent, which needs writable arrays.)
+MMAP_MODE = os.getenv("MODEL_MMAP_MODE", "c") or None
+
+# Threads used to read and checksum artifacts concurrently (file reads and sha256 release the GIL)
+LOAD_WORKERS = int(os.getenv("MODEL_LOAD_WORKERS", "5"))
+
+# Artifact key -> file name inside a version folder
+ARTIFACT_FILES = {
+    "clusterer": "HDBSCAN_cluster_model.pkl",
+    "encoder": "encoder.pkl",
+    "scaler": "scaler.pkl",
+    "umap_model": "umap_model.pkl",
+    "cluster_personas": "cluster_personas.pkl",
+}
+BUNDLE_FILE = "inference_bundle.pkl"
+
+# Optional per-version files, written only when present in the published artifacts
+EXTRA_FILES = {
+    "inference_bundle": BUNDLE_FILE,
+    "training_customer_ids": "training_customer_ids.pkl",
+}
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Hash of everything that decides the column layout of the feature matrix.
+# A model trained on a different set of locations/years/months gets a different hash.
+def feature_schema(encoder, scaler):
+    return {
+        "categorical_features": [str(c) for c in getattr(encoder, "feature_names_in_", [])],
+        "categories": [[str(v) for v in cats] for cats in encoder.categories_],
+        "numerical_features": [str(c) for c in getattr(scaler, "feature_names_in_", [])],
+        "n_features": int(sum(len(cats) for cats in encoder.categories_) + scaler.n_features_in_),
+    }
+
+
+def feature_schema_hash(encoder, scaler):
+    payload = json.dumps(feature_schema(encoder, scaler), sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _new_version_id():
+    return datetime.now().strftime("%Y%m%dT%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def _version_dir(version_id):
+    return os.path.join(VERSIONS_DIR, version_id)
+
+
+def _write_pointer(version_id):
+    tmp_path = CURRENT_POINTER + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(version_id)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, CURRENT_POINTER)
+
+
+def current_version():
+    if not os.path.exists(CURRENT_POINTER):
+        return None
+    with open(CURRENT_POINTER) as f:
+        return f.read().strip() or None
+
+
+def list_versions():
+    if not os.path.isdir(VERSIONS_DIR):
+        return []
+    return sorted(
+        name for name in os.listdir(VERSIONS_DIR)
+        if not name.startswith(".") and os.path.exists(os.path.join(VERSIONS_DIR, name, MANIFEST_NAME))
+    )
+
+
+def read_manifest(version_id):
+    with open(os.path.join(_version_dir(version_id), MANIFEST_NAME)) as f:
+        return json.load(f)
+
+
+# Recompute the checksums of a version folder (all files, or only `files`); raises ValueError on any mismatch
+def verify_version(version_id, files=None):
+    manifest = read_manifest(version_id)
+    expected = {
+        name: checksum for name, checksum in manifest["checksums"].items()
+        if files is None or name in files
+    }
+    for name in expected:
+        if not os.path.exists(os.path.join(_version_dir(version_id), name)):
+            raise ValueError(f"❌ Model version {version_id} is missing {name}")
+
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        actual = dict(zip(expected, pool.map(
+            lambda name: _sha256(os.path.join(_version_dir(version_id), name)), expected
+        )))
+    for name, checksum in expected.items():
+        if actual[name] != checksum:
+            raise ValueError(f"❌ Checksum mismatch for {name} in model version {version_id}")
+    return manifest
+
+
+# joblib.load several artifacts at once; paths: key -> file path.
+# The model libraries are imported here first: unpickling in several threads would otherwise
+# import sklearn/umap concurrently, which deadlocks on Python's module import locks.
+def _load_files(paths, mmap_mode=None):
+    import sklearn.preprocessing
+    import hdbscan
+    import umap
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        futures = {key: pool.submit(joblib.load, path, mmap_mode=mmap_mode) for key, path in paths.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
+# Write a complete artifact set as a new immutable version and make it live.
+# artifacts: dict with every key of ARTIFACT_FILES, plus optionally any key of EXTRA_FILES
+# ("inference_bundle" from inference_bundle.build_inference_bundle). metadata: free-form dict stored in the manifest.
+def publish_version(artifacts, metadata=None, keep=None):
+    missing = set(ARTIFACT_FILES) - set(artifacts)
+    if missing:
+        raise ValueError(f"❌ Cannot publish, missing artifacts: {sorted(missing)}")
+
+    os.makedirs(VERSIONS_DIR, exist_ok=True)
+    version_id = _new_version_id()
+    staging_dir = os.path.join(VERSIONS_DIR, f".staging-{version_id}-{os.getpid()}")
+    os.makedirs(staging_dir)
+
+    try:
+        checksums = {}
+        for key, file_name in ARTIFACT_FILES.items():
+            path = os.path.join(staging_dir, file_name)
+            # compress=0 keeps arrays page-aligned and memory-mappable
+            joblib.dump(artifacts[key], path, compress=0)
+            checksums[file_name] = _sha256(path)
+
+        schema_hash = feature_schema_hash(artifacts["encoder"], artifacts["scaler"])
+        bundle = artifacts.get("inference_bundle")
+        if bundle is not None:
+            bundle["header"]["model_version"] = version_id
+            bundle["header"]["feature_schema_hash"] = schema_hash
+
+        for key, file_name in EXTRA_FILES.items():
+            if artifacts.get(key) is None:
+                continue
+            path = os.path.join(staging_dir, file_name)
+            joblib.dump(artifacts[key], path, compress=0)
+            checksums[file_name] = _sha256(path)
+
+        manifest = {
+            "version": version_id,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "previous_version": current_version(),
+            "feature_schema_hash": schema_hash,
+            "feature_schema": feature_schema(artifacts["encoder"], artifacts["scaler"]),
+            "checksums": checksums,
+            "metadata": metadata or {},
+        }
+        with open(os.path.join(staging_dir, MANIFEST_NAME), "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+
+        os.rename(staging_dir, _version_dir(version_id))
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    _write_pointer(version_id)
+    print(f"📦 Published model version {version_id}")
+
+    prune_versions(KEEP_VERSIONS if keep is None else keep)
+    return version_id
+
+
+def _load_legacy_models(mmap_mode=None):
+    models = _load_files(
+        {key: os.path.join(REGISTRY_DIR, file_name) for key, file_name in ARTIFACT_FILES.items()}, mmap_mode
+    )
+    models["version"] = "legacy"
+    models["manifest"] = None
+    return models
+
+
+# Load every artifact of one version (default: the live one).
+# Returns a dict keyed like ARTIFACT_FILES plus "version" and "manifest".
+# mmap_mode="c" memory-maps large arrays copy-on-write (default from MODEL_MMAP_MODE).
+def load_models(version_id=None, verify=True, mmap_mode=MMAP_MODE):
+    version_id = version_id or current_version()
+    if version_id is None:
+        print("⚠️ No CURRENT model version, loading flat files from production_models/")
+        return _load_legacy_models(mmap_mode)
+
+    manifest = verify_version(version_id) if verify else read_manifest(version_id)
+    version_dir = _version_dir(version_id)
+    models = _load_files(
+        {key: os.path.join(version_dir, file_name) for key, file_name in ARTIFACT_FILES.items()}, mmap_mode
+    )
+
+    loaded_hash = feature_schema_hash(models["encoder"], models["scaler"])
+    if loaded_hash != manifest["feature_schema_hash"]:
+        raise ValueError(f"❌ Feature schema of model version {version_id} does not match its manifest")
+
+    models["version"] = version_id
+    models["manifest"] = manifest
+    return models
+
+
+# Load one optional artifact (a key of EXTRA_FILES) of a version; None if that version does not have it
+def load_artifact(key, version_id=None, mmap_mode=MMAP_MODE):
+    version_id = version_id or current_version()
+    file_name = EXTRA_FILES[key]
+    if version_id is None or file_name not in read_manifest(version_id)["checksums"]:
+        return None
+    verify_version(version_id, files=[file_name])
+    return joblib.load(os.path.join(_version_dir(version_id), file_name), mmap_mode=mmap_mode)
+
+
+# Load the slim serving bundle of one version (default: the live one).
+# Returns the same keys as load_models() plus "header" and "row_encoder" (features.compile_row_encoder).
+# Versions published before bundles existed (and the legacy flat layout) fall back to the full artifacts.
+def load_inference_bundle(version_id=None, verify=True, mmap_mode=MMAP_MODE):
+    version_id = version_id or current_version()
+    if version_id is None or BUNDLE_FILE not in read_manifest(version_id)["checksums"]:
+        print("⚠️ No inference bundle for this model version, loading the full artifacts")
+        models = load_models(version_id, verify=verify, mmap_mode=mmap_mode)
+        models["header"] = None
+        models["cluster_assigner"] = None
+        models["cluster_surrogate"] = None
+        models["row_encoder"] = compile_row_encoder(models["encoder"], models["scaler"])
+        return models
+
+    manifest = verify_version(version_id, files=[BUNDLE_FILE]) if verify else read_manifest(version_id)
+    bundle = joblib.load(os.path.join(_version_dir(version_id), BUNDLE_FILE), mmap_mode=mmap_mode)
+    header = check_bundle_header(bundle)
+    if header["model_version"] != version_id or header["feature_schema_hash"] != manifest["feature_schema_hash"]:
+        raise ValueError(f"❌ Inference bundle header does not match model version {version_id}")
+
+    models = {key: bundle[key] for key in ARTIFACT_FILES}
+    models["version"] = version_id
+    models["manifest"] = manifest
+    models["header"] = header
+    # knn / surrogate assignment engines (assignment.py); bundles built before them have none
+    models["cluster_assigner"] = bundle.get("cluster_assigner")
+    models["cluster_surrogate"] = bundle.get("cluster_surrogate")
+    models["row_encoder"] = compile_row_encoder(models["encoder"], models["scaler"])
+    return models
+
+
+# Point CURRENT back to an older version (default: the one published before the live one)
+def rollback(version_id=None):
+    versions = list_versions()
+    live = current_version()
+    if version_id is None:
+        older = [v for v in versions if live is None or v < live]
+        if not older:
+            raise ValueError("❌ No older model version to roll back to")
+        version_id = older[-1]
+    if version_id not in versions:
+        raise ValueError(f"❌ Unknown model version: {version_id}")
+
+    verify_version(version_id)
+    _write_pointer(version_id)
+    print(f"↩️ Rolled back model from {live} to {version_id}")
+    return version_id
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # exists, owned by another user
+        return True
+    return True
+
+
+# True for a staging folder left behind by a publish that died: its process is gone, or (folders named
+# before the pid was added) it is older than STALE_STAGING_SECONDS
+def _stale_staging(name):
+    pid = name.rsplit("-", 1)[-1]
+    if name.count("-") >= 3 and pid.isdigit():
+        return not _pid_alive(int(pid))
+    try:
+        return time.time() - os.path.getmtime(os.path.join(VERSIONS_DIR, name)) > STALE_STAGING_SECONDS
+    except FileNotFoundError:
+        return False
+
+
+# Delete the oldest versions beyond `keep`, and staging folders of publishes that died. The live version
+# and staging folders another publish is still writing are kept.
+def prune_versions(keep=KEEP_VERSIONS):
+    if not os.path.isdir(VERSIONS_DIR):
+        return []
+    for name in os.listdir(VERSIONS_DIR):
+        if name.startswith(".staging-") and _stale_staging(name):
+            shutil.rmtree(os.path.join(VERSIONS_DIR, name), ignore_errors=True)
+
+    live = current_version()
+    versions = list_versions()
+    removable = [v for v in versions[:max(len(versions) - keep, 0)] if v != live]
+    for version_id in removable:
+        shutil.rmtree(_version_dir(version_id), ignore_errors=True)
+        print(f"🗑️ Pruned model version {version_id}")
+    return removable
+
+
+# Publish the old flat production_models/*.pkl files as the first registry version
+def adopt_legacy_models():
+    models = _load_legacy_models(mmap_mode=None)
+    artifacts = {key: models[key] for key in ARTIFACT_FILES}
+    artifacts["inference_bundle"] = build_inference_bundle(**artifacts)
+    return publish_version(artifacts, metadata={"source": "legacy flat layout"})
+
+
+
+def _write_json(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+# Store a sweep's score table under sweeps/ and make its winner the parameters of the next retrain.
+# winner: {"umap": {...}, "hdbscan": {...}, "scores": {...}}; only the swept keys need to be present.
+def record_tuned_params(winner, results, sweep_id=None):
+    sweep_id = sweep_id or _new_version_id()
+    _write_json({"sweep_id": sweep_id, "winner": winner, "results": results},
+                os.path.join(SWEEPS_DIR, f"{sweep_id}.json"))
+    _write_json({
+        "sweep_id": sweep_id,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "umap": winner["umap"],
+        "hdbscan": winner["hdbscan"],
+        "scores": winner.get("scores", {}),
+    }, TUNED_PARAMS_FILE)
+    print(f"🏆 Recorded tuned parameters from sweep {sweep_id}")
+    return sweep_id
+
+
+# Reports written after publishing (e.g. profile.json) sit next to the artifacts but are not in the
+# manifest checksums: they describe the run, not the model, and never affect loading
+def write_version_report(version_id, name, data):
+    _write_json(data, os.path.join(_version_dir(version_id), name))
+
+
+def read_version_report(version_id, name):
+    path = os.path.join(_version_dir(version_id), name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# File name -> size in bytes of every artifact in a version folder
+def version_file_sizes(version_id):
+    return {
+        name: os.path.getsize(os.path.join(_version_dir(version_id), name))
+        for name in read_manifest(version_id)["checksums"]
+    }
+
+
+def read_tuned_params():
+    if not os.path.exists(TUNED_PARAMS_FILE):
+        return None
+    with open(TUNED_PARAMS_FILE) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        live = current_version()
+        for v in list_versions():
+            print(("* " if v == live else "  ") + v)
+    elif command == "rollback":
+        rollback(sys.argv[2] if len(sys.argv) > 2 else None)
+    elif command == "prune":
+        prune_versions(int(sys.argv[2]) if len(sys.argv) > 2 else KEEP_VERSIONS)
+    elif command == "adopt":
+        adopt_legacy_models()
+    elif command == "tuned":
+        print(json.dumps(read_tuned_params(), indent=2))
+    else:
+        print("Usage: python model_registry.py [list | rollback [version_id] | prune [keep] | adopt | tuned]")
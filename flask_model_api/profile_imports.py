@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+"""
+profile_imports.py
+
+Import-time profile of app.py, using Python's built-in `-X importtime`.
+Runs `import app` in a fresh interpreter (warmup disabled, so only imports and model loading
+are measured) and prints the slowest modules by cumulative import time, plus whether the
+modules that app.py defers to their routes (pandas, openpyxl, requests, openai) were imported.
+
+Note: model unpickling imports umap/hdbscan/sklearn, and sklearn itself imports pandas,
+so those show up even though app.py no longer imports them directly.
+
+Usage (from flask_model_api):
+    python profile_imports.py
+    python profile_imports.py --top 40 --json import_profile.json
+"""
+
+WATCHED_MODULES = ["pandas", "openpyxl", "requests", "openai", "dotenv", "umap", "hdbscan", "sklearn", "numba"]
+
+
+def profile_app_import():
+    env = dict(os.environ)
+    env.setdefault("OPENAI_API_KEY", "profile-only")
+    env["MODEL_WARMUP"] = "off"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"❌ import app failed:\n{proc.stderr[-2000:]}")
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time profile of app.py")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--json", help="optional path to write every module's timing as JSON")
+    args = parser.parse_args()
+
+    rows = profile_app_import()
+    total = next((r["cumulative_ms"] for r in rows if r["module"] == "app"), None)
+    print(f"⏱️ import app: {total:.0f} ms cumulative\n" if total else "")
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for row in sorted(rows, key=lambda r: r["cumulative_ms"], reverse=True)[:args.top]:
+        print(f"{row['cumulative_ms']:>14.1f} {row['self_ms']:>9.1f}  {'  ' * row['depth']}{row['module']}")
+
+    imported = {r["module"] for r in rows}
+    print("\n📦 Watched modules imported at startup:")
+    for name in WATCHED_MODULES:
+        print(f" - {name}: {'yes' if name in imported else 'no'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
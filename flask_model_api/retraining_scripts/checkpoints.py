@@ -0,0 +1,146 @@
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import joblib
+"""
+==========================
+STAGE CHECKPOINTS (checkpoints.py)
+==========================
+run_retraining() is a chain of stages, and each stage's output is saved before the next one starts:
+
+    clean       df_full                                   key: sha256 of every input workbook + CLEANING_VERSION
+    features    encoder, scaler, X_combined               key: clean key + FEATURES_VERSION
+    embedding   umap_model, embedding, info               key: features key + mode + UMAP parameters (+ previous
+                (sample mode: also clusterer and labels)       model for incremental, + HDBSCAN/sample settings)
+    labels      clusterer, labels                         key: embedding key + HDBSCAN parameters
+
+Because every key includes the key of the stage before it, changing an input invalidates everything
+downstream and nothing upstream: a retrain that died in HDBSCAN resumes from the saved embedding, and
+a retrain with only new HDBSCAN parameters reuses the embedding as well.
+
+Layout: checkpoints/<stage>/<key>/ with one file per object (DataFrame -> .parquet, numpy array -> .npy,
+anything else -> .pkl) and meta.json. The folder is built under a temporary name and renamed into
+place, so a checkpoint either exists completely or not at all. Only the newest CHECKPOINT_KEEP
+checkpoints per stage are kept.
+
+Arrays are loaded memory-mapped (copy-on-write), and an array written into a scratch_path() memmap
+(chunked_features.py) is moved into its checkpoint instead of being copied.
+
+Used in: retrain_model.py (RETRAIN_CHECKPOINTS=0 disables it)
+"""
+
+CHECKPOINT_DIR = os.getenv(
+    "RETRAIN_CHECKPOINT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoints")
+)
+CHECKPOINT_KEEP = int(os.getenv("RETRAIN_CHECKPOINT_KEEP", "2"))
+
+
+# Stable short hash of any JSON-like parts (parameters dicts, version numbers, other keys)
+def checkpoint_key(*parts):
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+class CheckpointStore:
+    def __init__(self, root=None, enabled=True, keep=CHECKPOINT_KEEP):
+        self.root = root or CHECKPOINT_DIR
+        self.enabled = enabled
+        self.keep = keep
+        # stage -> {"key", "status": "hit" | "saved"}, reported in the retrain report
+        self.outcomes = {}
+
+    def _dir(self, stage, key):
+        return os.path.join(self.root, stage, key)
+
+    def load(self, stage, key):
+        folder = self._dir(stage, key)
+        if not self.enabled or not os.path.exists(os.path.join(folder, "meta.json")):
+            return None
+        with open(os.path.join(folder, "meta.json")) as f:
+            meta = json.load(f)
+
+        objects = {}
+        for name, kind in meta["objects"].items():
+            path = os.path.join(folder, f"{name}.{kind}")
+            if kind == "parquet":
+                objects[name] = pd.read_parquet(path)
+            elif kind == "npy":
+                objects[name] = np.load(path, mmap_mode="c")
+            else:
+                objects[name] = joblib.load(path)
+        self.outcomes[stage] = {"key": key, "status": "hit"}
+        return objects
+
+    def save(self, stage, key, **objects):
+        if not self.enabled:
+            return
+        folder = self._dir(stage, key)
+        tmp_folder = f"{folder}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        os.makedirs(tmp_folder)
+
+        kinds = {}
+        for name, value in objects.items():
+            if isinstance(value, pd.DataFrame):
+                kinds[name] = "parquet"
+                value.to_parquet(os.path.join(tmp_folder, f"{name}.parquet"))
+            elif isinstance(value, np.memmap) and self._is_scratch(value.filename):
+                kinds[name] = "npy"
+                value.flush()
+                os.replace(value.filename, os.path.join(tmp_folder, f"{name}.npy"))
+            elif isinstance(value, np.ndarray) and value.dtype != object:
+                kinds[name] = "npy"
+                np.save(os.path.join(tmp_folder, f"{name}.npy"), value)
+            else:
+                kinds[name] = "pkl"
+                joblib.dump(value, os.path.join(tmp_folder, f"{name}.pkl"))
+        with open(os.path.join(tmp_folder, "meta.json"), "w") as f:
+            json.dump({"stage": stage, "key": key, "objects": kinds,
+                       "created_at": datetime.now().isoformat(timespec="seconds")}, f, indent=2)
+
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp_folder, folder)
+        self.outcomes[stage] = {"key": key, "status": "saved"}
+        self.prune(stage, current=key)
+
+    # .npy path for a large array built in pieces before its stage is saved. Files of earlier
+    # processes are left-overs (retrains hold the retrain lock) and are removed.
+    def scratch_path(self, name):
+        folder = os.path.join(self.root, ".scratch")
+        os.makedirs(folder, exist_ok=True)
+        for old in os.listdir(folder):
+            if not old.endswith(f"-{os.getpid()}.npy"):
+                os.remove(os.path.join(folder, old))
+        return os.path.join(folder, f"{name}-{os.getpid()}.npy")
+
+    def _is_scratch(self, path):
+        return bool(path) and os.path.dirname(os.path.abspath(path)) == os.path.join(os.path.abspath(self.root), ".scratch")
+
+    # Return fn(*args)'s outputs for `stage`, from the checkpoint when one exists for `key`.
+    # names labels the items of the tuple fn returns.
+    def cached(self, stage, key, names, fn, *args, **kwargs):
+        saved = self.load(stage, key)
+        if saved is not None:
+            print(f"♻️ Resuming from {stage} checkpoint {key}")
+            return tuple(saved[name] for name in names)
+        result = fn(*args, **kwargs)
+        self.save(stage, key, **dict(zip(names, result)))
+        return result
+
+    def prune(self, stage, current=None):
+        stage_dir = os.path.join(self.root, stage)
+        # Half-written folders of runs that died while saving
+        for name in os.listdir(stage_dir):
+            if ".tmp-" in name:
+                shutil.rmtree(os.path.join(stage_dir, name), ignore_errors=True)
+        entries = [
+            os.path.join(stage_dir, name) for name in os.listdir(stage_dir)
+            if name != current and os.path.exists(os.path.join(stage_dir, name, "meta.json"))
+        ]
+        entries.sort(key=lambda path: os.path.getmtime(os.path.join(path, "meta.json")), reverse=True)
+        for path in entries[max(self.keep - 1, 0):]:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,106 @@
+import os
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+from data_ingest import load_snapshot, filter_join_dates
+from features import engineer_features, make_encoder, encode_features
+"""
+==========================
+CHUNKED FEATURES (chunked_features.py)
+==========================
+Builds the same encoder, scaler and feature matrix as retrain_model.build_features(), without ever
+holding the whole dense matrix (or its float64 intermediates) in memory:
+
+1. First pass over the history, one chunk at a time: collect every category of each one-hot column
+   and update the scaler statistics with StandardScaler.partial_fit. The encoder is then fitted on a
+   small frame that contains each collected category, so it ends up with the same categories_ as a
+   fit on all rows.
+2. Second pass: encode each chunk with features.encode_features() straight into its rows of a
+   float32 .npy file opened with np.lib.format.open_memmap. Only one chunk is ever in RAM; UMAP
+   reads the rest from the page cache.
+
+Chunks come from the Parquet snapshot cache one workbook at a time (split into FEATURE_CHUNK_ROWS
+row slices), and go through the same cross-file steps as load_training_data(): duplicates are dropped
+(keep first) and then filter_join_dates(). The rows of the matrix are therefore in the same order as
+df_full. Duplicates are found by 64-bit row hashes (pd.util.hash_pandas_object) of the rows seen so
+far, kept as sorted arrays (one per finished workbook, one per chunk of the current one) so each is
+sorted once. Unlike drop_duplicates the rows themselves are not compared: two distinct rows with equal
+hashes would drop the later one and shift the matrix against df_full. With n rows that happens with
+probability about n^2 / 2^65 (under 1e-5 for 10 million rows).
+
+Only the feature matrix is out of core. run_retraining still loads the cleaned history as df_full
+(load_training_data) and adds the engineered columns to it, because customer ids, the sample-mode
+strata, incremental warm starts, the row-encoder check and the personas all read it row by row.
+Peak memory therefore still grows with the number of rows (a few small columns per row); what this
+removes is the dense float64 one-hot matrix and its intermediates, by far the largest allocation.
+
+Used in: retrain_model.py (RETRAIN_CHUNKED_FEATURES=1)
+"""
+
+FEATURE_CHUNK_ROWS = int(os.getenv("RETRAIN_FEATURE_CHUNK_ROWS", "100000"))
+
+
+# Which of `hashes` occur in any of the sorted (non-empty) hash arrays
+def _seen_before(hashes, sorted_arrays):
+    found = np.zeros(len(hashes), dtype=bool)
+    for seen in sorted_arrays:
+        position = np.minimum(np.searchsorted(seen, hashes), len(seen) - 1)
+        found |= seen[position] == hashes
+    return found
+
+
+# Cleaned, de-duplicated chunks of every workbook in `paths`, in the order of load_training_data()
+def iter_chunks(paths, chunk_rows=FEATURE_CHUNK_ROWS):
+    seen = []
+    for path in paths:
+        df, _ = load_snapshot(path)
+        file_seen = []
+        for start in range(0, len(df), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+            keep = ~_seen_before(hashes, seen + file_seen) & ~pd.Series(hashes).duplicated().to_numpy()
+            if keep.any():
+                file_seen.append(np.sort(hashes[keep]))
+            chunk = filter_join_dates(chunk[keep]).reset_index(drop=True)
+            if len(chunk):
+                yield chunk
+        if file_seen:
+            seen.append(np.sort(np.concatenate(file_seen)))
+
+
+# Encoder fitted on one row per category (columns padded by repeating their categories)
+def _fit_encoder(categories):
+    n_rows = max(len(values) for values in categories.values())
+    frame = pd.DataFrame({col: np.resize(values, n_rows) for col, values in categories.items()})
+    return make_encoder().fit(frame)
+
+
+# out_path: .npy file the matrix is written to.
+# Returns (encoder, scaler, X_combined) with X_combined a float32 memmap of out_path.
+def build_features_chunked(paths, out_path, chunk_rows=FEATURE_CHUNK_ROWS):
+    print(f"🧩 Fitting encoder and scaler in chunks of {chunk_rows} rows...")
+    categories = {}
+    scaler = StandardScaler()
+    n_rows = 0
+    for chunk in iter_chunks(paths, chunk_rows):
+        df_cat, df_num = engineer_features(chunk)
+        for col in df_cat.columns:
+            known = categories.get(col, np.empty(0, dtype=df_cat[col].dtype))
+            categories[col] = pd.unique(np.concatenate([known, df_cat[col].unique()]))
+        scaler.partial_fit(df_num)
+        n_rows += len(chunk)
+
+    if not n_rows:
+        raise ValueError("❌ No data found in uploads or base_data.")
+    encoder = _fit_encoder(categories)
+
+    n_features = sum(len(cats) for cats in encoder.categories_) + scaler.n_features_in_
+    print(f"🧩 Writing {n_rows} x {n_features} float32 feature matrix to {out_path}")
+    X_combined = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float32, shape=(n_rows, n_features))
+    row = 0
+    for chunk in iter_chunks(paths, chunk_rows):
+        df_cat, df_num = engineer_features(chunk)
+        encode_features(encoder, scaler, df_cat, df_num, out=X_combined[row:row + len(chunk)])
+        row += len(chunk)
+    X_combined.flush()
+    return encoder, scaler, X_combined
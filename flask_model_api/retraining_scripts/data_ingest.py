@@ -0,0 +1,171 @@
+import os
+import time
+import json
+import hashlib
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+"""
+==========================
+DATA INGEST + SNAPSHOT CACHE (data_ingest.py)
+==========================
+Reads one customer workbook and returns it cleaned and typed, with the five standard columns:
+    Customer ID (str), Gender (str), Loyalty Tier (str), Date Joined (datetime64), Location (str)
+
+Parsing .xlsx files is by far the slowest part of loading the history, and the files under
+base_data/<date>/ never change once they are archived. load_snapshot() therefore converts each
+workbook once into a Parquet file under snapshot_cache/ and records it in snapshot_cache/manifest.json,
+keyed by the sha256 of the source workbook. Later retrains read the cached Parquet columns and only
+new uploads go through pd.read_excel.
+
+Bump CLEANING_VERSION whenever clean_snapshot() changes, so old cache entries are rebuilt.
+
+load_snapshots() runs load_snapshot() for many workbooks in a process pool (Excel parsing and the
+pandas string cleaning are CPU-bound and hold the GIL). Workers only write their own Parquet file;
+the parent process updates the manifest once at the end, so workers never race on manifest.json.
+
+Used in: retrain_model.py (load_snapshots, filter_join_dates)
+"""
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BASE_DIR, "snapshot_cache")
+CLEANING_VERSION = 1
+
+# Worker processes used by load_snapshots() (RETRAIN_WORKERS env var, default: number of CPUs)
+DEFAULT_WORKERS = int(os.getenv("RETRAIN_WORKERS", "0")) or (os.cpu_count() or 1)
+
+STANDARD_COLUMNS = ['Customer ID', 'Gender', 'Loyalty Tier', 'Date Joined', 'Location']
+
+# Normalize column names and resolve aliases
+COLUMN_ALIASES = {
+    'Customer ID': ['customer id', 'customer_id', 'cust_id', 'id'],
+    'Gender': ['gender', 'sex'],
+    'Loyalty Tier': ['loyalty tier', 'loyalty_tier', 'tier', 'membership_level'],
+    'Date Joined': ['date joined', 'date_joined', 'joined_date', 'ks date', 'join_date'],
+    'Location': ['location', 'branch', 'region']
+}
+
+
+# Clean one raw workbook: alias resolution, type coercion, whitespace/case fixes and tier filtering.
+# The "joined in the future" filter depends on today's date and is applied later by filter_join_dates().
+def clean_snapshot(df, source=""):
+    df = df.copy()
+    df.columns = [str(col).strip().lower() for col in df.columns]
+
+    for standard_name, aliases in COLUMN_ALIASES.items():
+        found = None
+        for alias in aliases:
+            if alias.lower() in df.columns:
+                found = alias.lower()
+                break
+        if found:
+            df.rename(columns={found: standard_name}, inplace=True)
+        else:
+            raise ValueError(f"❌ Missing required column: {standard_name} in {source or 'workbook'}")
+
+    df = df[STANDARD_COLUMNS]
+    df = df.dropna(subset=STANDARD_COLUMNS)
+    df['Date Joined'] = pd.to_datetime(df['Date Joined'], errors='coerce')
+    df = df[df['Date Joined'].notna()]
+
+    df['Customer ID'] = df['Customer ID'].astype(str).str.strip()
+    df['Gender'] = df['Gender'].astype(str).str.strip().str.title()
+    df['Location'] = df['Location'].astype(str).str.strip().str.title()
+    df['Loyalty Tier'] = df['Loyalty Tier'].astype(str).str.strip().str.title()
+
+    df = df[df['Loyalty Tier'].isin(['Silver', 'Gold', 'Platinum'])]
+    return df.reset_index(drop=True)
+
+
+def filter_join_dates(df):
+    return df[df['Date Joined'] <= pd.Timestamp.today()]
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _write_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def _manifest_entry(path, checksum, parquet_path, rows):
+    return {
+        "source": os.path.relpath(path, BASE_DIR),
+        "sha256": checksum,
+        "cleaning_version": CLEANING_VERSION,
+        "parquet": os.path.basename(parquet_path),
+        "rows": rows,
+        "cached_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+# Return the cleaned frame for one workbook, from the Parquet cache when its checksum is known.
+# Returns (df, info); info has the cache outcome, row count, timing and (on a miss) the new manifest entry.
+# With update_manifest=False the caller is responsible for saving info["manifest_entry"].
+def load_snapshot(path, use_cache=True, cache_dir=None, update_manifest=True):
+    start = time.perf_counter()
+    cache_dir = cache_dir or CACHE_DIR
+    manifest_path = os.path.join(cache_dir, "manifest.json")
+    checksum = file_sha256(path)
+    cache_key = f"{checksum}-v{CLEANING_VERSION}"
+    parquet_path = os.path.join(cache_dir, f"{cache_key}.parquet")
+    info = {"source": path, "sha256": checksum, "cache_key": cache_key, "worker_pid": os.getpid()}
+
+    if use_cache and cache_key in _read_manifest(manifest_path) and os.path.exists(parquet_path):
+        df = pd.read_parquet(parquet_path)
+        info.update(cache="hit", rows=len(df), seconds=round(time.perf_counter() - start, 4))
+        return df, info
+
+    df = clean_snapshot(pd.read_excel(path), source=path)
+    info.update(cache="miss" if use_cache else "off", rows=len(df))
+
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = parquet_path + f".{os.getpid()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, parquet_path)
+        info["manifest_entry"] = _manifest_entry(path, checksum, parquet_path, len(df))
+        if update_manifest:
+            manifest = _read_manifest(manifest_path)
+            manifest[cache_key] = info["manifest_entry"]
+            _write_manifest(manifest, manifest_path)
+
+    info["seconds"] = round(time.perf_counter() - start, 4)
+    return df, info
+
+
+def _load_snapshot_task(path, use_cache, cache_dir):
+    return load_snapshot(path, use_cache=use_cache, cache_dir=cache_dir, update_manifest=False)
+
+
+# Load and clean many workbooks in parallel. Returns [(df, info), ...] in the order of `paths`.
+def load_snapshots(paths, workers=None, use_cache=True):
+    workers = max(1, min(workers or DEFAULT_WORKERS, len(paths) or 1))
+    if workers == 1:
+        results = [_load_snapshot_task(path, use_cache, CACHE_DIR) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_load_snapshot_task, paths, [use_cache] * len(paths), [CACHE_DIR] * len(paths)))
+
+    new_entries = {info["cache_key"]: info.pop("manifest_entry") for _, info in results if "manifest_entry" in info}
+    if new_entries:
+        manifest_path = os.path.join(CACHE_DIR, "manifest.json")
+        manifest = _read_manifest(manifest_path)
+        manifest.update(new_entries)
+        _write_manifest(manifest, manifest_path)
+    return results
@@ -0,0 +1,181 @@
+import os
+import sys
+import json
+import argparse
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2_contingency
+from hdbscan import approximate_predict
+from retrain_model import (
+    list_workbooks, run_retraining, retrain_lock, BASE_DIR, RETRAIN_LOCK_FILE, LOCK_BUSY_EXIT_CODE,
+)
+from model_registry import load_inference_bundle
+from features import engineer_features, encode_features
+from data_ingest import load_snapshots, filter_join_dates
+from filelock import Timeout
+"""
+==========================
+DRIFT CHECK (drift_check.py)
+==========================
+Decides whether the pending uploads justify a full UMAP + HDBSCAN refit, instead of refitting on a
+fixed calendar whether or not the customers changed.
+
+Two cheap signals, both computed from the Parquet snapshot cache and the live inference bundle:
+
+1. Feature distributions: for Location, Loyalty Tier, Join_Year and Join_Month the histogram of the
+   new uploads is compared with the training snapshot (every workbook under base_data/):
+       psi       population stability index (< 0.1 stable, 0.1-0.2 moderate, > 0.2 significant shift)
+       chi2      chi-square test of the 2 x k contingency table, with its p-value (reported only: with
+                 thousands of rows almost any difference is "significant")
+   A feature drifts when its PSI exceeds DRIFT_PSI_THRESHOLD.
+2. Noise share: the new rows are pushed through the live models (encoder -> scaler -> UMAP ->
+   approximate_predict). Customers the current clusters cannot place come back as -1; above
+   DRIFT_NOISE_THRESHOLD the clustering no longer describes the new data.
+
+check_drift() returns the report with "retrain": true/false and the reasons, and writes it to
+drift_reports/<timestamp>.json. Without new uploads there is nothing to retrain on.
+
+Used in: scheduler.py (runs `python drift_check.py --retrain` on its cron trigger)
+
+Run from retraining_scripts:
+    python drift_check.py              # report only
+    python drift_check.py --retrain    # retrain (under the retrain lock) when drift is found
+"""
+
+DRIFT_PSI_THRESHOLD = float(os.getenv("DRIFT_PSI_THRESHOLD", "0.2"))
+DRIFT_NOISE_THRESHOLD = float(os.getenv("DRIFT_NOISE_THRESHOLD", "0.2"))
+
+# Upper bound on new rows embedded for the noise share (UMAP transform is the expensive part)
+NOISE_SAMPLE_ROWS = 5000
+
+REPORT_DIR = os.path.join(BASE_DIR, "drift_reports")
+
+# Small probability given to empty bins so PSI stays finite for categories present on one side only
+PSI_EPSILON = 1e-4
+
+
+def _drift_columns(df):
+    return {
+        "Location": df["Location"],
+        "Loyalty Tier": df["Loyalty Tier"],
+        "Join_Year": df["Date Joined"].dt.year,
+        "Join_Month": df["Date Joined"].dt.month,
+    }
+
+
+def population_stability_index(expected_counts, actual_counts):
+    expected = np.maximum(expected_counts / expected_counts.sum(), PSI_EPSILON)
+    actual = np.maximum(actual_counts / actual_counts.sum(), PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+# Compare the histogram of one column between the training snapshot and the new rows
+def compare_histograms(reference, current, psi_threshold=DRIFT_PSI_THRESHOLD):
+    counts = pd.concat(
+        [reference.value_counts().rename("reference"), current.value_counts().rename("current")], axis=1
+    ).fillna(0)
+    psi = population_stability_index(counts["reference"].to_numpy(), counts["current"].to_numpy())
+    if len(counts) > 1:
+        chi2, p_value, _, _ = chi2_contingency(counts.T.to_numpy())
+    else:
+        chi2, p_value = 0.0, 1.0
+    return {
+        "psi": round(psi, 4),
+        "chi2": round(float(chi2), 2),
+        "p_value": float(p_value),
+        "new_categories": [str(c) for c in counts.index[counts["reference"] == 0]],
+        "drifted": psi > psi_threshold,
+    }
+
+
+# Share of rows the live clusters label as noise (sampled to at most NOISE_SAMPLE_ROWS)
+def noise_share(df, models, sample_rows=NOISE_SAMPLE_ROWS):
+    if len(df) > sample_rows:
+        df = df.sample(n=sample_rows, random_state=0)
+    df_cat, df_num = engineer_features(df.copy())
+    combined = encode_features(models["encoder"], models["scaler"], df_cat, df_num)
+    labels, _ = approximate_predict(models["clusterer"], models["umap_model"].transform(combined))
+    return round(float((labels == -1).mean()), 4), len(df)
+
+
+def _load(paths):
+    frames = [df for df, _ in load_snapshots(paths)] if paths else []
+    if not frames:
+        return None
+    return filter_join_dates(pd.concat(frames, ignore_index=True).drop_duplicates())
+
+
+def save_report(report, report_dir=None):
+    report_dir = report_dir or REPORT_DIR
+    os.makedirs(report_dir, exist_ok=True)
+    path = os.path.join(report_dir, f"{datetime.now().strftime('%Y%m%dT%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    return path
+
+
+def check_drift(psi_threshold=DRIFT_PSI_THRESHOLD, noise_threshold=DRIFT_NOISE_THRESHOLD, save=True):
+    base_paths, upload_paths, upload_files = list_workbooks()
+    report = {
+        "checked_at": datetime.now().isoformat(timespec="seconds"),
+        "upload_files": upload_files,
+        "thresholds": {"psi": psi_threshold, "noise_share": noise_threshold},
+        "features": {},
+        "noise": None,
+        "reasons": [],
+        "retrain": False,
+    }
+
+    current = _load(upload_paths)
+    report["new_rows"] = 0 if current is None else len(current)
+    if not report["new_rows"]:
+        report["reasons"].append("no new uploads")
+    else:
+        reference = _load(base_paths)
+        report["reference_rows"] = 0 if reference is None else len(reference)
+        if reference is None:
+            report["reasons"].append("no training snapshot in base_data")
+        else:
+            reference_columns, current_columns = _drift_columns(reference), _drift_columns(current)
+            for name in reference_columns:
+                result = compare_histograms(reference_columns[name], current_columns[name], psi_threshold)
+                report["features"][name] = result
+                if result["drifted"]:
+                    report["reasons"].append(f"{name} PSI {result['psi']} > {psi_threshold}")
+
+        models = load_inference_bundle()
+        share, sampled = noise_share(current, models)
+        report["model_version"] = models["version"]
+        report["noise"] = {"share": share, "sampled_rows": sampled}
+        if share > noise_threshold:
+            report["reasons"].append(f"noise share {share} > {noise_threshold}")
+
+        # Without a training snapshot there is nothing to compare with; treat the data as new
+        report["retrain"] = bool(report["reasons"])
+
+    if save:
+        report["report_path"] = save_report(report)
+
+    verdict = "🔁 Drift detected, retraining needed" if report["retrain"] else "✅ No significant drift"
+    print(f"{verdict}: {', '.join(report['reasons']) or 'all features within thresholds'}")
+    for name, result in report["features"].items():
+        print(f"   {name}: PSI {result['psi']}, chi2 {result['chi2']} (p={result['p_value']:.3g})")
+    if report["noise"]:
+        print(f"   noise share of new rows: {report['noise']['share']}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the pending uploads for drift against the training data")
+    parser.add_argument("--retrain", action="store_true", help="run the retraining when drift is found")
+    args = parser.parse_args()
+
+    drift = check_drift()
+    if args.retrain and drift["retrain"]:
+        try:
+            with retrain_lock().acquire(timeout=0):
+                run_retraining(drift_report=drift)
+        except Timeout:
+            print(f"❌ Another retraining is running (lock held on {RETRAIN_LOCK_FILE})")
+            sys.exit(LOCK_BUSY_EXIT_CODE)
@@ -0,0 +1,190 @@
+import os
+import time
+import numpy as np
+import umap
+import hdbscan
+from hdbscan import approximate_predict
+from sklearn.metrics import adjusted_rand_score
+from sklearn.manifold import trustworthiness
+from features import encode_features
+"""
+==========================
+FIT MODES (fit_modes.py)
+==========================
+The ways run_retraining can fit UMAP on the encoded customer matrix X:
+
+full          fit a brand-new UMAP on every row (the original behaviour)
+incremental   warm start from the previous model: rows whose Customer ID was in the previous
+              training set start at their previous embedding, new rows start at
+              previous_umap.transform(row), then only INCREMENTAL_EPOCHS of optimization are run.
+              The kNN graph is still rebuilt on all rows; the saving is in the layout epochs.
+sample        fit UMAP and HDBSCAN on a stratified sample (Location x Loyalty Tier x Join_Year, at
+              least one row per stratum) of SAMPLE_SIZE rows, then place every other row in batches
+              of ASSIGN_BATCH_SIZE with umap_model.transform + approximate_predict, the same path
+              serving uses. Labels come back for the whole population, so personas still describe
+              every customer. For histories too large to fit UMAP on in RAM/time.
+
+In full and incremental mode HDBSCAN is refit on the resulting embedding (fit_clusterer).
+compare_runs() puts a candidate run next to a full refit (ARI of the labels, noise share,
+trustworthiness of the embedding, fit seconds) for the retrain report.
+
+Used in: retrain_model.py
+"""
+
+# Layout epochs for a warm-started UMAP (a full fit uses 200 epochs on large data, 500 on small)
+INCREMENTAL_EPOCHS = int(os.getenv("RETRAIN_INCREMENTAL_EPOCHS", "50"))
+
+# Rows the sample mode fits on, and rows per transform/approximate_predict batch when assigning the rest
+SAMPLE_SIZE = int(os.getenv("RETRAIN_SAMPLE_SIZE", "50000"))
+ASSIGN_BATCH_SIZE = int(os.getenv("RETRAIN_ASSIGN_BATCH_SIZE", "20000"))
+STRATA_COLUMNS = ["Location", "Loyalty Tier", "Join_Year"]
+
+# Rows sampled for the trustworthiness score (it is quadratic in the number of rows)
+QUALITY_SAMPLE_ROWS = 2000
+
+
+def fit_umap_full(X, umap_params):
+    start = time.perf_counter()
+    model = umap.UMAP(**umap_params)
+    embedding = model.fit_transform(X)
+    return model, embedding, {"mode": "full", "seconds": round(time.perf_counter() - start, 3)}
+
+
+# Encode rows with the *previous* encoder/scaler so the previous UMAP can transform them
+def _encode_for_previous(df_cat, df_num, previous):
+    return encode_features(previous["encoder"], previous["scaler"], df_cat, df_num)
+
+
+# Warm-started UMAP fit. previous: dict from model_registry.load_models() plus "training_customer_ids".
+# customer_ids, df_cat and df_num are aligned row by row with X.
+def fit_umap_incremental(X, customer_ids, df_cat, df_num, umap_params, previous, n_epochs=INCREMENTAL_EPOCHS):
+    start = time.perf_counter()
+    previous_umap = previous["umap_model"]
+    if len(previous["training_customer_ids"]) != len(previous_umap.embedding_):
+        # e.g. a version published by an older sample-mode retrain with the IDs of every row
+        print(f"⚠️ Previous model has {len(previous['training_customer_ids'])} training Customer IDs but "
+              f"{len(previous_umap.embedding_)} embedded rows, falling back to a full UMAP refit")
+        model, embedding, info = fit_umap_full(X, umap_params)
+        return model, embedding, {**info, "fallback": "training_customer_ids do not match the previous embedding"}
+    position = {cid: i for i, cid in enumerate(previous["training_customer_ids"])}
+    index = np.array([position.get(cid, -1) for cid in customer_ids])
+    seen = index >= 0
+
+    init = np.empty((X.shape[0], previous_umap.embedding_.shape[1]), dtype=np.float32)
+    init[seen] = previous_umap.embedding_[index[seen]]
+    if (~seen).any():
+        init[~seen] = previous_umap.transform(_encode_for_previous(df_cat[~seen], df_num[~seen], previous))
+
+    model = umap.UMAP(**{**umap_params, "init": init, "n_epochs": n_epochs})
+    embedding = model.fit_transform(X)
+
+    # Keep get_params() reusable by the next retrain (the init array only fits this run's rows)
+    model.init = umap_params.get("init", "spectral")
+    model.n_epochs = umap_params.get("n_epochs")
+
+    return model, embedding, {
+        "mode": "incremental",
+        "seconds": round(time.perf_counter() - start, 3),
+        "seen_rows": int(seen.sum()),
+        "new_rows": int((~seen).sum()),
+        "n_epochs": n_epochs,
+    }
+
+
+def fit_clusterer(embedding, hdbscan_params):
+    clusterer = hdbscan.HDBSCAN(**hdbscan_params)
+    labels = clusterer.fit_predict(embedding)
+    return clusterer, labels
+
+
+# Row positions of a proportional stratified sample of df (aligned with X).
+# Every stratum keeps at least one row so rare location/tier/year combinations are still fitted.
+def stratified_sample(df, size, seed=0):
+    if size >= len(df):
+        return np.arange(len(df))
+    fraction = size / len(df)
+    strata = df[STRATA_COLUMNS].reset_index(drop=True)
+    sampled = strata.groupby(STRATA_COLUMNS, observed=True, group_keys=False).apply(
+        lambda group: group.sample(n=max(1, round(len(group) * fraction)), random_state=seed),
+        include_groups=False,
+    )
+    return np.sort(sampled.index.to_numpy())
+
+
+# Embed and label rows of X with already fitted models, batch_size rows at a time
+def assign_in_batches(X, rows, umap_model, clusterer, batch_size=ASSIGN_BATCH_SIZE):
+    embedding = np.empty((len(rows), umap_model.n_components), dtype=np.float32)
+    labels = np.empty(len(rows), dtype=int)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        embedding[start:start + len(batch)] = umap_model.transform(X[batch])
+        labels[start:start + len(batch)], _ = approximate_predict(clusterer, embedding[start:start + len(batch)])
+    return embedding, labels
+
+
+# Fit on a stratified sample and assign the remaining rows. df supplies the strata columns, aligned with X.
+# Returns (umap_model, clusterer, embedding, labels, sample_rows, info) with embedding/labels for every
+# row of X; sample_rows are the positions UMAP was fitted on (the rows of umap_model.embedding_).
+def fit_on_sample(X, df, umap_params, hdbscan_params, sample_size=SAMPLE_SIZE, batch_size=ASSIGN_BATCH_SIZE,
+                  progress=None):
+    start = time.perf_counter()
+    sample_rows = stratified_sample(df, sample_size)
+    rest_rows = np.setdiff1d(np.arange(X.shape[0]), sample_rows)
+
+    model = umap.UMAP(**umap_params)
+    sample_embedding = model.fit_transform(X[sample_rows])
+    if progress:
+        progress("hdbscan")
+    # approximate_predict needs the prediction data, whatever the previous model was fitted with
+    clusterer, sample_labels = fit_clusterer(sample_embedding, {**hdbscan_params, "prediction_data": True})
+    fit_seconds = time.perf_counter() - start
+
+    embedding = np.empty((X.shape[0], sample_embedding.shape[1]), dtype=np.float32)
+    labels = np.empty(X.shape[0], dtype=int)
+    embedding[sample_rows], labels[sample_rows] = sample_embedding, sample_labels
+    if len(rest_rows):
+        embedding[rest_rows], labels[rest_rows] = assign_in_batches(X, rest_rows, model, clusterer, batch_size)
+
+    seconds = time.perf_counter() - start
+    return model, clusterer, embedding, labels, sample_rows, {
+        "mode": "sample",
+        "seconds": round(seconds, 3),
+        "sample_fit_seconds": round(fit_seconds, 3),
+        "assign_seconds": round(seconds - fit_seconds, 3),
+        "sample_rows": int(len(sample_rows)),
+        "assigned_rows": int(len(rest_rows)),
+        "strata": int(df.groupby(STRATA_COLUMNS, observed=True).ngroups),
+        "batch_size": batch_size,
+    }
+
+
+def clustering_summary(labels):
+    labels = np.asarray(labels)
+    return {
+        "n_clusters": int(len(set(labels)) - (1 if -1 in labels else 0)),
+        "noise_fraction": round(float((labels == -1).mean()), 4),
+    }
+
+
+def _trustworthiness(X, embedding, seed=0):
+    rows = np.random.default_rng(seed).choice(X.shape[0], min(QUALITY_SAMPLE_ROWS, X.shape[0]), replace=False)
+    return round(float(trustworthiness(X[rows], embedding[rows], n_neighbors=15)), 4)
+
+
+def _run_summary(X, run):
+    return {
+        **clustering_summary(run["labels"]),
+        "trustworthiness": _trustworthiness(X, run["embedding"]),
+        "fit_seconds": run["seconds"],
+    }
+
+
+# Quality/runtime delta of a candidate run against a full refit on the same X.
+# Each run is a dict with "embedding" and "labels" for every row of X, and "seconds" for UMAP + HDBSCAN.
+def compare_runs(X, candidate, full):
+    return {
+        "candidate": _run_summary(X, candidate),
+        "full": _run_summary(X, full),
+        "adjusted_rand_index": round(float(adjusted_rand_score(full["labels"], candidate["labels"])), 4),
+        "seconds_saved": round(full["seconds"] - candidate["seconds"], 3),
+    }
@@ -1,7 +1,14 @@
 import os
+import sys
 import joblib
 
-BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "production_models")
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import current_version, VERSIONS_DIR, REGISTRY_DIR
+
+# Inspect the live registry version (falls back to the flat legacy files)
+LIVE_VERSION = current_version()
+BASE_DIR = os.path.join(VERSIONS_DIR, LIVE_VERSION) if LIVE_VERSION else REGISTRY_DIR
+print(f"🔎 Inspecting model version: {LIVE_VERSION or 'legacy'}")
 
 def check_file(name):
     path = os.path.join(BASE_DIR, name)
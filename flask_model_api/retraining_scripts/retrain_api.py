@@ -1,19 +1,53 @@
-from flask import Flask, request, jsonify
 import os
-from retrain_model import run_retraining
+
+# Retraining runs numba code (UMAP) in a background thread. With the OpenMP threading layer that
+# leaves libgomp's thread pool unable to shut down and the process hangs on exit; workqueue does not.
+# Only one retrain thread runs at a time (retrain lock), which is all workqueue supports.
+os.environ.setdefault("NUMBA_THREADING_LAYER", "workqueue")
+
+from flask import Flask, request, jsonify
+import threading
+from filelock import Timeout
+from retrain_model import run_retraining, retrain_lock, RETRAIN_STAGES
+from job_store import create_job, get_job, list_jobs, start_stage, finish_job, recover_jobs
 """
-Retraining API Endpoint (POST /retrain)
+Retraining API Endpoints (POST /retrain, GET /retrain/<job_id>)
 
 This API is not currently used in the main system but is included for future use.
 It allows retraining to be triggered via an HTTP request instead of running retrain_model.py manually.
 
-Use case: 
+Retraining takes minutes, so POST /retrain only saves the uploaded files, starts run_retraining() in a
+background thread and answers 202 with a job id. GET /retrain/<job_id> returns the job's state from
+job_store.py: status, the stage currently running (ingest, clean, encode, umap, hdbscan, personas,
+publish) with per-stage timings, and the published model version once it has finished.
+
+Only one retraining can run at a time (also across processes: the scheduler and the CLI take the same
+retrain lock). A POST while one is running is rejected with 409 and the running job's id, before its
+files are saved, so they cannot leak into the running job's uploads.
+
+Use case:
 Useful for adding a frontend button, Postman trigger, or automated retraining pipeline later on.
 """
 app = Flask(__name__)
 UPLOAD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uploads')
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Jobs left "running" by a previous server process are reported as interrupted
+recover_jobs("retrain")
+
+
+def run_retrain_job(job_id, lock):
+    try:
+        version_id = run_retraining(progress=lambda stage: start_stage(job_id, stage))
+        finish_job(job_id, result={"model_version": version_id})
+        print(f"✅ Retraining job {job_id} published model {version_id}")
+    except Exception as e:
+        finish_job(job_id, error=str(e))
+        print(f"❌ Retraining job {job_id} failed: {e}")
+    finally:
+        lock.release()
+
+
 @app.route('/retrain', methods=['POST'])
 def retrain():
     if 'files' not in request.files:
@@ -28,15 +62,42 @@ def retrain():
         ext = os.path.splitext(file.filename)[1]
         if ext.lower() not in allowed_extensions:
             return jsonify({"error": f"Invalid file type: {file.filename}"}), 400
-        file.save(os.path.join(UPLOAD_DIR, file.filename))
 
-    print(" Uploaded files:", [file.filename for file in files])
+    lock = retrain_lock()
+    try:
+        lock.acquire(timeout=0)
+    except Timeout:
+        running = list_jobs("retrain", status="running") + list_jobs("retrain", status="queued")
+        return jsonify({
+            "error": "A retraining is already running",
+            "job_id": running[-1]["id"] if running else None,
+        }), 409
 
     try:
-        run_retraining()
-        return jsonify({"message": "Retraining completed successfully."}), 200
+        for file in files:
+            file.save(os.path.join(UPLOAD_DIR, file.filename))
+        print(" Uploaded files:", [file.filename for file in files])
+
+        job = create_job("retrain", params={"files": [file.filename for file in files]}, stages=RETRAIN_STAGES)
+        threading.Thread(target=run_retrain_job, args=(job["id"], lock), daemon=True).start()
     except Exception as e:
+        lock.release()
         return jsonify({"error": str(e)}), 500
 
+    return jsonify({
+        "message": "Retraining started.",
+        "job_id": job["id"],
+        "status_url": f"/retrain/{job['id']}",
+    }), 202
+
+
+@app.route('/retrain/<job_id>', methods=['GET'])
+def retrain_status(job_id):
+    job = get_job(job_id)
+    if job is None or job["kind"] != "retrain":
+        return jsonify({"error": f"Unknown retraining job: {job_id}"}), 404
+    return jsonify(job), 200
+
+
 if __name__ == "__main__":
     app.run(debug=True)
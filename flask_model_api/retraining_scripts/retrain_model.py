@@ -1,120 +1,317 @@
 # retrain_model.py
 
 import os
+import sys
+import time
 import pandas as pd
-import joblib
 from datetime import datetime
-import numpy as np
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
-import umap
-import hdbscan
+from filelock import FileLock, Timeout
+from sklearn.preprocessing import StandardScaler
 
 # Define directory paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 BASE_DATA_DIR = os.path.join(BASE_DIR, "base_data")
-MODEL_DIR = os.path.join(BASE_DIR, "production_models")
 
-# Ensure required directories exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(BASE_DATA_DIR, exist_ok=True)
-os.makedirs(MODEL_DIR, exist_ok=True)
+# Shared modules (model_registry.py) live one folder up, next to app.py
+sys.path.append(os.path.dirname(BASE_DIR))
+from model_registry import (
+    load_models, load_artifact, publish_version, read_tuned_params, write_version_report, version_file_sizes,
+    REGISTRY_DIR,
+)
+from inference_bundle import build_inference_bundle
+from assignment import build_assigner, compare_engines, train_surrogate
+from features import engineer_features, make_encoder, encode_features, RowEncoder, verify_row_encoder
+from data_ingest import load_snapshots, filter_join_dates, file_sha256, DEFAULT_WORKERS, CLEANING_VERSION
+from fit_modes import (
+    fit_umap_full, fit_umap_incremental, fit_on_sample, fit_clusterer, clustering_summary, compare_runs,
+    INCREMENTAL_EPOCHS, SAMPLE_SIZE, ASSIGN_BATCH_SIZE,
+)
+from checkpoints import CheckpointStore, checkpoint_key
+from chunked_features import build_features_chunked
+from retrain_profiler import RetrainProfiler, print_profile, PROFILE_NAME
+
+MODEL_DIR = REGISTRY_DIR
+
+# "full" refits UMAP from scratch, "incremental" warm-starts it from the live model,
+# "sample" fits on a stratified sample and assigns the other rows (see fit_modes.py)
+RETRAIN_MODE = os.getenv("RETRAIN_MODE", "full")
+# Also run a full refit next to a non-full mode and report the quality/time delta
+COMPARE_FULL = os.getenv("RETRAIN_COMPARE_FULL", "0") == "1"
+
+# Save each stage's output so a failed or re-parameterised run resumes from it (see checkpoints.py)
+USE_CHECKPOINTS = os.getenv("RETRAIN_CHECKPOINTS", "1") == "1"
+
+# Build the feature matrix in two streaming passes into a float32 memmap instead of one dense
+# in-memory fit_transform (see chunked_features.py); for histories whose matrix does not fit in RAM.
+# Only the matrix is out of core: df_full and its engineered columns are still loaded in RAM.
+CHUNKED_FEATURES = os.getenv("RETRAIN_CHUNKED_FEATURES", "0") == "1"
+
+# Build the kNN cluster assigner ("knn" engine, see assignment.py) into the inference bundle.
+# Opt-in: it reads the whole training matrix once more (in chunks) and keeps its distinct rows.
+BUILD_ASSIGNER = os.getenv("RETRAIN_CLUSTER_ASSIGNER", "0") == "1"
+# Train the surrogate classifier ("surrogate" engine) and report its held-out fidelity (opt-in)
+BUILD_SURROGATE = os.getenv("RETRAIN_SURROGATE", "0") == "1"
+
+# Bump whenever features.py/build_features() change, so feature checkpoints are rebuilt
+FEATURES_VERSION = 2
+
+# Stages reported through run_retraining(progress=...), in order
+RETRAIN_STAGES = ["ingest", "clean", "encode", "umap", "hdbscan", "personas", "publish"]
+
+# Held for a whole retrain (API job, scheduler or CLI) so two runs never publish into production_models at once
+RETRAIN_LOCK_FILE = os.path.join(MODEL_DIR, "retrain.lock")
+
+# Exit code of the CLIs (retrain_model.py, drift_check.py --retrain) when another retrain holds the lock
+LOCK_BUSY_EXIT_CODE = 75
+
+
+# Create the data/model folders on first use (importing this module has no side effects)
+def ensure_dirs():
+    for folder in (UPLOAD_DIR, BASE_DATA_DIR, MODEL_DIR):
+        os.makedirs(folder, exist_ok=True)
 
-def run_retraining():
-    print("📄 Loading historical + new uploaded data...")
-    all_data = []
 
-    # Load base data from versioned folders
-    for folder in os.listdir(BASE_DATA_DIR):
+# Cross-process lock; thread_local=False so the API can acquire it in the request and release it from the job thread
+def retrain_lock():
+    ensure_dirs()
+    return FileLock(RETRAIN_LOCK_FILE, thread_local=False)
+
+
+def _no_progress(stage):
+    pass
+
+
+# Workbooks a retrain would read: (base_paths, upload_paths, upload_files)
+def list_workbooks():
+    ensure_dirs()
+    # Historical snapshots from versioned folders
+    base_paths = []
+    for folder in sorted(os.listdir(BASE_DATA_DIR)):
         folder_path = os.path.join(BASE_DATA_DIR, folder)
         if os.path.isdir(folder_path):
-            for file in os.listdir(folder_path):
+            for file in sorted(os.listdir(folder_path)):
                 if file.endswith(".xlsx"):
-                    df = pd.read_excel(os.path.join(folder_path, file))
-                    all_data.append(df)
-    
-    # Load newly uploaded Excel files
+                    base_paths.append(os.path.join(folder_path, file))
+
+    # Newly uploaded Excel files
     upload_files = [f for f in os.listdir(UPLOAD_DIR) if f.endswith(".xlsx")]
-    for file in upload_files:
-        df = pd.read_excel(os.path.join(UPLOAD_DIR, file))
-        all_data.append(df)
+    upload_paths = [os.path.join(UPLOAD_DIR, f) for f in upload_files]
+    return base_paths, upload_paths, upload_files
+
+
+# Read every base_data snapshot plus the pending uploads into one cleaned frame.
+# Returns (df_full, upload_files, ingest_report).
+def load_training_data(workers=None):
+    print("📄 Loading historical + new uploaded data...")
+
+    # Snapshots and uploads are read from the Parquet snapshot cache; only workbooks
+    # not seen before are parsed with pd.read_excel (see data_ingest.py)
+    base_paths, upload_paths, upload_files = list_workbooks()
+
+    # Parse + clean every workbook in a process pool, then concatenate once
+    ingest_start = time.perf_counter()
+    loaded = load_snapshots(base_paths + upload_paths, workers=workers)
+    all_data = [df for df, _ in loaded]
+    ingest_report = {
+        "workers": workers or DEFAULT_WORKERS,
+        "seconds": round(time.perf_counter() - ingest_start, 3),
+        "files": [
+            {
+                "file": os.path.relpath(info["source"], BASE_DIR),
+                "rows": info["rows"],
+                "cache": info["cache"],
+                "seconds": info["seconds"],
+            }
+            for _, info in loaded
+        ],
+    }
+    for file_info in ingest_report["files"]:
+        print(f"   {file_info['file']}: {file_info['rows']} rows in {file_info['seconds']}s (cache {file_info['cache']})")
 
     if not all_data:
         raise ValueError("❌ No data found in uploads or base_data.")
 
     df_full = pd.concat(all_data, ignore_index=True)
     print("✅ Total merged rows:", df_full.shape[0])
-    print("🧾 Sample Customer IDs:", df_full.iloc[:, 0].head())
-
-    # Normalize column names and resolve aliases
-    column_aliases = {
-        'Customer ID': ['customer id', 'customer_id', 'cust_id', 'id'],
-        'Gender': ['gender', 'sex'],
-        'Loyalty Tier': ['loyalty tier', 'loyalty_tier', 'tier', 'membership_level'],
-        'Date Joined': ['date joined', 'date_joined', 'joined_date', 'ks date', 'join_date'],
-        'Location': ['location', 'branch', 'region']
-    }
+    print("🧾 Sample Customer IDs:", df_full['Customer ID'].head())
 
-    df_full.columns = [col.strip().lower() for col in df_full.columns]
+    # Each snapshot is already cleaned per file; only cross-file steps remain
+    df_full.drop_duplicates(inplace=True)
+    df_full = filter_join_dates(df_full)
+    print("🧹 Cleaned data rows:", df_full.shape[0])
+    return df_full, upload_files, ingest_report
 
-    for standard_name, aliases in column_aliases.items():
-        found = None
-        for alias in aliases:
-            if alias.lower() in df_full.columns:
-                found = alias.lower()
-                break
-        if found:
-            df_full.rename(columns={found: standard_name}, inplace=True)
-        else:
-            raise ValueError(f"❌ Missing required column: {standard_name}")
 
-    # Data Cleaning & Preprocessing
-    df_full.drop_duplicates(inplace=True)
-    df_full.dropna(subset=['Customer ID', 'Gender', 'Loyalty Tier', 'Date Joined', 'Location'], inplace=True)
-    df_full['Date Joined'] = pd.to_datetime(df_full['Date Joined'], errors='coerce')
-    df_full = df_full[df_full['Date Joined'].notna() & (df_full['Date Joined'] <= pd.Timestamp.today())]
+# Add the engineered columns to df_full and fit the encoder/scaler on them.
+# Returns (encoder, scaler, X_combined, df_cat, df_num); X_combined is float32 (see features.py).
+def build_features(df_full):
+    print("🧠 Engineering features...")
+    df_cat, df_num = engineer_features(df_full)
 
-    df_full['Gender'] = df_full['Gender'].str.strip().str.title()
-    df_full['Location'] = df_full['Location'].str.strip().str.title()
-    df_full['Loyalty Tier'] = df_full['Loyalty Tier'].str.strip().str.title()
+    print("🔄 Fitting encoder and scaler...")
+    encoder = make_encoder().fit(df_cat)
+    scaler = StandardScaler().fit(df_num)
 
-    df_full = df_full[df_full['Loyalty Tier'].isin(['Silver', 'Gold', 'Platinum'])]
-    print("🧹 Cleaned data rows:", df_full.shape[0])
+    X_combined = encode_features(encoder, scaler, df_cat, df_num)
+    return encoder, scaler, X_combined, df_cat, df_num
 
-    print("🧠 Engineering features...")
-    df_full['Loyalty_Tier_Score'] = df_full['Loyalty Tier'].map({'Silver': 1, 'Gold': 2, 'Platinum': 3})
-    df_full['Join_Year'] = pd.to_datetime(df_full['Date Joined']).dt.year
-    df_full['Join_Month'] = pd.to_datetime(df_full['Date Joined']).dt.month
-    df_full['Join_Quarter'] = pd.to_datetime(df_full['Date Joined']).dt.quarter
 
-    categorical_cols = ['Location', 'Gender', 'Join_Year', 'Join_Month', 'Join_Quarter']
-    numerical_cols = ['Loyalty_Tier_Score']
-    df_cat = df_full[categorical_cols]
-    df_num = df_full[numerical_cols]
+# Check the serving fast path (features.RowEncoder) against sklearn on every distinct training row
+def check_row_encoder(encoder, scaler, df_cat, df_num):
+    try:
+        row_encoder = RowEncoder(encoder, scaler)
+    except ValueError as e:
+        return {"supported": False, "reason": str(e)}
+    distinct = pd.concat([df_cat, df_num], axis=1).drop_duplicates()
+    mismatches = verify_row_encoder(row_encoder, encoder, scaler, distinct[df_cat.columns], distinct[df_num.columns])
+    if mismatches:
+        print(f"⚠️ Row encoder differs from sklearn on {mismatches} distinct training rows")
+    return {"supported": True, "distinct_rows": len(distinct), "mismatched_rows": mismatches}
 
-    print("🔄 Fitting encoder and scaler...")
-    encoder = OneHotEncoder(handle_unknown='ignore', sparse_output=False)
-    scaled_cat = encoder.fit_transform(df_cat)
 
-    scaler = StandardScaler()
-    scaled_num = scaler.fit_transform(df_num)
+# UMAP/HDBSCAN parameters for the next fit: the live model's settings, overridden by the
+# winner of the last hyperparameter sweep if one was recorded (sweep_params.py)
+def training_params(previous, use_tuned=True):
+    umap_params = previous["umap_model"].get_params()
+    hdbscan_params = previous["clusterer"].get_params()
+    tuned = read_tuned_params() if use_tuned else None
+    if tuned:
+        print(f"🏆 Using tuned parameters from sweep {tuned['sweep_id']}")
+        umap_params.update(tuned["umap"])
+        hdbscan_params.update(tuned["hdbscan"])
+    return umap_params, hdbscan_params, tuned and tuned["sweep_id"]
+
 
-    X_combined = np.hstack([scaled_cat, scaled_num])
+# workers: processes used to parse and clean workbooks (default RETRAIN_WORKERS / CPU count)
+# mode: "full", "incremental" or "sample" (default RETRAIN_MODE); compare_full: also fit a full refit for the report
+# progress: called with each name in RETRAIN_STAGES as that stage starts (e.g. job_store.start_stage)
+# drift_report: the drift_check.check_drift() result that triggered this run, kept in the retrain report
+# chunked_features: build the feature matrix (only the matrix) out of core (default RETRAIN_CHUNKED_FEATURES)
+# use_checkpoints: resume stages from checkpoints/ when their inputs are unchanged (default RETRAIN_CHECKPOINTS)
+def run_retraining(workers=None, mode=None, compare_full=None, progress=_no_progress, drift_report=None,
+                   use_checkpoints=None, chunked_features=None):
+    mode = mode or RETRAIN_MODE
+    profiler = RetrainProfiler()
+    progress = profiler.wrap(progress or _no_progress)
+    compare_full = COMPARE_FULL if compare_full is None else compare_full
+    chunked_features = CHUNKED_FEATURES if chunked_features is None else chunked_features
+    checkpoints = CheckpointStore(enabled=USE_CHECKPOINTS if use_checkpoints is None else use_checkpoints)
+    report = {}
+    if drift_report is not None:
+        report["drift"] = drift_report
+
+    # The cleaned frame only depends on the content of the workbooks.
+    # ingest: list and fingerprint the workbooks; clean: parse + clean them, or load the clean checkpoint.
+    # "clean" is reported before the lookup so the stage shows up on checkpoint hits too.
+    progress("ingest")
+    base_paths, upload_paths, upload_files = list_workbooks()
+    clean_key = checkpoint_key(CLEANING_VERSION, sorted(file_sha256(path) for path in base_paths + upload_paths))
+    progress("clean")
+    df_full, _, report["ingest"] = checkpoints.cached(
+        "clean", clean_key, ("df_full", "upload_files", "ingest_report"), load_training_data, workers
+    )
+
+    profiler.set_rows(len(df_full))
+    progress("encode")
+    if chunked_features:
+        features_key = checkpoint_key(clean_key, FEATURES_VERSION, "chunked")
+        encoder, scaler, X_combined = checkpoints.cached(
+            "features", features_key, ("encoder", "scaler", "X_combined"),
+            build_features_chunked, base_paths + upload_paths, checkpoints.scratch_path("X_combined"),
+        )
+        if X_combined.shape[0] != len(df_full):
+            raise ValueError(f"❌ Chunked feature matrix has {X_combined.shape[0]} rows, cleaned data {len(df_full)}")
+    else:
+        features_key = checkpoint_key(clean_key, FEATURES_VERSION)
+        encoder, scaler, X_combined = checkpoints.cached(
+            "features", features_key, ("encoder", "scaler", "X_combined"),
+            lambda: build_features(df_full)[:3],
+        )
+    df_cat, df_num = engineer_features(df_full)
+    report["row_encoder"] = check_row_encoder(encoder, scaler, df_cat, df_num)
+    profiler.record_array("X_combined", X_combined)
 
     print("📦 Loading original UMAP and HDBSCAN parameters...")
-    old_umap = joblib.load(os.path.join(MODEL_DIR, "umap_model.pkl"))
-    old_clusterer = joblib.load(os.path.join(MODEL_DIR, "HDBSCAN_cluster_model.pkl"))
-    umap_params = old_umap.get_params()
-    hdbscan_params = old_clusterer.get_params()
+    previous = load_models()
+    umap_params, hdbscan_params, report["tuned_params_sweep"] = training_params(previous)
+
+    customer_ids = df_full['Customer ID'].to_numpy()
+    previous_ids = None
+    if mode == "incremental" and previous["manifest"] is not None:
+        previous_ids = load_artifact("training_customer_ids", previous["version"])
+    if mode == "incremental" and previous_ids is None:
+        print("⚠️ Previous model has no training Customer IDs, falling back to a full UMAP refit")
+        mode = "full"
 
-    # Refit UMAP with new data
-    new_umap = umap.UMAP(**umap_params)
-    X_embed = new_umap.fit_transform(X_combined)
+    # Refit UMAP and HDBSCAN with new data
+    progress("umap")
+    fit_start = time.perf_counter()
+    if mode == "sample":
+        print("🎯 Fitting on a stratified sample, assigning the remaining rows...")
+        # "sample_rows" in the key: checkpoints saved before the sample positions were stored are not reused
+        sample_key = checkpoint_key(features_key, mode, umap_params, hdbscan_params, SAMPLE_SIZE, ASSIGN_BATCH_SIZE,
+                                    "sample_rows")
+        new_umap, new_clusterer, X_embed, clusters, sample_rows, umap_info = checkpoints.cached(
+            "embedding", sample_key, ("umap_model", "clusterer", "embedding", "labels", "sample_rows", "info"),
+            fit_on_sample, X_combined, df_full, umap_params, hdbscan_params, progress=progress,
+        )
+        # Only the sample has a row in umap_model.embedding_
+        training_customer_ids = customer_ids[sample_rows]
+        print(f"⏱️ Fitted on {umap_info['sample_rows']} rows, assigned {umap_info['assigned_rows']} "
+              f"in {umap_info['assign_seconds']}s")
+    else:
+        training_customer_ids = customer_ids
+        if mode == "incremental":
+            print("♻️ Warm-starting UMAP from the previous embedding...")
+            previous["training_customer_ids"] = previous_ids
+            embedding_key = checkpoint_key(features_key, mode, umap_params, previous["version"], INCREMENTAL_EPOCHS)
+            new_umap, X_embed, umap_info = checkpoints.cached(
+                "embedding", embedding_key, ("umap_model", "embedding", "info"),
+                fit_umap_incremental, X_combined, customer_ids, df_cat, df_num, umap_params, previous,
+            )
+        else:
+            embedding_key = checkpoint_key(features_key, mode, umap_params)
+            new_umap, X_embed, umap_info = checkpoints.cached(
+                "embedding", embedding_key, ("umap_model", "embedding", "info"), fit_umap_full, X_combined, umap_params
+            )
+        print(f"⏱️ UMAP ({umap_info['mode']}) fitted in {umap_info['seconds']}s")
+        progress("hdbscan")
+        new_clusterer, clusters = checkpoints.cached(
+            "labels", checkpoint_key(embedding_key, hdbscan_params), ("clusterer", "labels"),
+            fit_clusterer, X_embed, hdbscan_params,
+        )
+    fit_seconds = round(time.perf_counter() - fit_start, 3)
+    report["checkpoints"] = checkpoints.outcomes
+    profiler.record_array("embedding", X_embed)
+    profiler.record_array("labels", clusters)
 
-    new_clusterer = hdbscan.HDBSCAN(**hdbscan_params)
-    clusters = new_clusterer.fit_predict(X_embed)
     df_full['cluster_id'] = clusters
+    report["umap"] = umap_info
+    report["fit_seconds"] = fit_seconds
+    report["clusters"] = clustering_summary(clusters)
+
+    if mode != "full":
+        if compare_full:
+            print("📏 Fitting a full refit for comparison...")
+            full_start = time.perf_counter()
+            _, full_embed, _ = fit_umap_full(X_combined, umap_params)
+            _, full_labels = fit_clusterer(full_embed, hdbscan_params)
+            report["comparison"] = compare_runs(
+                X_combined,
+                {"embedding": X_embed, "labels": clusters, "seconds": fit_seconds},
+                {"embedding": full_embed, "labels": full_labels,
+                 "seconds": round(time.perf_counter() - full_start, 3)},
+            )
+            print(f"📏 Saved {report['comparison']['seconds_saved']}s, "
+                  f"ARI vs full refit {report['comparison']['adjusted_rand_index']}")
+        else:
+            # Without a comparison run, estimate the saving from the previous full refit
+            previous_report = (previous["manifest"] or {}).get("metadata", {}).get("retrain_report", {})
+            if previous_report.get("umap", {}).get("mode") == "full" and "fit_seconds" in previous_report:
+                report["reference_full_fit_seconds"] = previous_report["fit_seconds"]
 
+    progress("personas")
     print("🧠 Generating cluster personas...")
     personas = {}
     for cluster_id in sorted(set(clusters)):
@@ -130,13 +327,54 @@ def run_retraining():
         }
         personas[cluster_id] = persona
 
-    print(" Saving updated models to model/...")
-    joblib.dump(new_umap, os.path.join(MODEL_DIR, "umap_model.pkl"))
-    joblib.dump(new_clusterer, os.path.join(MODEL_DIR, "HDBSCAN_cluster_model.pkl"))
-    joblib.dump(encoder, os.path.join(MODEL_DIR, "encoder.pkl"))
-    joblib.dump(scaler, os.path.join(MODEL_DIR, "scaler.pkl"))
-    joblib.dump(personas, os.path.join(MODEL_DIR, "cluster_personas.pkl"))
-    
+    progress("publish")
+    cluster_assigner = None
+    if BUILD_ASSIGNER:
+        cluster_assigner = build_assigner(X_combined, clusters)
+        report["assignment"] = compare_engines(X_combined, clusters, new_umap, new_clusterer)
+        report["assignment"]["distinct_training_rows"] = len(cluster_assigner.points)
+        print(f"🧭 kNN assigner agrees with approximate_predict on {report['assignment']['agreement']:.1%} "
+              f"of {report['assignment']['held_out_rows']} held-out rows, "
+              f"{report['assignment']['rows_per_second']['knn']} vs "
+              f"{report['assignment']['rows_per_second']['hdbscan']} rows/s")
+    cluster_surrogate = None
+    if BUILD_SURROGATE:
+        cluster_surrogate, report["surrogate"] = train_surrogate(X_combined, clusters, new_umap, new_clusterer)
+
+    print("📦 Exporting slim inference bundle...")
+    artifacts = {
+        "clusterer": new_clusterer,
+        "encoder": encoder,
+        "scaler": scaler,
+        "umap_model": new_umap,
+        "cluster_personas": personas,
+    }
+    artifacts["inference_bundle"] = build_inference_bundle(
+        **artifacts, cluster_assigner=cluster_assigner, cluster_surrogate=cluster_surrogate
+    )
+    # Lets the next incremental retrain find each customer's previous embedding
+    # (aligned with umap_model.embedding_, so only the sampled rows in sample mode)
+    artifacts["training_customer_ids"] = training_customer_ids
+
+    print(" Publishing updated models to the registry...")
+    version_id = publish_version(
+        artifacts,
+        metadata={
+            "trained_rows": int(df_full.shape[0]),
+            "n_clusters": int(len(set(clusters)) - (1 if -1 in clusters else 0)),
+            "previous_model": previous["version"],
+            "upload_files": upload_files,
+            "retrain_report": report,
+        },
+    )
+
+    profile = profiler.finish()
+    profile["mode"] = mode
+    profile["checkpoints"] = {stage: outcome["status"] for stage, outcome in checkpoints.outcomes.items()}
+    profile["artifacts"] = version_file_sizes(version_id)
+    write_version_report(version_id, PROFILE_NAME, profile)
+    print_profile(profile)
+
     # Move processed uploads to dated folder under base_data
     today = datetime.today().strftime("%Y-%m-%d")
     dated_folder = os.path.join(BASE_DATA_DIR, today)
@@ -147,9 +385,15 @@ def run_retraining():
         os.rename(src, dst)
 
     print(f"✅ Retraining complete. Uploads moved to {dated_folder}")
-    print(f"📦 Models saved to {MODEL_DIR}")
+    print(f"📦 Models published to {MODEL_DIR} as version {version_id}")
+    return version_id
 
 #python retrain_model.py
 if __name__ == "__main__":
-    run_retraining()
+    try:
+        with retrain_lock().acquire(timeout=0):
+            run_retraining()
+    except Timeout:
+        print(f"❌ Another retraining is running (lock held on {RETRAIN_LOCK_FILE})")
+        sys.exit(LOCK_BUSY_EXIT_CODE)
 
@@ -0,0 +1,188 @@
+import os
+import sys
+import time
+import platform
+import threading
+import tracemalloc
+import psutil
+
+# Shared modules (model_registry.py) live one folder up, next to app.py
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from model_registry import list_versions, read_version_report
+"""
+==========================
+RETRAIN PROFILER (retrain_profiler.py)
+==========================
+Measures where a retrain spends its time and memory, per stage of RETRAIN_STAGES
+(ingest, clean, encode, umap, hdbscan, personas, publish):
+
+    wall_seconds        elapsed time
+    cpu_seconds         user + system time of this process and of finished child processes
+                        (the parse/clean process pool); cpu_seconds / wall_seconds > 1 means parallel work
+    peak_rss_mb         highest resident memory seen while the stage ran (sampled every RSS_SAMPLE_SECONDS)
+    tracemalloc_peak_mb peak of Python-tracked allocations, numpy arrays included; only with RETRAIN_TRACEMALLOC=1
+                        because tracing every allocation about doubles the UMAP fit time
+    rows, rows_per_second
+
+plus the shape/dtype/size of the main matrices and the size of every file of the published version.
+A compare_full run (RETRAIN_COMPARE_FULL=1) is fitted after progress("hdbscan") and counts towards it.
+
+RetrainProfiler.wrap(progress) returns a progress callback, so the stage boundaries are the same
+progress("<stage>") calls that drive the job status in retrain_api. run_retraining() writes the result
+as profile.json into the version folder (model_registry.write_version_report).
+
+Used in: retrain_model.py
+
+Compare runs across versions (from retraining_scripts):
+    python retrain_profiler.py
+"""
+
+PROFILE_NAME = "profile.json"
+TRACE_MEMORY = os.getenv("RETRAIN_TRACEMALLOC", "0") == "1"
+RSS_SAMPLE_SECONDS = 0.05
+
+MB = 1024 * 1024
+
+
+def _cpu_seconds():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class _RssSampler(threading.Thread):
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        super().__init__(daemon=True)
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = self.process.memory_info().rss
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    # Peak since the last reset; the next window starts from the current RSS
+    def reset(self):
+        rss = self.process.memory_info().rss
+        peak, self.peak = max(self.peak, rss), rss
+        return peak
+
+
+class RetrainProfiler:
+    def __init__(self, trace_memory=TRACE_MEMORY):
+        self.trace_memory = trace_memory and not tracemalloc.is_tracing()
+        self.stages = {}
+        self.arrays = {}
+        self.rows = None
+        self.current = None
+        self._sampler = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.cpu_started = _cpu_seconds()
+        if self.trace_memory:
+            tracemalloc.start()
+        self._sampler = _RssSampler()
+        self._sampler.start()
+        return self
+
+    def _close_stage(self):
+        if self.current is None:
+            return
+        stage = self.stages[self.current]
+        stage["wall_seconds"] = round(time.perf_counter() - stage.pop("_wall"), 3)
+        stage["cpu_seconds"] = round(_cpu_seconds() - stage.pop("_cpu"), 3)
+        stage["peak_rss_mb"] = round(self._sampler.reset() / MB, 1)
+        if self.trace_memory:
+            stage["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / MB, 1)
+        rows = stage.setdefault("rows", self.rows)
+        if rows and stage["wall_seconds"]:
+            stage["rows_per_second"] = round(rows / stage["wall_seconds"], 1)
+        self.current = None
+
+    def begin(self, stage):
+        if self._sampler is None:
+            self.start()
+        self._close_stage()
+        self._sampler.reset()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        self.stages[stage] = {"_wall": time.perf_counter(), "_cpu": _cpu_seconds()}
+        self.current = stage
+
+    # Progress callback that also marks stage boundaries for the profiler
+    def wrap(self, progress):
+        def profiled_progress(stage):
+            self.begin(stage)
+            progress(stage)
+        return profiled_progress
+
+    # Rows processed by the current and later stages
+    def set_rows(self, rows):
+        self.rows = int(rows)
+        if self.current is not None:
+            self.stages[self.current]["rows"] = self.rows
+
+    def record_array(self, name, array):
+        self.arrays[name] = {
+            "shape": list(array.shape),
+            "dtype": str(array.dtype),
+            "mb": round(array.nbytes / MB, 2),
+        }
+
+    def finish(self):
+        self._close_stage()
+        if self.trace_memory:
+            tracemalloc.stop()
+        if self._sampler is not None:
+            self._sampler.stopped.set()
+        return {
+            "total_wall_seconds": round(time.perf_counter() - self.started, 3),
+            "total_cpu_seconds": round(_cpu_seconds() - self.cpu_started, 3),
+            "peak_rss_mb": max((s["peak_rss_mb"] for s in self.stages.values()), default=None),
+            "rows": self.rows,
+            "stages": self.stages,
+            "arrays": self.arrays,
+            "machine": {
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count(),
+                "memory_mb": round(psutil.virtual_memory().total / MB),
+            },
+        }
+
+
+def print_profile(profile):
+    print(f"⏱️ Retrain profile: {profile['total_wall_seconds']}s wall, {profile['total_cpu_seconds']}s CPU, "
+          f"peak RSS {profile['peak_rss_mb']} MB")
+    for name, stage in profile["stages"].items():
+        print(f"   {name:<9} {stage['wall_seconds']:>9}s wall {stage['cpu_seconds']:>9}s cpu "
+              f"{stage['peak_rss_mb']:>8} MB rss {stage.get('rows_per_second') or '-':>10} rows/s")
+
+
+# One line per published version that has a profile, oldest first
+def profile_history():
+    rows = []
+    for version_id in list_versions():
+        profile = read_version_report(version_id, PROFILE_NAME)
+        if profile is None:
+            continue
+        slowest = max(profile["stages"].items(), key=lambda item: item[1]["wall_seconds"])
+        rows.append({
+            "version": version_id,
+            "mode": profile.get("mode"),
+            "rows": profile["rows"],
+            "wall_seconds": profile["total_wall_seconds"],
+            "peak_rss_mb": profile["peak_rss_mb"],
+            "slowest_stage": f"{slowest[0]} ({slowest[1]['wall_seconds']}s)",
+            "artifacts_mb": round(sum(profile.get("artifacts", {}).values()) / MB, 1),
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    history = profile_history()
+    if not history:
+        print("No profiled model versions yet")
+        sys.exit(0)
+    for row in history:
+        print("  ".join(f"{key}={value}" for key, value in row.items()))
@@ -4,32 +4,292 @@ scheduler.py
 This script automates the model retraining process.
 
 How it works:
-- Runs daily at 2:00 AM server time.
-- Checks whether today is the 1st day of a new quarter (Jan, Apr, Jul, Oct).
-- If true, it calls `run_retraining()` to update clustering models and personas.
+- Every trigger has a cron expression (minute hour day-of-month month day-of-week, server time).
+  The default trigger runs daily at 2:00 AM: `python drift_check.py --retrain`, i.e. the drift check
+  (drift_check.py) and, only when a threshold is exceeded, `run_retraining()`.
+- Each run is a child process started with a lower CPU priority (RETRAIN_NICE), capped numba/BLAS
+  thread pools (RETRAIN_THREADS) and an optional address-space limit (RETRAIN_MAX_MEMORY_MB), so a
+  retrain does not starve the API running on the same machine.
+- The child takes the retrain lock (production_models/retrain.lock), so a scheduled run never overlaps
+  a retrain started from the API or the CLI; a run that finds the lock taken is recorded as "busy".
+- The last fire time of every trigger is kept in scheduler_state.json. After downtime the missed
+  windows are caught up with one run (not one per window), as long as the newest missed window is
+  younger than SCHEDULER_CATCHUP_HOURS.
+- Every run is appended to scheduler_history.jsonl (trigger, scheduled time, catch-up, exit code,
+  outcome, duration) and its output is kept in scheduler_logs/.
+- scheduler.lock makes sure only one scheduler daemon runs.
 
-This allows retraining to happen on a fixed quarterly schedule without manual intervention.
-To keep it running, this script must stay active in the background (e.g., using a process manager or cron with nohup).
+Usage (from retraining_scripts):
+    python scheduler.py                       # run the daemon (keep it alive with systemd/supervisor)
+    python scheduler.py --run-now [trigger]   # run a trigger once, right away
+    python scheduler.py --next                # show the next fire time of every trigger
+    python scheduler.py --history [n]         # show the last n runs
 """
 
-import schedule
+import os
+import sys
+import json
 import time
-from retrain_model import run_retraining
-from datetime import datetime
+import signal
+import argparse
+import subprocess
+from datetime import datetime, timedelta
+from filelock import FileLock, Timeout
 
-def should_retrain():
-    today = datetime.today()
-    return today.month in [1, 4, 7, 10] and today.day == 1  # Jan 1, Apr 1, Jul 1, Oct 1
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE = os.path.join(BASE_DIR, "scheduler_state.json")
+HISTORY_FILE = os.path.join(BASE_DIR, "scheduler_history.jsonl")
+LOG_DIR = os.path.join(BASE_DIR, "scheduler_logs")
+SCHEDULER_LOCK_FILE = os.path.join(BASE_DIR, "scheduler.lock")
 
-def job():
-    if should_retrain():
-        print(" Running scheduled retraining...")
-        run_retraining()
-    else:
-        print(" Not time yet. Waiting...")
+# Same value as retrain_model.LOCK_BUSY_EXIT_CODE (not imported: the daemon stays free of the ML stack)
+LOCK_BUSY_EXIT_CODE = 75
+
+TRIGGERS = {
+    "drift_retrain": {
+        "cron": os.getenv("RETRAIN_CRON", "0 2 * * *"),
+        "command": [sys.executable, os.path.join(BASE_DIR, "drift_check.py"), "--retrain"],
+    },
+}
+
+# Missed windows older than this are not caught up after downtime
+CATCHUP_HOURS = float(os.getenv("SCHEDULER_CATCHUP_HOURS", "168"))
+
+# Resource bounds for the retraining child process
+RETRAIN_NICE = int(os.getenv("RETRAIN_NICE", "10"))
+RETRAIN_THREADS = int(os.getenv("RETRAIN_THREADS", "0")) or max(1, (os.cpu_count() or 2) // 2)
+RETRAIN_MAX_MEMORY_MB = int(os.getenv("RETRAIN_MAX_MEMORY_MB", "0"))
+
+# Longest the daemon sleeps between checks, so state changes and signals are noticed
+POLL_SECONDS = 30
+
+CRON_FIELDS = [("minute", 0, 59), ("hour", 0, 23), ("day", 1, 31), ("month", 1, 12), ("weekday", 0, 7)]
+
+
+class CronSchedule:
+    """Five-field cron expression: numbers, *, lists (1,15), ranges (1-5) and steps (*/15, 0-30/10).
+    Weekday 0 (or 7) is Sunday. As in cron, when both day and weekday are restricted either may match."""
+
+    def __init__(self, expression):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"❌ Cron expression needs 5 fields, got {expression!r}")
+        self.expression = expression
+        self.fields = {name: self._parse_field(part, low, high, name)
+                       for part, (name, low, high) in zip(parts, CRON_FIELDS)}
+        if 7 in self.fields["weekday"]:
+            self.fields["weekday"].add(0)
+        # cron only ORs day and weekday when both are restricted (fields starting with * are not)
+        self.day_restricted = not parts[2].startswith("*")
+        self.weekday_restricted = not parts[4].startswith("*")
+
+    @staticmethod
+    def _parse_field(field, low, high, name):
+        values = set()
+        for item in field.split(","):
+            base, _, step = item.partition("/")
+            if base == "*":
+                start, end = low, high
+            elif "-" in base:
+                start, end = (int(v) for v in base.split("-"))
+            else:
+                start = int(base)
+                end = high if step else start
+            if start < low or end > high or start > end:
+                raise ValueError(f"❌ Cron {name} value out of range: {item!r}")
+            values.update(range(start, end + 1, int(step or 1)))
+        return values
+
+    def _day_matches(self, moment):
+        day = moment.day in self.fields["day"]
+        weekday = (moment.weekday() + 1) % 7 in self.fields["weekday"]
+        if self.day_restricted and self.weekday_restricted:
+            return day or weekday
+        return day and weekday
+
+    # First fire time strictly after `moment`
+    def next_after(self, moment):
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366 * 5)
+        while candidate < limit:
+            if candidate.month not in self.fields["month"] or not self._day_matches(candidate):
+                candidate = (candidate + timedelta(days=1)).replace(hour=0, minute=0)
+            elif candidate.hour not in self.fields["hour"]:
+                candidate = (candidate + timedelta(hours=1)).replace(minute=0)
+            elif candidate.minute not in self.fields["minute"]:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        raise ValueError(f"❌ Cron expression never fires: {self.expression!r}")
+
+    # Fire times in (start, end]
+    def fire_times_between(self, start, end):
+        times = []
+        moment = self.next_after(start)
+        while moment <= end:
+            times.append(moment)
+            moment = self.next_after(moment)
+        return times
+
+
+def _read_state():
+    if not os.path.exists(STATE_FILE):
+        return {}
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+
+def _write_state(state):
+    tmp_path = STATE_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, STATE_FILE)
+
+
+def _append_history(entry):
+    with open(HISTORY_FILE, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+def read_history(limit=20):
+    if not os.path.exists(HISTORY_FILE):
+        return []
+    with open(HISTORY_FILE) as f:
+        return [json.loads(line) for line in f if line.strip()][-limit:]
+
+
+# Runs in the child between fork and exec: lower its priority and cap its memory (POSIX only)
+def _limit_resources():
+    import resource
+    os.nice(RETRAIN_NICE)
+    if RETRAIN_MAX_MEMORY_MB:
+        limit = RETRAIN_MAX_MEMORY_MB * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
 
-schedule.every().day.at("02:00").do(job)  # Run daily check at 8 AM
 
-while True:
-    schedule.run_pending()
-    time.sleep(60)
+def _priority_kwargs():
+    if os.name == "nt":
+        # Windows has no nice/rlimit; start the child with below-normal priority instead
+        return {"creationflags": subprocess.BELOW_NORMAL_PRIORITY_CLASS}
+    return {"preexec_fn": _limit_resources}
+
+
+def _child_env():
+    env = dict(os.environ)
+    for name in ("NUMBA_NUM_THREADS", "OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        env[name] = str(RETRAIN_THREADS)
+    env["RETRAIN_WORKERS"] = env.get("RETRAIN_WORKERS") or str(RETRAIN_THREADS)
+    return env
+
+
+def _outcome(returncode):
+    if returncode == 0:
+        return "ok"
+    if returncode == LOCK_BUSY_EXIT_CODE:
+        return "busy"
+    return "failed"
+
+
+def run_trigger(name, scheduled_for=None, catch_up=False, missed=0):
+    trigger = TRIGGERS[name]
+    started = datetime.now()
+    os.makedirs(LOG_DIR, exist_ok=True)
+    log_path = os.path.join(LOG_DIR, f"{started.strftime('%Y%m%dT%H%M%S')}-{name}.log")
+
+    print(f"🕒 Running {name} (scheduled for {scheduled_for or 'now'}{', catch-up' if catch_up else ''})")
+    with open(log_path, "w") as log:
+        returncode = subprocess.call(
+            trigger["command"], cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT,
+            env=_child_env(), **_priority_kwargs(),
+        )
+
+    entry = {
+        "trigger": name,
+        "scheduled_for": scheduled_for.isoformat() if scheduled_for else None,
+        "started_at": started.isoformat(timespec="seconds"),
+        "seconds": round((datetime.now() - started).total_seconds(), 1),
+        "catch_up": catch_up,
+        "missed_windows": missed,
+        "returncode": returncode,
+        "outcome": _outcome(returncode),
+        "log": os.path.relpath(log_path, BASE_DIR),
+    }
+    _append_history(entry)
+    print(f"{'✅' if entry['outcome'] == 'ok' else '⚠️'} {name} finished: {entry['outcome']} in {entry['seconds']}s")
+    return entry
+
+
+# Run every trigger whose window passed since its last fire (several missed windows -> one run)
+def run_due(now=None):
+    now = now or datetime.now()
+    state = _read_state()
+    entries = []
+    for name, trigger in TRIGGERS.items():
+        schedule = CronSchedule(trigger["cron"])
+        last = state.get(name)
+        if last is None:
+            # First start: begin counting from now rather than replaying the past
+            state[name] = now.isoformat()
+            _write_state(state)
+            continue
+
+        due = schedule.fire_times_between(datetime.fromisoformat(last), now)
+        if not due:
+            continue
+        newest = due[-1]
+        catch_up = now - newest > timedelta(seconds=2 * POLL_SECONDS)
+        if catch_up and now - newest > timedelta(hours=CATCHUP_HOURS):
+            print(f"⏭️ Skipping {len(due)} missed {name} window(s), newest {newest} is older than {CATCHUP_HOURS}h")
+            _append_history({"trigger": name, "scheduled_for": newest.isoformat(), "catch_up": True,
+                             "missed_windows": len(due), "outcome": "skipped_stale"})
+        else:
+            entries.append(run_trigger(name, newest, catch_up=catch_up, missed=len(due) - 1))
+
+        state[name] = newest.isoformat()
+        _write_state(state)
+    return entries
+
+
+def seconds_until_next(now=None):
+    now = now or datetime.now()
+    next_fire = min(CronSchedule(t["cron"]).next_after(now) for t in TRIGGERS.values())
+    return max(1.0, (next_fire - now).total_seconds())
+
+
+def serve():
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stopping.append(True))
+
+    try:
+        lock = FileLock(SCHEDULER_LOCK_FILE).acquire(timeout=0)
+    except Timeout:
+        print(f"❌ Another scheduler is already running (lock held on {SCHEDULER_LOCK_FILE})")
+        sys.exit(1)
+
+    with lock:
+        print("🕒 Scheduler started:", ", ".join(f"{n} [{t['cron']}]" for n, t in TRIGGERS.items()))
+        while not stopping:
+            run_due()
+            time.sleep(min(POLL_SECONDS, seconds_until_next()))
+    print("🛑 Scheduler stopped")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cron-style scheduler for drift checks and retraining")
+    parser.add_argument("--run-now", nargs="?", const="drift_retrain", metavar="TRIGGER")
+    parser.add_argument("--next", action="store_true")
+    parser.add_argument("--history", nargs="?", const=20, type=int, metavar="N")
+    args = parser.parse_args()
+
+    if args.run_now:
+        sys.exit(run_trigger(args.run_now)["returncode"])
+    elif args.next:
+        now = datetime.now()
+        for name, trigger in TRIGGERS.items():
+            print(f"{name} [{trigger['cron']}]: {CronSchedule(trigger['cron']).next_after(now)}")
+    elif args.history is not None:
+        for entry in read_history(args.history):
+            print(json.dumps(entry))
+    else:
+        serve()
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import umap
+import hdbscan
+from retrain_model import load_training_data, build_features, training_params, BASE_DIR
+from model_registry import load_models, record_tuned_params
+from data_ingest import DEFAULT_WORKERS
+"""
+==========================
+HYPERPARAMETER SWEEP (sweep_params.py)
+==========================
+Replaces the manual tuning notebooks (08-11_HDBSCAN_tuned_*) with one command that scores a grid of
+UMAP x HDBSCAN settings on the current training data and records the winner in the model registry.
+
+1. The training matrix is built exactly like retrain_model.py does (load_training_data + build_features)
+   and saved once to embedding_cache/X-<fingerprint>.npy, so worker processes memory-map it.
+2. Every UMAP setting in the grid is fitted once, in a process pool. Embeddings are cached on disk
+   under embedding_cache/<key>.npy, keyed by the data fingerprint and the UMAP parameters, so a
+   re-run (or a grid that only adds HDBSCAN settings) reuses them. After each sweep the least recently
+   used entries (hits touch their files) are deleted until the directory is under SWEEP_CACHE_MAX_MB.
+3. Every HDBSCAN setting is fitted on every cached embedding, again in the pool, and scored:
+       relative_validity   HDBSCAN's fast DBCV approximation (higher is better)
+       noise_fraction      share of customers labelled -1 (they get no persona)
+       seconds             UMAP fit (from the cache entry) + HDBSCAN fit
+4. Candidates with noise above --max-noise or fewer than 2 clusters are discarded; the rest are ranked
+   by relative validity, then runtime. The winner goes to production_models/tuned_params.json and
+   the whole table to production_models/sweeps/<sweep_id>.json (model_registry.record_tuned_params).
+   The next run_retraining() uses the tuned settings instead of the live model's get_params().
+
+Run from retraining_scripts:
+    python sweep_params.py                         # default grid
+    python sweep_params.py --grid my_grid.json     # {"umap": {...: [...]}, "hdbscan": {...: [...]}}
+    python sweep_params.py --workers 4 --max-noise 0.2 --no-record
+"""
+
+EMBEDDING_CACHE_DIR = os.path.join(BASE_DIR, "embedding_cache")
+EMBEDDING_CACHE_MAX_BYTES = int(float(os.getenv("SWEEP_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+# Rows of the training matrix hashed at a time by _fingerprint
+FINGERPRINT_CHUNK_ROWS = 65536
+
+# Ranges explored in the tuning notebooks
+DEFAULT_GRID = {
+    "umap": {
+        "n_neighbors": [15, 30, 80],
+        "min_dist": [0.0, 0.1],
+    },
+    "hdbscan": {
+        "min_cluster_size": [50, 150, 400],
+        "min_samples": [5, 15],
+        "cluster_selection_method": ["eom", "leaf"],
+    },
+}
+
+# Candidates labelling more than this share of customers as noise are not eligible
+MAX_NOISE_FRACTION = float(os.getenv("SWEEP_MAX_NOISE", "0.3"))
+
+
+def expand_grid(grid):
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+
+# Hashed FINGERPRINT_CHUNK_ROWS rows at a time, so a memmapped matrix is never copied whole
+def _fingerprint(X):
+    digest = hashlib.sha256()
+    for start in range(0, X.shape[0], FINGERPRINT_CHUNK_ROWS):
+        digest.update(memoryview(np.ascontiguousarray(X[start:start + FINGERPRINT_CHUNK_ROWS])))
+    digest.update(str(X.shape).encode())
+    return digest.hexdigest()[:16]
+
+
+def _embedding_key(data_fingerprint, umap_params):
+    params = json.dumps(umap_params, sort_keys=True, default=str)
+    return hashlib.sha256(f"{data_fingerprint}|{params}".encode()).hexdigest()[:16]
+
+
+def _meta_path(embedding_path):
+    return embedding_path[:-len(".npy")] + ".json"
+
+
+# A cache entry is only a hit when the embedding and its sidecar were both written
+# (entries left by runs that died between the two writes are refitted)
+def _is_cached(embedding_path):
+    return os.path.exists(embedding_path) and os.path.exists(_meta_path(embedding_path))
+
+
+# Mark a cache file as just used, so the budget evicts it last
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+# Delete least recently used entries (an embedding with its sidecar, or a training matrix) until
+# cache_dir fits in max_bytes; returns the number deleted
+def enforce_cache_budget(cache_dir=EMBEDDING_CACHE_DIR, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = {}
+    for name in os.listdir(cache_dir):
+        if ".tmp" in name:  # still being written
+            continue
+        try:
+            stat = os.stat(os.path.join(cache_dir, name))
+        except FileNotFoundError:
+            continue
+        stem = name.rsplit(".", 1)[0]
+        last_used, size, names = entries.get(stem, (0.0, 0, []))
+        entries[stem] = (max(last_used, stat.st_mtime), size + stat.st_size, names + [name])
+
+    total = sum(size for _, size, _ in entries.values())
+    deleted = 0
+    for last_used, size, names in sorted(entries.values()):
+        if total <= max_bytes:
+            break
+        for name in names:
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except OSError:  # already deleted by another sweep
+                pass
+        total -= size
+        deleted += 1
+    if deleted:
+        print(f"🧹 Evicted {deleted} embedding cache entries ({total / 1024 / 1024:.1f} MB left)")
+    return deleted
+
+
+def _embed_task(x_path, umap_params, embedding_path):
+    X = np.load(x_path, mmap_mode="r")
+    start = time.perf_counter()
+    embedding = umap.UMAP(**umap_params).fit_transform(X)
+    seconds = round(time.perf_counter() - start, 3)
+
+    # Sidecar first, both replaced atomically: an .npy on disk always has a complete .json next to it
+    meta_path = _meta_path(embedding_path)
+    tmp_meta_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_meta_path, "w") as f:
+        json.dump({"umap": umap_params, "seconds": seconds, "rows": int(X.shape[0])}, f, indent=2, default=str)
+    os.replace(tmp_meta_path, meta_path)
+    tmp_path = embedding_path[:-len(".npy")] + f".{os.getpid()}.tmp.npy"
+    np.save(tmp_path, embedding.astype(np.float32))
+    os.replace(tmp_path, embedding_path)
+    return seconds
+
+
+def _cluster_task(embedding_path, hdbscan_params):
+    embedding = np.load(embedding_path, mmap_mode="r")
+    start = time.perf_counter()
+    clusterer = hdbscan.HDBSCAN(**hdbscan_params).fit(embedding)
+    seconds = round(time.perf_counter() - start, 3)
+    labels = clusterer.labels_
+    return {
+        "n_clusters": int(len(set(labels)) - (1 if -1 in labels else 0)),
+        "noise_fraction": round(float((labels == -1).mean()), 4),
+        "relative_validity": round(float(clusterer.relative_validity_), 4),
+        "hdbscan_seconds": seconds,
+    }
+
+
+def _map(workers, fn, *iterables):
+    if workers == 1:
+        return list(map(fn, *iterables))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(fn, *iterables))
+
+
+# Eligible candidates first (by relative validity, then runtime), then the rejected ones
+def rank_candidates(results, max_noise=MAX_NOISE_FRACTION):
+    for result in results:
+        scores = result["scores"]
+        result["eligible"] = scores["n_clusters"] >= 2 and scores["noise_fraction"] <= max_noise
+    return sorted(results, key=lambda r: (not r["eligible"], -r["scores"]["relative_validity"], r["scores"]["seconds"]))
+
+
+def run_sweep(grid=None, workers=None, max_noise=MAX_NOISE_FRACTION, record=True, cache_dir=None):
+    grid = grid or DEFAULT_GRID
+    workers = workers or DEFAULT_WORKERS
+    cache_dir = cache_dir or EMBEDDING_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+
+    df_full, _, _ = load_training_data()
+    _, _, X, _, _ = build_features(df_full)
+    base_umap, base_hdbscan, _ = training_params(load_models(), use_tuned=False)
+    # Only the clustering itself is scored; the prediction data is not needed for that
+    base_hdbscan.update(prediction_data=False, gen_min_span_tree=True)
+
+    fingerprint = _fingerprint(X)
+    x_path = os.path.join(cache_dir, f"X-{fingerprint}.npy")
+    if os.path.exists(x_path):
+        _touch(x_path)
+    else:
+        np.save(x_path, X)
+
+    umap_grid = expand_grid(grid.get("umap", {}))
+    hdbscan_grid = expand_grid(grid.get("hdbscan", {}))
+    print(f"🔍 Sweeping {len(umap_grid)} UMAP x {len(hdbscan_grid)} HDBSCAN settings "
+          f"on {X.shape[0]} rows with {workers} workers")
+
+    # Stage 1: one embedding per UMAP setting, reused from the cache when possible
+    embeddings = []
+    for umap_setting in umap_grid:
+        key = _embedding_key(fingerprint, {**base_umap, **umap_setting})
+        embeddings.append({"umap": umap_setting, "path": os.path.join(cache_dir, f"{key}.npy")})
+    missing = [e for e in embeddings if not _is_cached(e["path"])]
+    for e in embeddings:
+        if e not in missing:
+            _touch(e["path"])
+            _touch(_meta_path(e["path"]))
+    print(f"🗺️ {len(embeddings) - len(missing)} embeddings cached, fitting {len(missing)}")
+    _map(min(workers, len(missing) or 1), _embed_task,
+         [x_path] * len(missing), [{**base_umap, **e["umap"]} for e in missing], [e["path"] for e in missing])
+    for e in embeddings:
+        with open(_meta_path(e["path"])) as f:
+            e["seconds"] = json.load(f)["seconds"]
+
+    # Stage 2: every HDBSCAN setting on every embedding
+    pairs = [(e, h) for e in embeddings for h in hdbscan_grid]
+    scores = _map(min(workers, len(pairs) or 1), _cluster_task,
+                  [e["path"] for e, _ in pairs], [{**base_hdbscan, **h} for _, h in pairs])
+
+    results = []
+    for (e, h), score in zip(pairs, scores):
+        score["umap_seconds"] = e["seconds"]
+        score["seconds"] = round(e["seconds"] + score["hdbscan_seconds"], 3)
+        results.append({"umap": e["umap"], "hdbscan": h, "scores": score})
+    results = rank_candidates(results, max_noise)
+    enforce_cache_budget(cache_dir)
+
+    for r in results:
+        s = r["scores"]
+        print(f"{'✅' if r['eligible'] else '  '} validity {s['relative_validity']:>7} noise {s['noise_fraction']:>6} "
+              f"clusters {s['n_clusters']:>3} {s['seconds']:>8}s  {r['umap']} {r['hdbscan']}")
+
+    winner = results[0] if results and results[0]["eligible"] else None
+    if winner is None:
+        print("⚠️ No candidate passed the noise/cluster-count limits; nothing recorded")
+    elif record:
+        record_tuned_params(winner, results)
+    return winner, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a grid of UMAP/HDBSCAN settings on the training data")
+    parser.add_argument("--grid", help="JSON file with {'umap': {param: [values]}, 'hdbscan': {param: [values]}}")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-noise", type=float, default=MAX_NOISE_FRACTION)
+    parser.add_argument("--no-record", action="store_true", help="only print the ranking")
+    args = parser.parse_args()
+
+    grid = None
+    if args.grid:
+        with open(args.grid) as f:
+            grid = json.load(f)
+    winner, _ = run_sweep(grid, args.workers, args.max_noise, record=not args.no_record)
+    sys.exit(0 if winner else 1)
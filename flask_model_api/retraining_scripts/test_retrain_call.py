@@ -1,3 +1,4 @@
+import time
 import requests
 
 url = 'http://127.0.0.1:5000/retrain'
@@ -9,3 +10,14 @@ with open(file_path, 'rb') as f:
 
 print(response.status_code)
 print(response.json())
+
+# Retraining runs in the background; poll the job until it has finished
+if response.status_code == 202:
+    status_url = 'http://127.0.0.1:5000' + response.json()['status_url']
+    while True:
+        job = requests.get(status_url).json()
+        print(job['status'], job['stage'])
+        if job['status'] not in ('queued', 'running'):
+            break
+        time.sleep(5)
+    print(job['result'] or job['error'])
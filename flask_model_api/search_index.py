@@ -0,0 +1,193 @@
+import heapq
+import numba
+import numpy as np
+from pynndescent.rp_trees import select_side
+from pynndescent.distances import squared_euclidean
+from pynndescent.utils import make_heap, siftdown, simple_heap_push, tau_rand_int, mark_visited, check_and_mark_visited
+"""
+==========================
+SEARCH INDEX (search_index.py)
+==========================
+umap_model.transform() finds the training neighbours of new rows with the pynndescent index UMAP
+keeps from fit (umap_model._knn_search_index). The index is pickled already prepared (search graph
+and search tree), but NNDescent.__setstate__ builds its search function as a numba closure over those
+arrays and compiles it on every load. Closures cannot go into the numba disk cache, so each process
+paid about two seconds per bundle load, before the first query.
+
+PreparedSearchIndex holds the same arrays and searches them with _search_kernel, a module-level
+numba function declared with cache=True. Loading it is plain unpickling, and with NUMBA_CACHE_DIR set
+(app.py) the kernel is compiled once per machine instead of once per load.
+
+    PreparedSearchIndex.from_nndescent(index)   copy what the search reads out of a fitted NNDescent
+    .query(query_data, k, epsilon)             same signature and result as NNDescent.query
+    prepare_search_index(index, sample)        PreparedSearchIndex, or None when unsupported/different
+
+The kernel is pynndescent's search_closure for the dense, unquantized euclidean case (what UMAP builds
+for this feature matrix): tree descent for the initial candidates, random fill-up, then greedy graph
+search, with the same float32 arithmetic and random state. prepare_search_index() checks on training
+rows that it returns the same neighbours and distances as NNDescent.query and returns None otherwise,
+so the bundle keeps the NNDescent (see inference_bundle.slim_umap).
+
+Used in: inference_bundle.py (slim_umap), bench_transform.py
+
+Benchmark (pynndescent vs prepared index): python bench_transform.py
+"""
+
+# Training rows queried by prepare_search_index() to compare both indexes
+VERIFY_SAMPLE_ROWS = 256
+
+
+@numba.njit(
+    fastmath=True,
+    locals={
+        "i": numba.types.uint32,
+        "j": numba.types.uint32,
+        "node": numba.types.uint32,
+        "candidate": numba.types.int32,
+        "vertex": numba.types.int32,
+        "d": numba.types.float32,
+        "d_vertex": numba.types.float32,
+        "distance_bound": numba.types.float32,
+    },
+    cache=True,
+)
+def _search_kernel(query_points, k, epsilon, hyperplanes, offsets, children, tree_indices,
+                   indptr, indices, data, n_neighbors, min_distance, rng_state):
+    result = make_heap(query_points.shape[0], k)
+    internal_rng_state = np.copy(rng_state)
+    visited = np.zeros(data.shape[0] // 8 + 1, dtype=np.uint8)
+
+    for i in range(query_points.shape[0]):
+        visited[:] = 0
+        current_query = query_points[i]
+        heap_priorities = result[1][i]
+        heap_indices = result[0][i]
+        seed_set = [(np.float32(np.inf), np.int32(-1)) for j in range(0)]
+
+        # Init from the search tree
+        node = 0
+        while children[node, 0] > 0:
+            if select_side(hyperplanes[node], offsets[node], current_query, internal_rng_state) == 0:
+                node = children[node, 0]
+            else:
+                node = children[node, 1]
+        candidate_indices = tree_indices[-children[node, 0]:-children[node, 1]]
+
+        n_initial_points = candidate_indices.shape[0]
+        for j in range(n_initial_points):
+            candidate = candidate_indices[j]
+            d = np.float32(squared_euclidean(current_query, data[candidate]))
+            simple_heap_push(heap_priorities, heap_indices, d, candidate)
+            heapq.heappush(seed_set, (d, candidate))
+            mark_visited(visited, candidate)
+
+        # Random samples if the leaf was too small
+        n_random_samples = min(k, n_neighbors) - n_initial_points
+        for j in range(max(n_random_samples, 0)):
+            candidate = np.int32(np.abs(tau_rand_int(internal_rng_state)) % data.shape[0])
+            if check_and_mark_visited(visited, candidate) == 0:
+                d = np.float32(squared_euclidean(current_query, data[candidate]))
+                simple_heap_push(heap_priorities, heap_indices, d, candidate)
+                heapq.heappush(seed_set, (d, candidate))
+
+        # Greedy search of the graph
+        distance_bound = heap_priorities[0] + (epsilon * (heap_priorities[0] - min_distance))
+        d_vertex, vertex = heapq.heappop(seed_set)
+        while d_vertex < distance_bound:
+            for j in range(indptr[vertex], indptr[vertex + 1]):
+                candidate = indices[j]
+                if check_and_mark_visited(visited, candidate) == 0:
+                    d = np.float32(squared_euclidean(current_query, data[candidate]))
+                    if d < distance_bound:
+                        simple_heap_push(heap_priorities, heap_indices, d, candidate)
+                        heapq.heappush(seed_set, (d, candidate))
+                        distance_bound = heap_priorities[0] + (epsilon * (heap_priorities[0] - min_distance))
+            if len(seed_set) == 0:
+                break
+            d_vertex, vertex = heapq.heappop(seed_set)
+
+    # Heap -> increasing distance (pynndescent.utils.deheap_sort)
+    result_indices, result_distances = result[0], result[1]
+    for i in range(result_indices.shape[0]):
+        for j in range(result_indices.shape[1] - 1, 0, -1):
+            result_indices[i, 0], result_indices[i, j] = result_indices[i, j], result_indices[i, 0]
+            result_distances[i, 0], result_distances[i, j] = result_distances[i, j], result_distances[i, 0]
+            siftdown(result_distances[i, :j], result_indices[i, :j], 0)
+    return result_indices, result_distances
+
+
+class PreparedSearchIndex:
+    def __init__(self, hyperplanes, offsets, children, tree_indices, indptr, indices, data,
+                 vertex_order, n_neighbors, min_distance, rng_state, angular_trees=False):
+        self.hyperplanes = hyperplanes
+        self.offsets = offsets
+        self.children = children
+        self.tree_indices = tree_indices
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.vertex_order = vertex_order
+        self.n_neighbors = int(n_neighbors)
+        self.min_distance = float(min_distance)
+        self.rng_state = rng_state
+        self._angular_trees = angular_trees  # read by umap_model.transform to pick epsilon
+
+    # Raises ValueError for indexes _search_kernel does not reproduce
+    @classmethod
+    def from_nndescent(cls, index):
+        if index._is_sparse or index.metric not in ("euclidean", "l2") or len(index._dist_args):
+            raise ValueError(f"❌ Prepared search index only supports dense euclidean, not {index.metric!r}")
+        if getattr(index, "quantization", None) is not None or index._bit_trees:
+            raise ValueError("❌ Prepared search index does not support quantized indexes")
+        if not index.tree_init or index.parallel_batch_queries:
+            raise ValueError("❌ Prepared search index needs tree_init and serial queries")
+        if not hasattr(index, "_search_graph"):
+            index.prepare()
+
+        tree = index._search_forest[0]
+        return cls(
+            hyperplanes=np.ascontiguousarray(tree.hyperplanes, dtype=np.float32),
+            offsets=np.ascontiguousarray(tree.offsets, dtype=np.float32),
+            children=np.ascontiguousarray(tree.children, dtype=np.int32),
+            tree_indices=np.ascontiguousarray(tree.indices, dtype=np.int32),
+            indptr=np.ascontiguousarray(index._search_graph.indptr, dtype=np.int32),
+            indices=np.ascontiguousarray(index._search_graph.indices, dtype=np.int32),
+            data=np.ascontiguousarray(index._raw_data, dtype=np.float32),
+            vertex_order=np.asarray(index._vertex_order),
+            n_neighbors=index.n_neighbors,
+            min_distance=index._min_distance,
+            rng_state=np.array(index.search_rng_state, dtype=np.int64),
+            angular_trees=index._angular_trees,
+        )
+
+    def query(self, query_data, k=10, epsilon=0.1):
+        query_data = np.asarray(query_data).astype(np.float32, order="C")
+        indices, dists = _search_kernel(
+            query_data, k, epsilon, self.hyperplanes, self.offsets, self.children, self.tree_indices,
+            self.indptr, self.indices, self.data, self.n_neighbors, self.min_distance, self.rng_state,
+        )
+        return self.vertex_order[indices], np.sqrt(dists)
+
+
+# Number of query rows where the two indexes return different neighbours or distances (0 = identical)
+def verify_search_index(prepared, index, query_data, k, epsilon):
+    expected_indices, expected_dists = index.query(query_data, k=k, epsilon=epsilon)
+    indices, dists = prepared.query(query_data, k=k, epsilon=epsilon)
+    differs = (expected_indices != indices) | (expected_dists.view(np.uint32) != dists.view(np.uint32))
+    return int(differs.any(axis=1).sum())
+
+
+# PreparedSearchIndex for a fitted NNDescent, or None when it cannot reproduce index.query exactly.
+# sample: rows to compare on (UMAP training rows); k/epsilon as umap_model.transform queries them.
+def prepare_search_index(index, sample, k, epsilon):
+    try:
+        prepared = PreparedSearchIndex.from_nndescent(index)
+    except (ValueError, AttributeError) as e:
+        print(f"⚠️ Prepared search index not available, keeping the pynndescent index: {e}")
+        return None
+    sample = np.asarray(sample[:VERIFY_SAMPLE_ROWS], dtype=np.float32)
+    mismatches = verify_search_index(prepared, index, sample, k, epsilon)
+    if mismatches:
+        print(f"⚠️ Prepared search index differs from pynndescent on {mismatches} rows, keeping the pynndescent index")
+        return None
+    return prepared
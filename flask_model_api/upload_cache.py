@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import pandas as pd
+"""
+==========================
+UPLOAD CACHE (upload_cache.py)
+==========================
+Marketers often re-upload the same workbook with the same campaign inputs, and /upload-excel would
+parse it, cluster it and call the AI once per cluster all over again. The upload cache keeps two kinds
+of entries under upload_cache/ (UPLOAD_CACHE_DIR):
+
+    clustering-<key>.pkl     the parsed upload with engineered columns and cluster_id
+                             key: sha256 of the file, model version, upload assignment engine
+    results-<key>.ndjson     a header line (row/cluster counts), then one generated cluster result per line
+                             key: the clustering key + campaign inputs
+
+So an identical upload is answered from results-*, and the same file with other campaign inputs reuses
+clustering-* and only generates the posts. A new model version or engine never reuses old entries.
+Results are only stored when every cluster's post was generated (ResultWriter.commit), so a failed AI
+call is retried by the next upload.
+
+Entries are written to a temp file and renamed, so concurrent workers never read half an entry. After
+each write the oldest entries (by last use: hits touch their file) are deleted until the directory is
+under UPLOAD_CACHE_MAX_MB. UPLOAD_CACHE_MAX_MB=0 turns the cache off.
+
+Used in: app.py (/upload-excel)
+"""
+
+CACHE_DIR = os.getenv("UPLOAD_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "upload_cache"))
+MAX_BYTES = int(float(os.getenv("UPLOAD_CACHE_MAX_MB", "256")) * 1024 * 1024)
+ENABLED = MAX_BYTES > 0
+
+ENTRY_PREFIXES = ("clustering-", "results-")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def clustering_key(file_sha, model_version, engine):
+    return _key("clustering", file_sha, model_version, engine)
+
+
+def results_key(clustering_key, campaign_inputs):
+    return _key("results", clustering_key, campaign_inputs)
+
+
+def _entry_path(kind, key, ext):
+    return os.path.join(CACHE_DIR, f"{kind}-{key}.{ext}")
+
+
+# Mark an entry as just used, so the budget evicts it last
+def _touch(path):
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+# Parsed upload with cluster_id, or None on a miss
+def load_clustering(key):
+    path = _entry_path("clustering", key, "pkl")
+    if not ENABLED or not os.path.exists(path):
+        return None
+    try:
+        df = pd.read_pickle(path)
+    except (OSError, EOFError, ValueError) as e:  # evicted or cut short meanwhile
+        print(f"⚠️ Ignoring unreadable upload cache entry {os.path.basename(path)}: {e}")
+        return None
+    _touch(path)
+    return df
+
+
+def save_clustering(key, df):
+    if not ENABLED:
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _entry_path("clustering", key, "pkl")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+    enforce_budget()
+
+
+# (header, iterator of cluster results) of a cached results entry, or None on a miss.
+# The file is opened here, so the entry can be evicted while its lines are still being read.
+def read_results(key):
+    path = _entry_path("results", key, "ndjson")
+    if not ENABLED:
+        return None
+    try:
+        f = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    header = json.loads(f.readline())
+    _touch(path)
+
+    def cluster_results():
+        with f:
+            for line in f:
+                yield json.loads(line)
+    return header, cluster_results()
+
+
+# Writes one results entry line by line; nothing is visible to readers until commit()
+class ResultWriter:
+    # header: JSON-ready dict; the cluster results are passed to write() already serialized
+    def __init__(self, key, header):
+        self.path = _entry_path("results", key, "ndjson")
+        self.tmp_path = f"{self.path}.{os.getpid()}.{id(self)}.tmp"
+        self._file = None
+        if ENABLED:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self._file = open(self.tmp_path, "w", encoding="utf-8")
+            self.write(json.dumps(header))
+
+    def write(self, line):
+        if self._file is not None:
+            self._file.write(line + "\n")
+
+    def commit(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.replace(self.tmp_path, self.path)
+        enforce_budget()
+
+    # Drop the entry unless it was committed
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.remove(self.tmp_path)
+
+
+# Delete least recently used entries until the cache fits in MAX_BYTES; returns the number deleted
+def enforce_budget(max_bytes=None):
+    max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.startswith(ENTRY_PREFIXES) or name.endswith(".tmp"):
+            continue
+        try:
+            stat = os.stat(os.path.join(CACHE_DIR, name))
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, name))
+
+    total = sum(size for _, size, _ in entries)
+    deleted = 0
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+        except OSError:  # already evicted by another worker, or still open (Windows)
+            continue
+        total -= size
+        deleted += 1
+    if deleted:
+        print(f"🧹 Evicted {deleted} upload cache entries ({total / 1024 / 1024:.1f} MB left)")
+    return deleted
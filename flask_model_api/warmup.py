@@ -0,0 +1,86 @@
+import time
+import threading
+from generate import get_cluster_label
+"""
+==========================
+MODEL WARMUP (warmup.py)
+==========================
+The first umap_model.transform() in a fresh process JIT-compiles UMAP's numba kernels and prepares
+the pynndescent search function, which made the first /generate-promo after a deploy take seconds
+longer than the rest. run_warmup() pushes one synthetic customer through the full get_cluster_label
+path (encoder -> scaler -> UMAP -> approximate_predict) so that cost is paid before traffic arrives.
+
+app.py sets NUMBA_CACHE_DIR before umap/hdbscan are imported, but only functions declared with
+cache=True are stored there: pynndescent's trees/utils and this repo's own kernels
+(search_index._search_kernel). UMAP's transform kernels (smooth_knn_dist,
+compute_membership_strengths, the optimize_layout epoch functions) are not disk-cached and are
+compiled again in every new process, so the first transform after a restart still takes seconds
+(4.5-10 s measured with a populated cache). The disk cache does not remove that cold-start cost;
+the warmup only moves it before traffic: /ready answers 503 until run_warmup() has called
+transform() in this process.
+
+Modes (MODEL_WARMUP env var, used by app.py):
+    sync        warm up while app.py is imported (default; with gunicorn preload this happens once in
+                the master and the compiled code is inherited by every forked worker)
+    background  warm up in a thread, /ready answers 503 until it has finished
+    off         no warmup
+
+Used in: app.py (start_warmup, WARMUP_STATE for the /ready route)
+"""
+
+# Shared readiness state, reported by the /ready route
+WARMUP_STATE = {
+    "status": "pending",          # pending | running | ready | skipped | failed
+    "model_version": None,
+    "first_call_seconds": None,
+    "second_call_seconds": None,
+    "error": None,
+}
+
+
+# Build a valid get_cluster_label input from the first fitted category of every encoded column
+def synthetic_user_input(encoder):
+    location, gender, join_year, join_month, join_quarter = [cats[0] for cats in encoder.categories_]
+    return {
+        "location": location,
+        "gender": gender,
+        "join_year": int(join_year),
+        "join_month": int(join_month),
+        "join_quarter": int(join_quarter),
+        "loyalty_tier": "Silver",
+    }
+
+
+def run_warmup(models, state=WARMUP_STATE):
+    state["status"] = "running"
+    state["model_version"] = models.get("version")
+    try:
+        user_input = synthetic_user_input(models["encoder"])
+        timings = []
+        for _ in range(2):
+            start = time.perf_counter()
+            get_cluster_label(
+                user_input, models["clusterer"], models["encoder"], models["scaler"], models["umap_model"],
+                models.get("row_encoder"),
+            )
+            timings.append(round(time.perf_counter() - start, 4))
+
+        state["first_call_seconds"], state["second_call_seconds"] = timings
+        state["status"] = "ready"
+        print(f"🔥 Model warmup done: first call {timings[0]}s, second call {timings[1]}s")
+    except Exception as e:
+        state["status"] = "failed"
+        state["error"] = str(e)
+        print(f"❌ Model warmup failed: {e}")
+    return state
+
+
+def start_warmup(models, mode="sync", state=WARMUP_STATE):
+    if mode == "off":
+        state["status"] = "skipped"
+        state["model_version"] = models.get("version")
+    elif mode == "background":
+        threading.Thread(target=run_warmup, args=(models, state), daemon=True).start()
+    else:
+        run_warmup(models, state)
+    return state